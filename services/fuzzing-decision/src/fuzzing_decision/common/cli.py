@@ -33,6 +33,18 @@ def build_cli_parser(*args, **kwargs):
         help="A git revision for the fuzzing git repository",
         default=os.environ.get("FUZZING_GIT_REVISION"),
     )
+    parser.add_argument(
+        "--snapshot-dir",
+        type=pathlib.Path,
+        help="Directory used to cache compiled snapshots of the Fuzzing configuration",
+        default=os.environ.get("FUZZING_SNAPSHOT_DIR"),
+    )
+    parser.add_argument(
+        "--git-cache-dir",
+        type=pathlib.Path,
+        help="Directory used to keep mirrors of the cloned git repositories",
+        default=os.environ.get("FUZZING_GIT_CACHE_DIR"),
+    )
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
         "--quiet",
@@ -5,16 +5,26 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import abc
+import bisect
+import collections
+import copy
+import fnmatch
 import itertools
+import json
 import logging
+import math
+import os
 import pathlib
 import re
+import threading
 import types
 from datetime import datetime, timedelta, timezone
 
 import dateutil.parser
 import yaml
 
+from .timing import timings
+
 LOG = logging.getLogger(__name__)
 
 # fields that must exist in pool.yml (once flattened), and their types
@@ -26,16 +36,20 @@ COMMON_FIELD_TYPES = types.MappingProxyType(
         "container": (str, dict),
         "cores_per_task": int,
         "cpu": str,
+        "cpu_affinity": str,
         "cycle_time": (int, str),
         "disk_size": (int, str),
         "imageset": str,
         "macros": dict,
         "max_run_time": (int, str),
+        "memory_limit": (int, str),
         "metal": bool,
         "minimum_memory_per_core": (float, str),
         "name": str,
+        "numa_node": (int, str),
         "platform": str,
         "preprocess": str,
+        "preprocess_cache": list,
         "schedule_start": (datetime, str),
         "scopes": list,
         "tasks": int,
@@ -62,6 +76,24 @@ CPU_ALIASES = types.MappingProxyType(
 )
 PROVIDERS = frozenset(("aws", "gcp"))
 ARCHITECTURES = frozenset(("x64", "arm64"))
+SNAPSHOT_VERSION = 3
+# range of each cron field: second, minute, hour, day of month, month, day of week
+CRON_FIELD_RANGES = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+# warn when a pool schedule needs more cron patterns than this
+CRON_WARN_PATTERNS = 100
+# time assumed between a hook firing, and its decision task cancelling the previous
+# tasks and creating new ones
+PLAN_DECISION_TIME = 5 * 60
+# period simulated by the capacity planner
+PLAN_DURATION = 7 * 24 * 60 * 60
+# optional files of the fuzzing configuration used by every pool, like machines.yml
+SHARED_CONFIG_FILES = ("launch-configs.yml", "spot-prices.yml")
+# values of the placement fields (cpu_affinity, numa_node, memory_limit) chosen by
+# fuzzing-pool-launch from cores_per_task, or disabling them
+PLACEMENT_AUTO = "auto"
+PLACEMENT_NONE = "none"
+# private artifact of decision tasks, holding the launch parameters of their pool
+LAUNCH_PARAMS_ARTIFACT = "project/fuzzing/private/launch-params.json"
 
 
 def parse_size(size):
@@ -86,6 +118,26 @@ def parse_size(size):
     return result * multiplier
 
 
+def parse_cpu_list(cpus):
+    """Parse a list of CPUs like "0-3,8" (the format of Linux cpulist files)
+
+    Args:
+        cpus (str): comma separated CPU numbers or inclusive ranges
+
+    Returns:
+        list of int: sorted CPU numbers
+    """
+    result = set()
+    for part in cpus.split(","):
+        match = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", part)
+        assert match is not None, f"invalid CPU list: {cpus!r}"
+        low = int(match.group(1))
+        high = int(match.group(2) or low)
+        assert low <= high, f"invalid CPU range: {part.strip()!r}"
+        result.update(range(low, high + 1))
+    return sorted(result)
+
+
 def parse_time(time):
     """Parse a human readable time like 1h30m or 30m10s
 
@@ -120,16 +172,32 @@ def parse_time(time):
 
 
 class MachineTypes:
-    """Database of all machine types available, by provider and architecture."""
+    """Database of all machine types available, by provider and architecture.
 
-    def __init__(self, machines_data):
+    Args:
+        machines_data (dict): provider -> architecture -> machine type -> spec
+        prices (dict): provider -> machine type -> hourly price, from an offline
+                       price snapshot. These take precedence over the `price` in
+                       machine specs.
+    """
+
+    def __init__(self, machines_data, prices=None):
+        for provider, provider_prices in (prices or {}).items():
+            assert provider in PROVIDERS, f"unknown provider in prices: {provider}"
+            for machine, price in provider_prices.items():
+                assert isinstance(
+                    price, (int, float)
+                ), f"price of {provider}.{machine} should be a number"
+        self._prices = prices or {}
         for provider, provider_archs in machines_data.items():
             assert provider in PROVIDERS, f"unknown provider: {provider}"
             for arch, machines in provider_archs.items():
                 assert arch in ARCHITECTURES, f"unknown architecture: {provider}.{arch}"
                 for machine, spec in machines.items():
                     missing = list({"cpu", "ram"} - set(spec))
-                    extra = list(set(spec) - {"cpu", "ram", "metal", "zone_blacklist"})
+                    extra = list(
+                        set(spec) - {"cpu", "ram", "metal", "price", "zone_blacklist"}
+                    )
                     assert not missing, (
                         f"machine {provider}.{arch}.{machine} missing required keys: "
                         f"{missing!r}"
@@ -140,21 +208,61 @@ class MachineTypes:
                     )
         self._data = machines_data
 
+        # index machines by (provider, architecture, cpu, metal), sorted by ram per cpu
+        # a metal machine is also suitable when metal isn't required
+        index = {}
+        for provider, provider_archs in machines_data.items():
+            for arch, machines in provider_archs.items():
+                for name, spec in machines.items():
+                    # machines are matched on exact cpu count, so each fits one task
+                    entry = (
+                        spec["ram"] / spec["cpu"],
+                        (name, 1, frozenset(spec.get("zone_blacklist", []))),
+                    )
+                    for metal in {False, spec.get("metal", False)}:
+                        key = (provider, arch, spec["cpu"], metal)
+                        index.setdefault(key, []).append(entry)
+        self._index = {}
+        for key, entries in index.items():
+            entries.sort(key=lambda entry: entry[0])
+            ram_per_cpu, machines = zip(*entries)
+            self._index[key] = (ram_per_cpu, machines)
+
     @classmethod
-    def from_file(cls, machines_yml):
+    def from_file(cls, machines_yml, prices_yml=None):
         assert machines_yml.is_file()
-        return cls(yaml.safe_load(machines_yml.read_text()))
+        prices = None
+        if prices_yml is not None:
+            prices = yaml.safe_load(prices_yml.read_text())
+        return cls(yaml.safe_load(machines_yml.read_text()), prices)
 
     def cpus(self, provider, architecture, machine):
         return self._data[provider][architecture][machine]["cpu"]
 
+    def price(self, provider, architecture, machine):
+        """Get the hourly price of a machine type
+
+        Args:
+            provider (str): the cloud provider (aws or gcp)
+            architecture (str): the cpu architecture (x64 or arm64)
+            machine (str): machine type name
+
+        Returns:
+            float: price from the price snapshot, or from machines.yml, or None if
+                   unknown
+        """
+        price = self._prices.get(provider, {}).get(machine)
+        if price is None:
+            price = self._data[provider][architecture][machine].get("price")
+        return price
+
     def zone_blacklist(self, provider, architecture, machine):
         return frozenset(
             self._data[provider][architecture][machine].get("zone_blacklist", [])
         )
 
     def filter(self, provider, architecture, min_cpu, min_ram_per_cpu, metal=False):
-        """Generate machine types which fit the given requirements.
+        """Find machine types which fit the given requirements.
 
         Args:
             provider (str): the cloud provider (aws or google)
@@ -164,15 +272,778 @@ class MachineTypes:
             metal (bool): whether a bare-metal instance is required
 
         Returns:
-            generator of str: machine type names for the given provider/architecture
+            tuple of machine (name, capacity, zone_blacklist): machine type names for
+                the given provider/architecture, their task capacity, and zones where
+                they are not available. Sorted by ram per cpu.
+        """
+        if architecture not in self._data[provider]:
+            raise KeyError(architecture)
+        ram_per_cpu, machines = self._index.get(
+            (provider, architecture, min_cpu, bool(metal)), ((), ())
+        )
+        return machines[bisect.bisect_left(ram_per_cpu, min_ram_per_cpu) :]
+
+
+def _cron_field(values, low, high):
+    """Format a set of values as a cron field, as briefly as possible
+
+    Args:
+        values (set of int): values matched by the field
+        low (int): minimum value of the field
+        high (int): maximum value of the field
+
+    Returns:
+        str: cron field
+    """
+    values = sorted(values)
+    if values == list(range(low, high + 1)):
+        return "*"
+
+    # list of values, with runs of 3 or more collapsed into ranges
+    parts = []
+    start = prev = values[0]
+    for value in values[1:] + [None]:
+        if value is not None and value == prev + 1:
+            prev = value
+            continue
+        if prev - start >= 2:
+            parts.append(f"{start}-{prev}")
+        else:
+            parts.extend(str(part) for part in range(start, prev + 1))
+        start = prev = value
+    result = ",".join(parts)
+
+    # a single step expression
+    if len(values) >= 3:
+        step = values[1] - values[0]
+        if values == list(range(values[0], values[-1] + 1, step)):
+            stepped = f"{values[0]}-{values[-1]}/{step}"
+            if len(stepped) < len(result):
+                result = stepped
+    return result
+
+
+def compile_crons(times):
+    """Find a small set of cron patterns matching exactly the given times
+
+    Times which only differ by one field are merged into a single pattern matching
+    all the values of that field, repeatedly for each field.
+
+    Args:
+        times (iterable of tuple): fields of each time (second, minute, hour, day of
+                                   month, month, day of week), or None for fields
+                                   matching any value
+
+    Returns:
+        list of str: cron patterns, in order of the first time each one matches
+    """
+    entries = [
+        tuple(None if value is None else frozenset((value,)) for value in time)
+        for time in dict.fromkeys(times)
+    ]
+    varying = [
+        field
+        for field in range(len(CRON_FIELD_RANGES))
+        if len({entry[field] for entry in entries}) > 1
+    ]
+    # the result depends on the order fields are merged in, try a few
+    orders = [varying[i:] + varying[:i] for i in range(len(varying))]
+    orders += [order[::-1] for order in orders]
+    best = entries
+    for order in orders:
+        merged = entries
+        while True:
+            size = len(merged)
+            for field in order:
+                groups = {}
+                for entry in merged:
+                    key = entry[:field] + entry[field + 1 :]
+                    groups.setdefault(key, set()).update(entry[field])
+                merged = [
+                    key[:field] + (frozenset(values),) + key[field:]
+                    for key, values in groups.items()
+                ]
+            if len(merged) == size:
+                break
+        if len(merged) < len(best):
+            best = merged
+
+    return [
+        " ".join(
+            "*" if values is None else _cron_field(values, low, high)
+            for values, (low, high) in zip(entry, CRON_FIELD_RANGES)
+        )
+        for entry in best
+    ]
+
+
+def _cron_values(field):
+    """Expand a cron field into the values it matches
+
+    Args:
+        field (str): cron field, as generated by `compile_crons`
+
+    Returns:
+        set of int: values matched, or None for any value
+    """
+    if field == "*":
+        return None
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+        if "-" in part:
+            first, last = (int(value) for value in part.split("-"))
+        else:
+            first = last = int(part)
+        values.update(range(first, last + 1, step))
+    return values
+
+
+def cron_times(crons, start, stop):
+    """Find the times matched by cron patterns
+
+    Args:
+        crons (iterable of str): cron patterns (second, minute, hour, day of month,
+                                 month, day of week)
+        start (datetime): first time included
+        stop (datetime): first time excluded
+
+    Returns:
+        list of datetime: times matched by any pattern, sorted
+    """
+    patterns = []
+    for cron in crons:
+        fields = [_cron_values(field) for field in cron.split()]
+        patterns.append(
+            [
+                sorted(range(low, high + 1)) if values is None else sorted(values)
+                for values, (low, high) in zip(fields[:3], CRON_FIELD_RANGES)
+            ]
+            + fields[3:]
+        )
+    result = set()
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < stop:
+        weekday = day.isoweekday() % 7
+        for seconds, minutes, hours, days, months, weekdays in patterns:
+            if months is not None and day.month not in months:
+                continue
+            # like cron, either day field matches when both are restricted
+            if days is not None and weekdays is not None:
+                if day.day not in days and weekday not in weekdays:
+                    continue
+            elif days is not None and day.day not in days:
+                continue
+            elif weekdays is not None and weekday not in weekdays:
+                continue
+            for hour, minute, second in itertools.product(hours, minutes, seconds):
+                time = day.replace(hour=hour, minute=minute, second=second)
+                if start <= time < stop:
+                    result.add(time)
+        day += timedelta(days=1)
+    return sorted(result)
+
+
+def plan_capacity(pools, machine_types, start, decision_time=PLAN_DECISION_TIME):
+    """Simulate the schedule of worker pools, to find the capacity they really use
+
+    Each time a hook fires, its decision task runs for `decision_time`, then
+    cancels the tasks of the previous cycle and creates new ones, which run for up
+    to `max_run_time` (after the preprocess task, if any).
+
+    Args:
+        pools (list of PoolConfiguration or PoolConfigMap): worker pools
+        machine_types (MachineTypes): database of all machine types
+        start (datetime): start of the simulated period (`PLAN_DURATION` long)
+        decision_time (int): seconds a decision task runs before creating tasks
+
+    Returns:
+        list of dict: for each pool, its "peak" number of instances running at once,
+                      and "timeline", a list of (time, instances, cores) for each
+                      change in the number of instances running. Pools which can't
+                      be simulated (eg. no machine type matches them) have an
+                      "error" instead.
+    """
+    stop = start + timedelta(seconds=PLAN_DURATION)
+    decision = timedelta(seconds=decision_time)
+    result = []
+    for pool in pools:
+        try:
+            result.append(_plan_pool(pool, machine_types, start, stop, decision))
+        except Exception as exc:
+            LOG.warning(f"Failed to plan the capacity of {pool.pool_id}: {exc!r}")
+            result.append({"error": str(exc) or type(exc).__name__})
+    return result
+
+
+def _plan_pool(pool, machine_types, start, stop, decision):
+    """Simulate the schedule of one worker pool (see `plan_capacity`)"""
+    if isinstance(pool, PoolConfigMap):
+        applied = pool.pools
+    else:
+        applied = [pool]
+    machine, capacity, _ = next(iter(pool.get_machine_list(machine_types)))
+    cpus = machine_types.cpus(pool.cloud, pool.cpu, machine)
+
+    # (preprocess run time, tasks run time, instances) of each applied pool
+    groups = []
+    for config in applied:
+        preprocess = config.create_preprocess()
+        groups.append(
+            (
+                timedelta(seconds=0 if preprocess is None else preprocess.max_run_time),
+                timedelta(seconds=config.max_run_time),
+                math.ceil(config.tasks / capacity),
+            )
+        )
+    # tasks of the cycle before the simulated period may still be running
+    lookback = decision + max(pre + run for pre, run, _ in groups)
+    fires = cron_times(pool.cycle_crons(), start - lookback, stop)
+
+    events = collections.Counter()
+    for fire, next_fire in zip(fires, fires[1:] + [stop + lookback]):
+        created = fire + decision
+        cancelled = next_fire + decision
+        events[fire] += 1
+        events[created] -= 1
+        for pre, run, instances in groups:
+            if pre:
+                events[created] += 1
+                events[min(created + pre, cancelled)] -= 1
+            if created + pre < cancelled:
+                events[created + pre] += instances
+                events[min(created + pre + run, cancelled)] -= instances
+
+    timeline = [(start, 0, 0)]
+    running = 0
+    for time in sorted(events):
+        if time >= stop:
+            break
+        running += events[time]
+        if time <= start:
+            timeline[0] = (start, running, running * cpus)
+        else:
+            timeline.append((time, running, running * cpus))
+    return {
+        "peak": max(instances for _, instances, _ in timeline),
+        "timeline": timeline,
+    }
+
+
+def peak_usage(timelines):
+    """Find the peak usage of several pools running at the same time
+
+    Args:
+        timelines (iterable of list): timelines returned by `plan_capacity`
+
+    Returns:
+        tuple (int, int): peak number of instances and cores running at once
+    """
+    events = collections.defaultdict(lambda: [0, 0])
+    for timeline in timelines:
+        previous = (0, 0)
+        for time, instances, cores in timeline:
+            events[time][0] += instances - previous[0]
+            events[time][1] += cores - previous[1]
+            previous = (instances, cores)
+    peak = [0, 0]
+    running = [0, 0]
+    for time in sorted(events):
+        running = [total + delta for total, delta in zip(running, events[time])]
+        peak = [max(values) for values in zip(peak, running)]
+    return tuple(peak)
+
+
+def _json_default(obj):
+    # YAML parses timestamps (eg. schedule_start) as datetime
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class PoolConfigResolver:
+    """Cache of parsed pool YAML and flattened parent configurations.
+
+    A single resolver can be shared by every pool loaded from the same configuration
+    directory, so that each file is parsed once, and each parent is flattened once,
+    no matter how many pools inherit from it.
+    """
+
+    def __init__(self):
+        self._data = {}
+        # path -> (mtime, size) of the files loaded from disk
+        self._stats = {}
+        self._parents = {}
+        # path -> (flattened data, ancestors) of parents loaded from a snapshot
+        self._flattened = {}
+        self._resolving = set()
+        # (cycle_time, schedule_start) -> list of cron patterns
+        self.crons = {}
+
+    def exists(self, pool_yml):
+        """Check whether a file is either cached, or exists on disk.
+
+        Args:
+            pool_yml (Path): path to the YAML file
+
+        Returns:
+            bool: True if the file can be loaded
+        """
+        return pool_yml in self._data or pool_yml.is_file()
+
+    def glob(self, config_dir, pattern):
+        """Find files in a configuration directory, including cached files.
+
+        Args:
+            config_dir (Path): configuration directory
+            pattern (str): glob pattern for file names
+
+        Returns:
+            list of Path: matching files, sorted by name
+        """
+        found = {
+            path
+            for path in self._data
+            if path.parent == config_dir and fnmatch.fnmatchcase(path.name, pattern)
+        }
+        found.update(config_dir.glob(pattern))
+        return sorted(found)
+
+    def load(self, pool_yml):
+        """Load the YAML data for a pool file.
+
+        Args:
+            pool_yml (Path): path to the pool YAML file
+
+        Returns:
+            dict: a copy of the parsed data, safe to be modified by the caller
+        """
+        return copy.deepcopy(self._parse(pool_yml))
+
+    def _parse(self, pool_yml):
+        """Get the cached YAML data for a file, which must not be modified"""
+        if pool_yml not in self._data:
+            assert pool_yml.is_file(), f"Missing config file {pool_yml}"
+            stat = pool_yml.stat()
+            with timings.phase("parse_yaml"):
+                self._data[pool_yml] = yaml.safe_load(pool_yml.read_text())
+            self._stats[pool_yml] = (stat.st_mtime_ns, stat.st_size)
+        return self._data[pool_yml]
+
+    def dependencies(self, pool_yml):
+        """Find the configuration files a pool file is built from, without
+        flattening it.
+
+        This follows the `parents`, `preprocess` and `apply_to` fields of each file
+        as written, so it may find files which end up overridden, but none used to
+        build the pool are missed.
+
+        Args:
+            pool_yml (Path): path to the pool YAML file
+
+        Returns:
+            dict: path of each file -> its YAML data, which must not be modified
+        """
+        result = {}
+        pending = [pool_yml]
+        while pending:
+            path = pending.pop()
+            if path in result:
+                continue
+            data = result[path] = self._parse(path)
+            references = itertools.chain(
+                data.get("parents") or (), data.get("apply_to") or ()
+            )
+            if data.get("preprocess"):
+                references = itertools.chain(references, [data["preprocess"]])
+            pending.extend(path.parent / f"{name}.yml" for name in references)
+        return result
+
+    def validate(self, cls, data, pool_yml=None):
+        """Check pool data against the fields of a configuration class.
+
+        Results for data loaded unmodified from a file on disk are cached for that
+        version of the file, so it is only validated once per process.
+
+        Args:
+            cls (type): pool configuration class
+            data (dict): pool data
+            pool_yml (Path): file the data was loaded from, if unmodified
+
+        Returns:
+            tuple of str: every error found in the data
+        """
+        validator = cls.validator()
+        if pool_yml not in self._stats:
+            return validator.validate(data)
+        return validator.validate(data, key=(pool_yml,) + self._stats[pool_yml])
+
+    def resolve(self, cls, pool_yml):
+        """Get the flattened configuration for a parent pool file.
+
+        Args:
+            cls (type): pool configuration class to instantiate
+            pool_yml (Path): path to the parent pool YAML file
+
+        Returns:
+            tuple (CommonPoolConfiguration, frozenset): the flattened parent, and the
+                pool ids of all its ancestors
+        """
+        key = (cls, pool_yml)
+        if key not in self._parents and pool_yml in self._flattened:
+            data, ancestors = self._flattened[pool_yml]
+            parent = cls(
+                pool_yml.stem,
+                copy.deepcopy(data),
+                base_dir=pool_yml.parent,
+                resolver=self,
+                _flattened=set(),
+            )
+            self._parents[key] = (parent, ancestors)
+        if key not in self._parents:
+            assert key not in self._resolving, (
+                f"attempt to resolve cyclic configuration, {pool_yml.stem} already "
+                "encountered"
+            )
+            self._resolving.add(key)
+            try:
+                ancestors = set()
+                with timings.phase("flatten"):
+                    parent = cls.from_file(
+                        pool_yml, resolver=self, _flattened=ancestors
+                    )
+            finally:
+                self._resolving.discard(key)
+            self._parents[key] = (parent, frozenset(ancestors))
+        return self._parents[key]
+
+    @classmethod
+    def compile(cls, config_dir):
+        """Load every pool in a configuration directory, and all the files they
+        reference.
+
+        Args:
+            config_dir (Path): fuzzing configuration directory
+
+        Returns:
+            PoolConfigResolver: resolver with all the configuration cached
+        """
+        resolver = cls()
+        resolver.load(config_dir / "machines.yml")
+        for name in SHARED_CONFIG_FILES:
+            if (config_dir / name).is_file():
+                resolver.load(config_dir / name)
+        for pool_yml in config_dir.glob("pool*.yml"):
+            pool_config = PoolConfigLoader.from_file(pool_yml, resolver=resolver)
+            if isinstance(pool_config, PoolConfigMap):
+                pools = pool_config.pools
+            else:
+                pools = [pool_config]
+            for pool in pools:
+                pool.create_preprocess()
+                if pool.schedule_start is not None:
+                    list(pool.cycle_crons())
+        return resolver
+
+    def save_snapshot(self, path, revision):
+        """Write the cached configuration to a snapshot file.
+
+        Parents are also written flattened, next to the data of their files, so
+        loading the snapshot doesn't require flattening them again.
+
+        Args:
+            path (Path): snapshot file to write
+            revision (str): git revision of the configuration
+        """
+        parents = {}
+        for (_, pool_yml), (parent, ancestors) in self._parents.items():
+            data = parent.as_data()
+            data["parents"] = []
+            parents[pool_yml.name] = {"ancestors": sorted(ancestors), "data": data}
+        for pool_yml, (data, ancestors) in self._flattened.items():
+            parents.setdefault(
+                pool_yml.name, {"ancestors": sorted(ancestors), "data": data}
+            )
+        snapshot = {
+            "crons": [
+                [cycle_time, schedule_start, crons]
+                for (cycle_time, schedule_start), crons in self.crons.items()
+            ],
+            "files": {pool_yml.name: data for pool_yml, data in self._data.items()},
+            "parents": parents,
+            "revision": revision,
+            "version": SNAPSHOT_VERSION,
+        }
+        # write to a temporary file first, snapshots may be shared by other processes
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        tmp_path.write_text(json.dumps(snapshot, default=_json_default))
+        tmp_path.replace(path)
+
+    @classmethod
+    def from_snapshot(cls, path, config_dir, revision):
+        """Create a resolver from a snapshot file.
+
+        Args:
+            path (Path): snapshot file to read
+            config_dir (Path): configuration directory the files are loaded under
+            revision (str): git revision of the configuration expected
+
+        Returns:
+            PoolConfigResolver: resolver with all the configuration in the snapshot
+                                cached, or None if the snapshot doesn't match
+        """
+        snapshot = json.loads(path.read_text())
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            LOG.warning(f"Ignoring snapshot {path} with unsupported version")
+            return None
+        if snapshot["revision"] != revision:
+            LOG.warning(f"Ignoring snapshot {path} for revision {snapshot['revision']}")
+            return None
+        resolver = cls()
+        for name, data in snapshot["files"].items():
+            resolver._data[config_dir / name] = data
+        for name, parent in snapshot["parents"].items():
+            resolver._flattened[config_dir / name] = (
+                parent["data"],
+                frozenset(parent["ancestors"]),
+            )
+        for cycle_time, schedule_start, crons in snapshot["crons"]:
+            resolver.crons[(cycle_time, schedule_start)] = crons
+        return resolver
+
+
+class PoolValidator:
+    """Validator for pool data, compiled from a table of field types.
+
+    Data is checked in a single pass, and every error is reported instead of only
+    the first one.
+
+    Args:
+        field_types (Mapping): field name -> type, or tuple of types
+        required_fields (frozenset): fields which must be set
+    """
+
+    CONTAINER_KEYS = types.MappingProxyType(
+        {
+            "docker-image": frozenset(("type", "name")),
+            "indexed-image": frozenset(("type", "path", "namespace")),
+            "task-image": frozenset(("type", "path", "taskId")),
+        }
+    )
+    ARTIFACT_KEYS = frozenset(("url", "type"))
+    ARTIFACT_TYPES = frozenset(("file", "directory"))
+
+    def __init__(self, field_types, required_fields):
+        checks = {
+            "artifacts": self._check_artifacts,
+            "cloud": self._check_cloud,
+            "container": self._check_container,
+            "cpu": self._check_cpu,
+            "cpu_affinity": self._check_cpu_affinity,
+            "cycle_time": self._check_time,
+            "disk_size": self._check_size,
+            "macros": self._check_macros,
+            "max_run_time": self._check_time,
+            "memory_limit": self._check_memory_limit,
+            "minimum_memory_per_core": self._check_size,
+            "numa_node": self._check_numa_node,
+            "preprocess_cache": self._check_preprocess_cache,
+            "schedule_start": self._check_schedule_start,
+        }
+        # field -> (accepted types, description of the types, value check)
+        self.fields = {}
+        for field, cls in field_types.items():
+            if not isinstance(cls, tuple):
+                cls = (cls,)
+            expected = " or ".join(f"'{type_.__name__}'" for type_ in cls)
+            self.fields[field] = (cls, expected, checks.get(field))
+        self.required = frozenset(required_fields)
+        # cache key -> errors found
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def validate(self, data, key=None):
+        """Find all the errors in pool data
+
+        Args:
+            data (dict): pool data
+            key (tuple): if given, identifies the data (eg. file and mtime), and the
+                         result is cached for it
+
+        Returns:
+            tuple of str: every error found, empty if the data is valid
         """
-        for name, spec in self._data[provider][architecture].items():
-            if (
-                spec["cpu"] == min_cpu
-                and (spec["ram"] / spec["cpu"]) >= min_ram_per_cpu
+        if key is not None:
+            with self._lock:
+                if key in self._results:
+                    return self._results[key]
+
+        errors = []
+        missing = self.required - data.keys()
+        if missing:
+            errors.append(f"configuration is missing fields: {sorted(missing)!r}")
+        extra = data.keys() - self.fields.keys()
+        if extra:
+            errors.append(f"configuration has extra fields: {sorted(extra)!r}")
+        for field, value in data.items():
+            if value is None:
+                if field in self.required:
+                    errors.append(f"{field} is required for every configuration")
+                continue
+            spec = self.fields.get(field)
+            if spec is None:
+                continue
+            cls, expected, check = spec
+            if not isinstance(value, cls):
+                errors.append(
+                    f"expected '{field}' to be {expected}, got '{type(value).__name__}'"
+                )
+            elif check is not None:
+                check(field, value, errors)
+        errors = tuple(errors)
+
+        if key is not None:
+            with self._lock:
+                self._results[key] = errors
+        return errors
+
+    def _check_container(self, field, value, errors):
+        if not isinstance(value, dict):
+            return
+        if "type" not in value:
+            errors.append("'container' missing required key: 'type'")
+            return
+        if value["type"] not in self.CONTAINER_KEYS:
+            errors.append(f"unknown 'container.type': {value['type']}")
+            return
+        required_keys = self.CONTAINER_KEYS[value["type"]]
+        missing_keys = required_keys - value.keys()
+        extra_keys = value.keys() - required_keys
+        if missing_keys:
+            errors.append(
+                f"missing required keys for 'container' with type '{value['type']}': "
+                f"{', '.join(sorted(missing_keys))}"
+            )
+        if extra_keys:
+            errors.append(
+                f"unknown keys for 'container' with type '{value['type']}': "
+                f"{', '.join(sorted(extra_keys))}"
+            )
+        for key, item in value.items():
+            if not isinstance(item, str):
+                errors.append(
+                    f"unexpected type for 'container.{key}': {type(item).__name__}"
+                )
+
+    def _check_artifacts(self, field, value, errors):
+        for key, artifact in value.items():
+            if not isinstance(key, str):
+                errors.append(
+                    f"expected artifact '{key!r}' name to be 'str', "
+                    f"got '{type(key).__name__}'"
+                )
+            if not isinstance(artifact, dict):
+                errors.append(
+                    f"expected artifact '{key}' value to be 'dict', "
+                    f"got '{type(artifact).__name__}'"
+                )
+                continue
+            if artifact.keys() != self.ARTIFACT_KEYS:
+                errors.append(
+                    f"expected artifact '{key}' object to contain only keys: url, type"
+                )
+            if not isinstance(artifact.get("url"), str):
+                errors.append(
+                    f"expected artifact '{key}' .url to be 'str', "
+                    f"got '{type(artifact.get('url')).__name__}'"
+                )
+            if artifact.get("type") not in self.ARTIFACT_TYPES:
+                errors.append(
+                    f"expected artifact '{key}' .type to be one of: file, directory"
+                )
+
+    @staticmethod
+    def _check_macros(field, value, errors):
+        for key, macro in value.items():
+            if not isinstance(key, str):
+                errors.append(
+                    f"expected macro '{key!r}' name to be 'str', "
+                    f"got '{type(key).__name__}'"
+                )
+            if not isinstance(macro, (int, str)):
+                errors.append(
+                    f"expected macro '{key}' value to be 'int' or 'str', got "
+                    f"'{type(macro).__name__}'"
+                )
+
+    @staticmethod
+    def _check_cloud(field, value, errors):
+        if value not in PROVIDERS:
+            errors.append(f"Invalid cloud - use {','.join(sorted(PROVIDERS))}")
+
+    @staticmethod
+    def _check_cpu(field, value, errors):
+        if CPU_ALIASES.get(value.lower()) not in ARCHITECTURES:
+            errors.append(f"unknown 'cpu': {value}")
+
+    @staticmethod
+    def _check_cpu_affinity(field, value, errors):
+        if value in {PLACEMENT_AUTO, PLACEMENT_NONE}:
+            return
+        try:
+            parse_cpu_list(value)
+        except AssertionError as exc:
+            errors.append(f"invalid '{field}' {value!r}: {exc}")
+
+    @staticmethod
+    def _check_numa_node(field, value, errors):
+        if value in {PLACEMENT_AUTO, PLACEMENT_NONE}:
+            return
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            errors.append(
+                f"invalid '{field}' {value!r}: expected a node number, "
+                f"'{PLACEMENT_AUTO}' or '{PLACEMENT_NONE}'"
+            )
+
+    @staticmethod
+    def _check_preprocess_cache(field, value, errors):
+        for namespace in value:
+            if not isinstance(namespace, str) or not re.fullmatch(
+                r"[\w-]+(\.[\w-]+)*", namespace
             ):
-                if not metal or (metal and spec.get("metal", False)):
-                    yield name
+                errors.append(f"invalid index namespace in '{field}': {namespace!r}")
+
+    @classmethod
+    def _check_memory_limit(cls, field, value, errors):
+        if value in {PLACEMENT_AUTO, PLACEMENT_NONE}:
+            return
+        cls._check_size(field, value, errors)
+
+    @staticmethod
+    def _check_size(field, value, errors):
+        try:
+            parse_size(str(value))
+        except AssertionError as exc:
+            errors.append(f"invalid '{field}' {value!r}: {exc}")
+
+    @staticmethod
+    def _check_time(field, value, errors):
+        try:
+            parse_time(str(value))
+        except AssertionError as exc:
+            errors.append(f"invalid '{field}' {value!r}: {exc}")
+
+    @staticmethod
+    def _check_schedule_start(field, value, errors):
+        if isinstance(value, datetime):
+            return
+        try:
+            dateutil.parser.isoparse(value)
+        except ValueError as exc:
+            errors.append(f"invalid '{field}' {value!r}: {exc}")
 
 
 class CommonPoolConfiguration(abc.ABC):
@@ -187,115 +1058,61 @@ class CommonPoolConfiguration(abc.ABC):
             https://docs.taskcluster.net/docs/reference/workers/docker-worker/payload
         cores_per_task (int): number of cores to be allocated per task
         cpu (int): cpu architecture (eg. x64/arm64)
+        cpu_affinity (str): CPUs the tasks are restricted to (eg. "0-7"), "auto" to
+                            use the CPUs of `numa_node`, or "none"
         cycle_time (int): schedule for running this pool in seconds
         disk_size (int): disk size in GB
         imageset (str): imageset name in community-tc-config/config/imagesets.yml
         macros (dict): dictionary of environment variables passed to the target
         max_run_time (int): maximum run time of this pool in seconds
+        memory_limit (int/str): memory limit of the tasks (eg. "16g"), "auto" for
+                                the share of the machine's memory matching
+                                `cores_per_task`, or "none"
         metal (bool): whether or not the target requires to be run on bare metal
         minimum_memory_per_core (float): minimum RAM to be made available per core in GB
         name (str): descriptive name of the configuration
+        numa_node (int/str): NUMA node the tasks are bound to, "auto" to pick one
+                             with at least `cores_per_task` CPUs, or "none"
         platform (str): operating system of the target (linux, windows)
         pool_id (str): basename of the pool on disk (eg. "pool1" for pool1.yml)
+        resolver (PoolConfigResolver): cache used to load related pool files
         preprocess (str): name of pool configuration to apply and run before fuzzing
                           tasks
+        preprocess_cache (list): index namespaces of the inputs of the preprocess
+                                 task (eg. the build it uses). When set, even
+                                 empty, the results of a previous preprocess task
+                                 are reused while the preprocess configuration and
+                                 the latest tasks indexed there are unchanged.
         schedule_start (datetime): reference date for `cycle_time` scheduling
         scopes (list): list of taskcluster scopes required by the target
         tasks (int): number of tasks to run (each with `cores_per_task`)
     """
 
-    def __init__(self, pool_id, data, base_dir=None):
+    def __init__(self, pool_id, data, base_dir=None, resolver=None, _source=None):
         LOG.debug(f"creating pool {pool_id}")
-        extra = list(set(data) - set(self.FIELD_TYPES))
-        missing = list(set(self.REQUIRED_FIELDS) - set(data))
-        assert not missing, f"configuration is missing fields: {missing!r}"
-        assert not extra, f"configuration has extra fields: {extra!r}"
 
         # "normal" fields
         self.pool_id = pool_id
         self.base_dir = base_dir or pathlib.Path.cwd()
+        self.resolver = resolver or PoolConfigResolver()
 
-        # check that all fields are of the right type (or None)
-        for field, cls in self.FIELD_TYPES.items():
-            if data.get(field) is not None:
-                if isinstance(cls, tuple):
-                    expected = f"'{cls[0].__name__}' or '{cls[1].__name__}'"
-                else:
-                    expected = f"'{cls.__name__}'"
-                assert isinstance(data[field], cls), (
-                    f"expected '{field}' to be {expected}, got "
-                    f"'{type(data[field]).__name__}'"
-                )
-        if isinstance(data.get("container"), dict):
-            value = data["container"]
-            assert "type" in value, "'container' missing required key: 'type'"
-            assert value["type"] in {
-                "docker-image",
-                "indexed-image",
-                "task-image",
-            }, f"unknown 'container.type': {value['type']}"
-            required_keys = {
-                "docker-image": {"type", "name"},
-                "indexed-image": {"type", "path", "namespace"},
-                "task-image": {"type", "path", "taskId"},
-            }[value["type"]]
-            have_keys = set(value.keys())
-            missing_keys = required_keys - have_keys
-            extra_keys = have_keys - required_keys
-            assert not missing_keys, (
-                f"missing required keys for 'container' with type '{value['type']}': "
-                f"{', '.join(missing_keys)}"
-            )
-            assert not extra_keys, (
-                f"unknown keys for 'container' with type '{value['type']}': "
-                f"{', '.join(extra_keys)}"
-            )
-            for k, v in value.items():
-                assert isinstance(
-                    v, str
-                ), f"unexpected type for 'container.{k}': {type(v).__name__}"
-        for key, value in data.get("artifacts", {}).items():
-            assert isinstance(key, str), (
-                f"expected artifact '{key!r}' name to be 'str', "
-                f"got '{type(key).__name__}'"
-            )
-            assert isinstance(value, dict), (
-                f"expected artifact '{key}' value to be 'dict', "
-                f"got '{type(value).__name__}'"
-            )
-            assert set(value.keys()) == {
-                "url",
-                "type",
-            }, f"expected artifact '{key}' object to contain only keys: url, type"
-            assert isinstance(value["url"], str), (
-                f"expected artifact '{key}' .url to be 'str', "
-                f"got '{type(value['url']).__name__}'"
-            )
-            assert value["type"] in {
-                "file",
-                "directory",
-            }, f"expected artifact '{key}' .type to be one of: file, directory"
-        for key, value in data.get("macros", {}).items():
-            assert isinstance(
-                key, str
-            ), f"expected macro '{key!r}' name to be 'str', got '{type(key).__name__}'"
-            assert isinstance(value, (int, str)), (
-                f"expected macro '{key}' value to be 'int' or 'str', got "
-                f"'{type(value).__name__}'"
-            )
+        errors = self.resolver.validate(type(self), data, _source)
+        assert not errors, "\n".join(errors)
 
         self.container = data.get("container")
         self.cores_per_task = data.get("cores_per_task")
         self.imageset = data.get("imageset")
         self.metal = data.get("metal")
         self.name = data["name"]
-        assert self.name is not None, "name is required for every configuration"
         self.platform = data.get("platform")
         self.tasks = data.get("tasks")
         self.preprocess = data.get("preprocess")
+        self.preprocess_cache = None
+        if data.get("preprocess_cache") is not None:
+            self.preprocess_cache = data["preprocess_cache"].copy()
 
         # dict fields
-        self.artifacts = data.get("artifacts", {})
+        self.artifacts = data.get("artifacts", {}).copy()
         self.macros = {k: str(v) for k, v in data.get("macros", {}).items()}
 
         # list fields
@@ -332,51 +1149,109 @@ class CommonPoolConfiguration(abc.ABC):
         # other special fields
         self.cpu = None
         if data.get("cpu") is not None:
-            cpu = self.alias_cpu(data["cpu"])
-            assert cpu in ARCHITECTURES
-            self.cpu = cpu
-        self.cloud = None
-        if data.get("cloud") is not None:
-            assert data["cloud"] in PROVIDERS, "Invalid cloud - use {}".format(
-                ",".join(PROVIDERS)
-            )
-            self.cloud = data["cloud"]
+            self.cpu = self.alias_cpu(data["cpu"])
+        self.cloud = data.get("cloud")
+
+        # placement fields, applied by fuzzing-pool-launch
+        self.cpu_affinity = data.get("cpu_affinity")
+        self.memory_limit = data.get("memory_limit")
+        self.numa_node = data.get("numa_node")
 
     @classmethod
-    def from_file(cls, pool_yml, **kwds):
-        assert pool_yml.is_file()
+    def validator(cls):
+        """Get the validator compiled for this class' fields
+
+        Returns:
+            PoolValidator: validator shared by all instances of this class
+        """
+        validator = cls.__dict__.get("_validator")
+        if validator is None:
+            validator = PoolValidator(cls.FIELD_TYPES, cls.REQUIRED_FIELDS)
+            cls._validator = validator
+        return validator
+
+    @classmethod
+    def from_file(cls, pool_yml, resolver=None, **kwds):
+        resolver = resolver or PoolConfigResolver()
         return cls(
             pool_yml.stem,
-            yaml.safe_load(pool_yml.read_text()),
+            resolver.load(pool_yml),
             base_dir=pool_yml.parent,
+            resolver=resolver,
+            _source=pool_yml,
             **kwds,
         )
 
+    def as_data(self):
+        """Convert this configuration back to the format used in pool.yml
+
+        Returns:
+            dict: data which can be loaded to an equivalent configuration
+        """
+        data = {k: getattr(self, k, None) for k in COMMON_FIELD_TYPES}
+        # convert special fields
+        for gig_field in ("disk_size", "minimum_memory_per_core"):
+            if data[gig_field] is not None:
+                data[gig_field] *= 1024 * 1024 * 1024
+        if data["schedule_start"] is not None:
+            data["schedule_start"] = data["schedule_start"].isoformat()
+        return data
+
+    def launch_params(self):
+        """Get the parameters fuzzing-pool-launch needs to run the tasks of this pool
+
+        Returns:
+            dict: "pools" maps the name of each pool (as given to
+                  fuzzing-pool-launch) to its command and macros. "preprocess" is
+                  the same for the preprocess configuration of each pool.
+        """
+        result = {"pools": {}, "preprocess": {}}
+        for pool in self.iterpools():
+            result["pools"][pool.pool_id] = pool.launch_fields()
+            preprocess = pool.create_preprocess()
+            if preprocess is not None:
+                result["preprocess"][pool.pool_id] = preprocess.launch_fields()
+        return result
+
+    def launch_fields(self):
+        """Get the fields of this pool used by fuzzing-pool-launch
+
+        Returns:
+            dict: command, macros, and placement fields
+        """
+        return {
+            "command": self.command,
+            "cores_per_task": self.cores_per_task,
+            "cpu_affinity": self.cpu_affinity,
+            "macros": self.macros,
+            "memory_limit": self.memory_limit,
+            "numa_node": self.numa_node,
+        }
+
     def get_machine_list(self, machine_types):
         """
         Args:
             machine_types (MachineTypes): database of all machine types
 
         Returns:
-            generator of machine (name, capacity): instance type name and task capacity
+            generator of machine (name, capacity, zone_blacklist): instance type name,
+                task capacity, and zones where it is not available. Sorted by ram.
         """
-        yielded = False
-        for machine in machine_types.filter(
+        machines = machine_types.filter(
             self.cloud,
             self.cpu,
             self.cores_per_task,
             self.minimum_memory_per_core,
             self.metal,
-        ):
-            cpus = machine_types.cpus(self.cloud, self.cpu, machine)
-            zone_blacklist = machine_types.zone_blacklist(self.cloud, self.cpu, machine)
-            yield (machine, cpus // self.cores_per_task, zone_blacklist)
-            yielded = True
-        assert yielded, "No available machines match specified configuration"
+        )
+        assert machines, "No available machines match specified configuration"
+        yield from machines
 
     def cycle_crons(self):
         """Generate cron patterns that correspond to cycle_time (starting from now)
 
+        Patterns are cached in the resolver when schedule_start is set.
+
         Args:
             None
 
@@ -384,7 +1259,11 @@ class CommonPoolConfiguration(abc.ABC):
             generator of str: One or more strings in simple cron format. If all patterns
                               are installed, the result should correspond to cycle_time.
         """
-        if self.schedule_start is not None:
+        if self.schedule_start is None:
+            yield from self._cycle_crons(datetime.now(timezone.utc))
+            return
+        key = (self.cycle_time, self.schedule_start.isoformat())
+        if key not in self.resolver.crons:
             now = self.schedule_start
             if now.utcoffset() is None:
                 # no timezone was specified. treat it as UTC
@@ -392,8 +1271,20 @@ class CommonPoolConfiguration(abc.ABC):
             else:
                 # timezone was given, shift the datetime to be equivalent but in UTC
                 now = now.astimezone(timezone.utc)
-        else:
-            now = datetime.now(timezone.utc)
+            self.resolver.crons[key] = self._cycle_crons(now)
+        yield from self.resolver.crons[key]
+
+    def _cycle_crons(self, now):
+        crons = compile_crons(self._cycle_times(now))
+        if len(crons) > CRON_WARN_PATTERNS:
+            LOG.warning(
+                f"{self.pool_id} cycle_time of {self.cycle_time}s needs {len(crons)} "
+                "cron patterns, consider a factor of 1 day or 1 week"
+            )
+        return crons
+
+    def _cycle_times(self, now):
+        """Generate the times a cycle starts, as cron fields"""
         interval = timedelta(seconds=self.cycle_time)
 
         # special case if the cycle time is a factor of 24 hours
@@ -401,7 +1292,7 @@ class CommonPoolConfiguration(abc.ABC):
             stop = now + timedelta(days=1)
             while now < stop:
                 now += interval
-                yield f"{now.second} {now.minute} {now.hour} * * *"
+                yield (now.second, now.minute, now.hour, None, None, None)
             return
 
         # special case if the cycle time is a factor of 7 days
@@ -410,7 +1301,7 @@ class CommonPoolConfiguration(abc.ABC):
             while now < stop:
                 now += interval
                 weekday = now.isoweekday() % 7
-                yield f"{now.second} {now.minute} {now.hour} * * {weekday}"
+                yield (now.second, now.minute, now.hour, None, None, weekday)
             return
 
         # if the cycle can't be represented as a daily or weekly pattern, then it is
@@ -420,7 +1311,7 @@ class CommonPoolConfiguration(abc.ABC):
         stop = now + timedelta(days=365)
         while now < stop:
             now += interval
-            yield f"{now.second} {now.minute} {now.hour} {now.day} {now.month} *"
+            yield (now.second, now.minute, now.hour, now.day, now.month, None)
 
     @staticmethod
     def alias_cpu(cpu_name):
@@ -444,8 +1335,16 @@ class PoolConfiguration(CommonPoolConfiguration):
     FIELD_TYPES = POOL_CONFIG_FIELD_TYPES
     REQUIRED_FIELDS = COMMON_REQUIRED_FIELDS
 
-    def __init__(self, pool_id, data, base_dir=None, _flattened=None):
-        super().__init__(pool_id, data, base_dir)
+    def __init__(
+        self,
+        pool_id,
+        data,
+        base_dir=None,
+        resolver=None,
+        _flattened=None,
+        _source=None,
+    ):
+        super().__init__(pool_id, data, base_dir, resolver, _source)
 
         # specific fields defined in pool config
         self.parents = data.get("parents", []).copy()
@@ -461,6 +1360,9 @@ class PoolConfiguration(CommonPoolConfiguration):
                 self.artifacts = {}
             if self.command is None:
                 self.command = []
+            for field in ("cpu_affinity", "memory_limit", "numa_node"):
+                if getattr(self, field) is None:
+                    setattr(self, field, PLACEMENT_NONE)
             if self.macros is None:
                 self.macros = {}
             if self.max_run_time is None:
@@ -475,7 +1377,9 @@ class PoolConfiguration(CommonPoolConfiguration):
             missing = {
                 field for field in self.FIELD_TYPES if getattr(self, field) is None
             }
-            missing.discard("schedule_start")  # this field can be null
+            # these fields can be null
+            missing.discard("preprocess_cache")
+            missing.discard("schedule_start")
             assert not missing, f"Pool is missing fields: {list(missing)!r}"
 
     def create_preprocess(self):
@@ -484,7 +1388,7 @@ class PoolConfiguration(CommonPoolConfiguration):
         """
         if not self.preprocess:
             return None
-        data = yaml.safe_load((self.base_dir / f"{self.preprocess}.yml").read_text())
+        data = self.resolver.load(self.base_dir / f"{self.preprocess}.yml")
         pool_id = self.pool_id + "/preprocess"
         assert data["tasks"] == 1 or (
             self.tasks == 1 and data["tasks"] is None
@@ -506,10 +1410,27 @@ class PoolConfiguration(CommonPoolConfiguration):
             assert data.get(field) is None, f"{self.preprocess} cannot set {field}"
         data["preprocess"] = ""  # blank the preprocess field to avoid inheritance
         data["parents"] = [self.pool_id] + data.get("parents", [])
-        result = type(self)(pool_id, data, self.base_dir)
+        result = type(self)(pool_id, data, self.base_dir, self.resolver)
         result.name = f"{self.name} ({result.name})"
         return result
 
+    def iterpools(self):
+        yield self
+
+    def max_capacity(self):
+        """Capacity of the worker pool running this pool's tasks
+
+        Returns:
+            int: maxCapacity of the worker pool
+        """
+        # add +1 to expected size, so if we manually trigger the hook, the new
+        # decision can run without also manually cancelling a task
+        # * 2 since Taskcluster seems to not reuse workers very quickly in some
+        # cases, so we end up with a lot of pending tasks.
+        return (
+            max(1, math.ceil(self.max_run_time / self.cycle_time)) * self.tasks * 2 + 1
+        )
+
     def _flatten(self, flattened):
         overwriting_fields = (
             "cloud",
@@ -517,15 +1438,19 @@ class PoolConfiguration(CommonPoolConfiguration):
             "container",
             "cores_per_task",
             "cpu",
+            "cpu_affinity",
             "cycle_time",
             "disk_size",
             "imageset",
             "max_run_time",
+            "memory_limit",
             "metal",
             "minimum_memory_per_core",
             "name",
+            "numa_node",
             "platform",
             "preprocess",
+            "preprocess_cache",
             "schedule_start",
             "tasks",
         )
@@ -545,9 +1470,14 @@ class PoolConfiguration(CommonPoolConfiguration):
                 "encountered"
             )
             flattened.add(parent_id)
-            parent_obj = self.from_file(
-                self.base_dir / f"{parent_id}.yml", _flattened=flattened
+            parent_obj, ancestors = self.resolver.resolve(
+                type(self), self.base_dir / f"{parent_id}.yml"
             )
+            assert flattened.isdisjoint(ancestors), (
+                "attempt to resolve cyclic configuration, "
+                f"{', '.join(sorted(flattened & ancestors))} already encountered"
+            )
+            flattened.update(ancestors)
 
             # "normal" overwriting fields
             for field in overwriting_fields:
@@ -576,7 +1506,7 @@ class PoolConfiguration(CommonPoolConfiguration):
                 setattr(
                     self,
                     field,
-                    list(set(getattr(self, field)) | set(getattr(parent_obj, field))),
+                    sorted(set(getattr(self, field)) | set(getattr(parent_obj, field))),
                 )
 
         # dict values defined in self take precedence over values defined in parents
@@ -596,11 +1526,12 @@ class PoolConfigMap(CommonPoolConfiguration):
     REQUIRED_FIELDS = POOL_MAP_REQUIRED_FIELDS
     RESULT_TYPE = PoolConfiguration
 
-    def __init__(self, pool_id, data, base_dir=None):
-        super().__init__(pool_id, data, base_dir)
+    def __init__(self, pool_id, data, base_dir=None, resolver=None, _source=None):
+        super().__init__(pool_id, data, base_dir, resolver, _source)
 
         # specific fields defined in pool config
         self.apply_to = data["apply_to"].copy()
+        self._pools = None
 
         # while these fields are not required to be defined here, they must be the same
         # for the entire set .. at least for now
@@ -616,8 +1547,8 @@ class PoolConfigMap(CommonPoolConfiguration):
             "platform",
             "schedule_start",
         )
-        not_allowed = ("preprocess",)
-        pools = list(self.iterpools())
+        not_allowed = ("preprocess", "preprocess_cache")
+        pools = self.pools
         for field in same_fields:
             assert (
                 len({getattr(pool, field) for pool in pools}) == 1
@@ -631,32 +1562,53 @@ class PoolConfigMap(CommonPoolConfiguration):
 
     def apply(self, parent):
         pool_id = f"{parent}/{self.pool_id}"
-        data = {k: getattr(self, k, None) for k in COMMON_FIELD_TYPES}
-        # convert special fields
-        for gig_field in ("disk_size", "minimum_memory_per_core"):
-            if data[gig_field] is not None:
-                data[gig_field] *= 1024 * 1024 * 1024
-        if data["schedule_start"] is not None:
-            data["schedule_start"] = data["schedule_start"].isoformat()
+        data = self.as_data()
         # override fields
         data["parents"] = [parent]
-        name = self.RESULT_TYPE.from_file(self.base_dir / f"{parent}.yml").name
-        data["name"] = f"{name} ({self.name})"
-        return self.RESULT_TYPE(pool_id, data, self.base_dir)
+        parent_obj, _ = self.resolver.resolve(
+            self.RESULT_TYPE, self.base_dir / f"{parent}.yml"
+        )
+        data["name"] = f"{parent_obj.name} ({self.name})"
+        return self.RESULT_TYPE(pool_id, data, self.base_dir, self.resolver)
+
+    def max_capacity(self):
+        """Capacity of the worker pool running the tasks of all the applied pools
+
+        Returns:
+            int: maxCapacity of the worker pool
+        """
+        return max(sum(pool.tasks for pool in self.pools) * 2, 3)
+
+    @property
+    def pools(self):
+        """Pool configurations resulting from applying this map to each entry of
+        `apply_to`. These are only computed once.
+
+        Returns:
+            list of PoolConfiguration: the applied pools, in `apply_to` order
+        """
+        if self._pools is None:
+            self._pools = [self.apply(parent) for parent in self.apply_to]
+        return self._pools
 
     def iterpools(self):
-        for parent in self.apply_to:
-            yield self.apply(parent)
+        yield from self.pools
 
 
 class PoolConfigLoader:
     @staticmethod
-    def from_file(pool_yml):
-        assert pool_yml.is_file()
-        data = yaml.safe_load(pool_yml.read_text())
+    def from_file(pool_yml, resolver=None):
+        resolver = resolver or PoolConfigResolver()
+        data = resolver.load(pool_yml)
         for cls in (PoolConfiguration, PoolConfigMap):
             if set(cls.FIELD_TYPES) >= set(data.keys()) >= cls.REQUIRED_FIELDS:
-                return cls(pool_yml.stem, data, base_dir=pool_yml.parent)
+                return cls(
+                    pool_yml.stem,
+                    data,
+                    base_dir=pool_yml.parent,
+                    resolver=resolver,
+                    _source=pool_yml,
+                )
         LOG.error(
             f"{pool_yml} has keys {data.keys()} and expected all of either "
             f"{PoolConfiguration.REQUIRED_FIELDS} or {PoolConfigMap.REQUIRED_FIELDS} "
@@ -670,6 +1622,7 @@ def test_main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("input", type=pathlib.Path, help="machines.yml")
+    parser.add_argument("--prices", type=pathlib.Path, help="spot-prices.yml")
     parser.add_argument(
         "--cpu", help="cpu architecture", choices=ARCHITECTURES, default="x64"
     )
@@ -686,11 +1639,118 @@ def test_main():
     args = parser.parse_args()
 
     ram = parse_size(args.ram) / parse_size("1g")
-    type_list = MachineTypes.from_file(args.input)
-    for machine in type_list.filter(
+    type_list = MachineTypes.from_file(args.input, args.prices)
+    for machine, _, _ in type_list.filter(
         args.provider, args.cpu, args.cores, ram, args.metal
     ):
-        print(machine)
+        price = type_list.price(args.provider, args.cpu, machine)
+        if price is None:
+            print(machine)
+        else:
+            print(f"{machine} ({price}/h)")
+
+
+def imageset_regions(community_dir):
+    """Find the regions where the images of each imageset are available
+
+    Args:
+        community_dir (Path): community configuration
+
+    Returns:
+        dict: provider -> imageset -> set of regions
+    """
+    config_dir = community_dir / "config"
+    imagesets = yaml.safe_load((config_dir / "imagesets.yml").read_text())
+    aws = set(yaml.safe_load((config_dir / "aws.yml").read_text())["subnets"])
+    gcp = set(yaml.safe_load((config_dir / "gcp.yml").read_text())["regions"])
+    result = {"aws": {}, "gcp": {}}
+    for name, imageset in imagesets.items():
+        result["aws"][name] = aws & set(imageset.get("aws", {}).get("amis", {}))
+        # GCP images are global, but only some imagesets have one
+        result["gcp"][name] = gcp if "gcp" in imageset else set()
+    return result
+
+
+def plan_main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Simulate the schedule of all fuzzing pools over a week, report "
+        "the peak capacity they use, and suggest tighter maxCapacity values."
+    )
+    parser.add_argument("config", type=pathlib.Path, help="fuzzing configuration")
+    parser.add_argument(
+        "--community",
+        type=pathlib.Path,
+        help="community configuration, to report capacity by region",
+    )
+    parser.add_argument(
+        "--start",
+        type=dateutil.parser.isoparse,
+        help="start of the simulated week (default: now)",
+    )
+    parser.add_argument(
+        "--decision-time",
+        type=parse_time,
+        default=PLAN_DECISION_TIME,
+        help="time between a hook firing and its tasks being created, eg. 5m",
+    )
+    args = parser.parse_args()
+
+    start = args.start or datetime.now(timezone.utc)
+    if start.utcoffset() is None:
+        start = start.replace(tzinfo=timezone.utc)
+    prices = args.config / "spot-prices.yml"
+    machine_types = MachineTypes.from_file(
+        args.config / "machines.yml", prices if prices.is_file() else None
+    )
+
+    # regions each pool can run in
+    regions = {"aws": {}, "gcp": {}}
+    if args.community is not None:
+        regions = imageset_regions(args.community)
+
+    resolver = PoolConfigResolver()
+    pools = []
+    for pool_yml in sorted(args.config.glob("pool*.yml")):
+        pool = PoolConfigLoader.from_file(pool_yml, resolver=resolver)
+        if pool.schedule_start is None:
+            # the schedule of these pools depends on when they are generated
+            pool.schedule_start = start
+        pools.append(pool)
+    plans = plan_capacity(pools, machine_types, start, args.decision_time)
+
+    print(f"{'pool':40} {'cloud':5} {'peak':>5} {'max':>5} {'suggested':>9}")
+    usage = collections.defaultdict(list)
+    failed = 0
+    for pool, plan in zip(pools, plans):
+        if "error" in plan:
+            print(f"{pool.pool_id:40} {pool.cloud or '-':5} error: {plan['error']}")
+            failed += 1
+            continue
+        current = pool.max_capacity()
+        # +1 so the hook can be triggered manually
+        suggested = plan["peak"] + 1
+        print(
+            f"{pool.pool_id:40} {pool.cloud:5} {plan['peak']:5} {current:5} "
+            f"{suggested if suggested < current else '-':>9}"
+        )
+        usage[(pool.cloud, "*")].append(plan["timeline"])
+        for region in regions[pool.cloud].get(pool.imageset, ()):
+            usage[(pool.cloud, region)].append(plan["timeline"])
+
+    # pools are counted in every region they can run in, so region peaks are upper
+    # bounds
+    print()
+    print(f"{'provider':8} {'region':20} {'instances':>9} {'cores':>7}")
+    for (provider, region), timelines in sorted(usage.items()):
+        instances, cores = peak_usage(timelines)
+        print(f"{provider:8} {region:20} {instances:9} {cores:7}")
+    if failed:
+        print()
+        print(f"Failed to plan the capacity of {failed} pool(s), not counted above")
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import atexit
+import contextlib
+import cProfile
+import json
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    """Total time spent in named phases of the execution.
+
+    Phases can contain other phases, so their durations overlap. A phase entered
+    again while it is already running in the same thread (eg. recursively) is only
+    counted once.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # (name, details) -> [calls, duration]
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def phase(self, name, **details):
+        """Time the enclosed block.
+
+        Args:
+            name (str): phase name
+            **details (str): attributes distinguishing instances of the phase
+                             (eg. pool)
+        """
+        active = self._local.__dict__.setdefault("active", set())
+        key = (name, tuple(sorted(details.items())))
+        if key in active:
+            yield
+            return
+        active.add(key)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            active.discard(key)
+            self.record(name, time.perf_counter() - start, **details)
+
+    def record(self, name, duration, **details):
+        """Add time measured elsewhere (eg. in another process) to a phase.
+
+        Args:
+            name (str): phase name
+            duration (float): seconds spent in the phase
+            **details (str): attributes distinguishing instances of the phase
+        """
+        key = (name, tuple(sorted(details.items())))
+        with self._lock:
+            totals = self._phases.setdefault(key, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+
+    def merge(self, phases):
+        """Add the phases recorded by another timer (eg. in a worker process).
+
+        Args:
+            phases (list of dict): phases, as returned in `as_json()["phases"]`
+        """
+        with self._lock:
+            for phase in phases:
+                details = {
+                    key: value
+                    for key, value in phase.items()
+                    if key not in {"name", "calls", "duration"}
+                }
+                key = (phase["name"], tuple(sorted(details.items())))
+                totals = self._phases.setdefault(key, [0, 0.0])
+                totals[0] += phase["calls"]
+                totals[1] += phase["duration"]
+
+    def clear(self):
+        """Forget the phases recorded so far"""
+        with self._lock:
+            self._phases.clear()
+
+    def as_json(self):
+        """Get the timings
+
+        Returns:
+            dict: "phases" is a list of each phase name, details, number of calls
+                  and total duration (in seconds). "total" is the time elapsed
+                  since the timer was created.
+        """
+        with self._lock:
+            phases = [
+                dict(details, name=name, calls=calls, duration=round(duration, 6))
+                for (name, details), (calls, duration) in self._phases.items()
+            ]
+        return {
+            "phases": phases,
+            "total": round(time.perf_counter() - self.start, 6),
+        }
+
+    def save(self, path):
+        """Write the timings to a JSON file
+
+        Args:
+            path (Path): file to write
+        """
+        path.write_text(json.dumps(self.as_json(), indent=2))
+        LOG.info(f"Saved phase timings to {path}")
+
+    def save_at_exit(self, path):
+        """Write the timings to a JSON file when the process exits
+
+        Args:
+            path (Path): file to write
+        """
+        atexit.register(self.save, path)
+
+
+def profile_until_exit(path):
+    """Profile the rest of the execution with cProfile
+
+    Args:
+        path (Path): file the profile is dumped to when the process exits, readable
+                     with `pstats`
+    """
+    profile = cProfile.Profile()
+
+    def _dump():
+        profile.disable()
+        profile.dump_stats(str(path))
+        LOG.info(f"Saved profile to {path}")
+
+    atexit.register(_dump)
+    profile.enable()
+
+
+# Timings of the current process
+timings = PhaseTimer()
@@ -4,23 +4,98 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
 import logging
 import os
 import pathlib
+import re
+import shutil
 import subprocess
 import tempfile
+import time
 
 import yaml
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
 from . import taskcluster
+from .pool import PoolConfigResolver
+from .timing import timings
 
 LOG = logging.getLogger(__name__)
 
+# seconds between attempts to lock a git mirror
+LOCK_POLL_INTERVAL = 0.5
+
+
+def _check_output(cmd, deadline=None, **kwds):
+    """Run a command, killing it if it doesn't complete before `deadline`
+
+    Args:
+        cmd (list of str): command to run
+        deadline (float): `time.monotonic()` value, or None to wait indefinitely
+        **kwds: passed to `subprocess.check_output`
+
+    Returns:
+        bytes: command output
+    """
+    return subprocess.check_output(cmd, timeout=_timeout(deadline), **kwds)
+
+
+def _call(cmd, deadline=None, **kwds):
+    """Run a command, killing it if it doesn't complete before `deadline`
+
+    Args:
+        cmd (list of str): command to run
+        deadline (float): `time.monotonic()` value, or None to wait indefinitely
+        **kwds: passed to `subprocess.call`
+
+    Returns:
+        int: command exit code
+    """
+    return subprocess.call(cmd, timeout=_timeout(deadline), **kwds)
+
+
+def _lock(lock, deadline=None):
+    """Take an exclusive lock on a file, waiting until `deadline` at most
+
+    Args:
+        lock (file): file to lock
+        deadline (float): `time.monotonic()` value, or None to wait indefinitely
+    """
+    if deadline is None:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for the lock on {lock.name}")
+        time.sleep(min(LOCK_POLL_INTERVAL, _timeout(deadline)))
+
+
+def _timeout(deadline):
+    """Get the seconds left before `deadline` (None if there is none)"""
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
 
 class Workflow:
     def __init__(self):
         taskcluster.auth()
 
+        self.fuzzing_config_dir = None
+        # commit of the fuzzing configuration, when known
+        self.fuzzing_config_revision = None
+        # cache used to load files from the fuzzing configuration
+        self.resolver = PoolConfigResolver()
+
     @property
     def in_taskcluster(self):
         return "TASK_ID" in os.environ and "TASKCLUSTER_ROOT_URL" in os.environ
@@ -31,6 +106,8 @@ class Workflow:
         secret=None,
         fuzzing_git_repository=None,
         fuzzing_git_revision=None,
+        snapshot_dir=None,
+        git_cache_dir=None,
     ):
         """Load configuration either from local file or Taskcluster secret"""
 
@@ -63,6 +140,11 @@ class Workflow:
 
         assert "fuzzing_config" in config, "Missing fuzzing_config"
 
+        if snapshot_dir is not None:
+            config["snapshot_dir"] = str(snapshot_dir)
+        if git_cache_dir is not None:
+            config["git_cache_dir"] = str(git_cache_dir)
+
         return config
 
     def clone(self, config):
@@ -82,9 +164,113 @@ class Workflow:
                 path.chmod(0o400)
                 LOG.info("Installed ssh private key")
 
-    def git_clone(self, url=None, path=None, revision=None, **kwargs):
-        """Clone a configuration repository"""
+    def clone_fuzzing_config(self, config, deadline=None, write_snapshot=False):
+        """Retrieve the fuzzing configuration repository.
+
+        If `snapshot_dir` is configured, and contains a snapshot for the requested
+        revision, the configuration is loaded from there instead of cloning.
+
+        Args:
+            config (dict): workflow configuration
+            deadline (float): `time.monotonic()` value after which cloning is aborted
+            write_snapshot (bool): compile a new snapshot after cloning, when none
+                                   was found. Compiling loads every pool, so only
+                                   workflows loading them anyway should do it.
+        """
+        fuzzing_config = config["fuzzing_config"]
+        if fuzzing_config.get("path") is not None:
+            # local changes may not be committed, so there is no revision
+            self.fuzzing_config_dir = self.git_clone(**fuzzing_config)
+            return
+        snapshot_dir = config.get("snapshot_dir")
+        if snapshot_dir is None:
+            self.fuzzing_config_dir = self.git_clone(
+                cache_dir=config.get("git_cache_dir"),
+                deadline=deadline,
+                **fuzzing_config,
+            )
+            self.fuzzing_config_revision = self._head_revision(
+                self.fuzzing_config_dir, deadline
+            )
+            return
+        snapshot_dir = pathlib.Path(snapshot_dir)
+
+        # snapshots are keyed by commit, anything else could have moved
+        revision = fuzzing_config.get("revision") or ""
+        if re.fullmatch(r"[0-9a-f]{40}", revision):
+            snapshot = snapshot_dir / f"{revision}.json"
+            if snapshot.is_file():
+                # files are loaded from the snapshot, this directory is never created
+                config_dir = snapshot_dir / revision
+                resolver = PoolConfigResolver.from_snapshot(
+                    snapshot, config_dir, revision
+                )
+                if resolver is not None:
+                    LOG.info(f"Using fuzzing configuration snapshot {snapshot}")
+                    self.fuzzing_config_dir = config_dir
+                    self.fuzzing_config_revision = revision
+                    self.resolver = resolver
+                    return
+
+        self.fuzzing_config_dir = self.git_clone(
+            cache_dir=config.get("git_cache_dir"),
+            deadline=deadline,
+            **fuzzing_config,
+        )
+        revision = self._head_revision(self.fuzzing_config_dir, deadline)
+        self.fuzzing_config_revision = revision
+        if not write_snapshot:
+            return
+        try:
+            resolver = PoolConfigResolver.compile(self.fuzzing_config_dir)
+        except Exception:
+            LOG.warning("Failed to compile configuration snapshot", exc_info=True)
+            return
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        resolver.save_snapshot(snapshot_dir / f"{revision}.json", revision)
+        LOG.info(f"Saved fuzzing configuration snapshot for {revision}")
+        self.resolver = resolver
+
+    @staticmethod
+    def _head_revision(path, deadline=None):
+        """Get the commit checked out in a repository
+
+        Args:
+            path (Path): repository directory
+            deadline (float): `time.monotonic()` value after which git is killed
+
+        Returns:
+            str: full commit hash
+        """
+        cmd = ["git", "rev-parse", "HEAD"]
+        return _check_output(cmd, deadline, cwd=str(path)).decode().strip()
+
+    def git_clone(
+        self,
+        url=None,
+        path=None,
+        revision=None,
+        cache_dir=None,
+        deadline=None,
+        **kwargs,
+    ):
+        """Clone a configuration repository
+
+        Args:
+            url (str): remote repository to clone
+            path (str): local repository, used instead of cloning
+            revision (str): revision to checkout
+            cache_dir (str): directory holding mirrors of remote repositories, shared
+                             by concurrent processes. Without it, only the requested
+                             revision is fetched.
+            deadline (float): `time.monotonic()` value after which git commands
+                              are killed
+
+        Returns:
+            Path: repository directory
+        """
         local_path = False
+        updated = False
 
         if path is not None:
             path = pathlib.Path(path)
@@ -98,23 +284,121 @@ class Workflow:
 
             # Clone the configuration repository
             LOG.info(f"Cloning {url}")
-            cmd = ["git", "clone", "--quiet", url, str(path)]
-            subprocess.check_output(cmd)
+            if cache_dir is not None and fcntl is None:
+                LOG.warning("Git cache requires file locking, ignoring cache_dir")
+                cache_dir = None
+            with timings.phase("git_clone", repository=url):
+                try:
+                    if cache_dir is not None:
+                        self._clone_from_mirror(
+                            url, path, revision, pathlib.Path(cache_dir), deadline
+                        )
+                    else:
+                        updated = self._clone_shallow(url, path, revision, deadline)
+                except BaseException:
+                    # the caller never gets the path, so can't remove it
+                    shutil.rmtree(str(path), ignore_errors=True)
+                    raise
             LOG.info(f"Using cloned config files in {path}")
         else:
             raise Exception("You need to specify a repo url or local path")
 
         # Update to specified revision
         # Fallback to pulling remote references
-        if not local_path and revision is not None:
+        if not local_path and not updated and revision is not None:
             LOG.info(f"Updating repo to {revision}")
-            try:
-                cmd = ["git", "checkout", revision, "-q"]
-                subprocess.check_output(cmd, cwd=str(path))
+            with timings.phase("git_update", repository=url):
+                try:
+                    cmd = ["git", "checkout", revision, "-q"]
+                    _check_output(cmd, deadline, cwd=str(path))
 
-            except subprocess.CalledProcessError:
-                LOG.info("Updating failed, trying to pull")
-                cmd = ["git", "pull", "origin", revision, "-q"]
-                subprocess.check_output(cmd, cwd=str(path))
+                except subprocess.CalledProcessError:
+                    LOG.info("Updating failed, trying to pull")
+                    cmd = ["git", "pull", "origin", revision, "-q"]
+                    _check_output(cmd, deadline, cwd=str(path))
 
         return path
+
+    @staticmethod
+    def _clone_shallow(url, path, revision, deadline):
+        """Fetch only the requested revision of a remote repository
+
+        Returns:
+            bool: True if the revision is checked out, False if the full history
+                  was fetched instead
+        """
+        if revision is None:
+            cmd = ["git", "clone", "--quiet", "--depth", "1", url, str(path)]
+            _check_output(cmd, deadline)
+            return True
+
+        for cmd in (
+            ["git", "init", "--quiet"],
+            ["git", "remote", "add", "origin", url],
+        ):
+            _check_output(cmd, deadline, cwd=str(path))
+        try:
+            cmd = ["git", "fetch", "--quiet", "--depth", "1", "origin", revision]
+            _check_output(cmd, deadline, cwd=str(path))
+        except subprocess.CalledProcessError:
+            # eg. abbreviated commits can't be fetched
+            LOG.info("Fetching revision failed, fetching all")
+            cmd = ["git", "fetch", "--quiet", "origin"]
+            _check_output(cmd, deadline, cwd=str(path))
+            return False
+        cmd = ["git", "checkout", "--quiet", "FETCH_HEAD"]
+        _check_output(cmd, deadline, cwd=str(path))
+        return True
+
+    @staticmethod
+    def _clone_from_mirror(url, path, revision, cache_dir, deadline):
+        """Clone a remote repository using a local mirror
+
+        The mirror is created or updated as needed, holding a lock so concurrent
+        processes can share it, waiting for it until the deadline at most. Mirrors
+        are not updated if they already contain the requested commit. Garbage
+        collection runs as needed after updates, while still holding the lock:
+        unreachable objects are only pruned after `gc.pruneExpire` (2 weeks by
+        default), much longer than clones are used.
+        """
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        mirror = cache_dir / f"{name}.git"
+
+        with (cache_dir / f"{name}.lock").open("w") as lock:
+            _lock(lock, deadline)
+            try:
+                if not mirror.is_dir():
+                    LOG.info(f"Creating mirror of {url} in {mirror}")
+                    cmd = ["git", "clone", "--quiet", "--mirror", url, str(mirror)]
+                    _check_output(cmd, deadline)
+                    # garbage collection triggered by git must run under the lock
+                    cmd = ["git", "config", "gc.autoDetach", "false"]
+                    _check_output(cmd, deadline, cwd=str(mirror))
+                elif not (
+                    revision is not None
+                    and re.fullmatch(r"[0-9a-f]{40}", revision)
+                    and _call(
+                        ["git", "cat-file", "-e", f"{revision}^{{commit}}"],
+                        deadline,
+                        cwd=str(mirror),
+                        stderr=subprocess.DEVNULL,
+                    )
+                    == 0
+                ):
+                    LOG.info(f"Updating mirror of {url} in {mirror}")
+                    cmd = ["git", "fetch", "--quiet", "--prune", "origin"]
+                    _check_output(cmd, deadline, cwd=str(mirror))
+                    # drop the objects of branches deleted or force-pushed
+                    cmd = ["git", "gc", "--auto", "--quiet"]
+                    _check_output(cmd, deadline, cwd=str(mirror))
+
+                # objects are used from the mirror instead of being copied
+                cmd = ["git", "clone", "--quiet", "--shared", str(mirror), str(path)]
+                _check_output(cmd, deadline)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        # pulling falls back to the remote repository
+        cmd = ["git", "remote", "set-url", "origin", url]
+        _check_output(cmd, deadline, cwd=str(path))
@@ -9,6 +9,7 @@ import logging
 from tcadmin.resources import Hook, WorkerPool
 
 from ..common import taskcluster
+from ..common.timing import timings
 from .pool import cancel_tasks
 
 LOG = logging.getLogger(__name__)
@@ -19,7 +20,8 @@ async def cancel_pool_tasks(action, resource):
     assert isinstance(resource, WorkerPool)
 
     _, worker_type = resource.workerPoolId.split("/")
-    cancel_tasks(worker_type)
+    with timings.phase("cancel_pool_tasks", pool=worker_type):
+        cancel_tasks(worker_type)
 
 
 async def trigger_hook(action, resource):
@@ -28,4 +30,5 @@ async def trigger_hook(action, resource):
 
     hooks = taskcluster.get_service("hooks")
     LOG.info(f"Triggering hook {resource.hookGroupId} / {resource.hookId}")
-    hooks.triggerHook(resource.hookGroupId, resource.hookId, {})
+    with timings.phase("trigger_hook", hook=resource.hookId):
+        hooks.triggerHook(resource.hookGroupId, resource.hookId, {})
@@ -4,17 +4,23 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import json
 import logging
 import os
+import pathlib
 
 from ..common.cli import build_cli_parser
-from .workflow import Workflow
+from ..common.timing import profile_until_exit, timings
+from .workflow import RENDER_FORMATS, Workflow
 
 
-def main():
+def main(args=None):
     parser = build_cli_parser(prog="fuzzing-decision")
     parser.add_argument(
-        "pool_name", type=str, help="The target fuzzing pool to create tasks for"
+        "pool_name",
+        type=str,
+        nargs="?",
+        help="The target fuzzing pool to create tasks for (optional with --render)",
     )
     parser.add_argument(
         "--task-id",
@@ -27,15 +33,58 @@ def main():
         action="store_true",
         help="Build the task group, but exit before creating tasks in Taskcluster.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--render",
+        type=pathlib.Path,
+        metavar="DIR",
+        help="Render the decision and fuzzing tasks of all pools (or pool_name) to "
+        "this directory, without calling Taskcluster, with the sha256 of each pool",
+    )
+    parser.add_argument(
+        "--render-format",
+        choices=RENDER_FORMATS,
+        default="jsonl",
+        help="Write a single JSON lines file, or a JSON file per pool",
+    )
+    parser.add_argument(
+        "--launch-params",
+        type=pathlib.Path,
+        help="Write the parameters of fuzzing-pool-launch for the pool to this file",
+        default=os.environ.get("FUZZING_LAUNCH_PARAMS"),
+    )
+    parser.add_argument(
+        "--timings",
+        type=pathlib.Path,
+        help="Write the time spent in each phase to this JSON file on exit",
+        default=os.environ.get("FUZZING_TIMINGS"),
+    )
+    parser.add_argument(
+        "--profile",
+        type=pathlib.Path,
+        help="Profile the execution with cProfile, and write the stats to this file",
+        default=os.environ.get("FUZZING_PROFILE"),
+    )
+    args = parser.parse_args(args=args)
 
-    # We need both task & task group information
-    if not args.task_id:
-        raise Exception("Missing decision task id")
+    if args.render is None:
+        if not args.pool_name:
+            parser.error("the following arguments are required: pool_name")
+        # We need both task & task group information
+        if not args.task_id:
+            raise Exception("Missing decision task id")
 
     # Setup logger
     logging.basicConfig(level=args.log_level)
 
+    if args.launch_params is not None:
+        # the artifact is published even if no pool is loaded (eg. on errors),
+        # fuzzing tasks then clone the configuration instead
+        args.launch_params.write_text(json.dumps({"pools": {}, "preprocess": {}}))
+    if args.timings is not None:
+        timings.save_at_exit(args.timings)
+    if args.profile is not None:
+        profile_until_exit(args.profile)
+
     # Configure workflow using the secret or local configuration
     workflow = Workflow()
     config = workflow.configure(
@@ -43,10 +92,23 @@ def main():
         secret=args.taskcluster_secret,
         fuzzing_git_repository=args.git_repository,
         fuzzing_git_revision=args.git_revision,
+        snapshot_dir=args.snapshot_dir,
+        git_cache_dir=args.git_cache_dir,
     )
 
     # Retrieve remote repositories
     workflow.clone(config)
 
+    if args.render is not None:
+        pool_names = [args.pool_name] if args.pool_name else None
+        workflow.render_tasks(args.render, pool_names, args.render_format)
+        return
+
     # Build all task definitions for that pool
-    workflow.build_tasks(args.pool_name, args.task_id, config, dry_run=args.dry_run)
+    workflow.build_tasks(
+        args.pool_name,
+        args.task_id,
+        config,
+        dry_run=args.dry_run,
+        launch_params=args.launch_params,
+    )
@@ -4,14 +4,18 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import concurrent.futures
+import hashlib
+import json
 import logging
-import math
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from itertools import chain
 from pathlib import Path
 from string import Template
 
+import dateutil.parser
+import requests.adapters
 import yaml
 from taskcluster.exceptions import TaskclusterFailure, TaskclusterRestFailure
 from taskcluster.utils import fromNow, slugId, stringDate
@@ -19,6 +23,7 @@ from tcadmin.resources import Hook, Role, WorkerPool
 
 from ..common import taskcluster
 from ..common.pool import PoolConfigMap as CommonPoolConfigMap
+from ..common.pool import PoolConfigResolver
 from ..common.pool import PoolConfiguration as CommonPoolConfiguration
 from ..common.pool import parse_time
 from . import (
@@ -46,8 +51,91 @@ DOCKER_WORKER_DEVICES = (
 )
 
 TEMPLATES = (Path(__file__).parent / "task_templates").resolve()
-DECISION_TASK = Template((TEMPLATES / "decision.yaml").read_text())
-FUZZING_TASK = Template((TEMPLATES / "fuzzing.yaml").read_text())
+
+
+class _TemplateLoader(yaml.SafeLoader):
+    """YAML loader keeping `${...}` placeholders for later substitution"""
+
+    def construct_template_int(self, node):
+        value = self.construct_scalar(node)
+        if "$" in value:
+            return _IntTemplate(value)
+        return self.construct_yaml_int(node)
+
+
+class _IntTemplate(Template):
+    """Placeholder for an integer field"""
+
+
+_TemplateLoader.add_constructor(
+    "tag:yaml.org,2002:int", _TemplateLoader.construct_template_int
+)
+
+
+class TaskTemplate:
+    """Task definition parsed once from a YAML template
+
+    Rendering copies the parsed skeleton and only substitutes the fields holding
+    placeholders, instead of parsing the substituted YAML text for each task.
+
+    Args:
+        text (str): YAML task template, with `string.Template` placeholders in
+                    quoted scalars
+    """
+
+    def __init__(self, text):
+        self.skeleton = self._compile(yaml.load(text, Loader=_TemplateLoader))
+
+    @classmethod
+    def _compile(cls, obj):
+        if isinstance(obj, dict):
+            return {
+                cls._compile(key): cls._compile(value) for key, value in obj.items()
+            }
+        if isinstance(obj, list):
+            return [cls._compile(value) for value in obj]
+        if isinstance(obj, str) and "$" in obj:
+            return Template(obj)
+        return obj
+
+    @classmethod
+    def _render(cls, obj, values):
+        if isinstance(obj, dict):
+            return {
+                cls._render(key, values): cls._render(value, values)
+                for key, value in obj.items()
+            }
+        if isinstance(obj, list):
+            return [cls._render(value, values) for value in obj]
+        if isinstance(obj, _IntTemplate):
+            return int(obj.substitute(values))
+        if isinstance(obj, Template):
+            return obj.substitute(values)
+        return obj
+
+    def render(self, **values):
+        """Create a task definition
+
+        Arguments:
+            **values (str): values of the template placeholders
+
+        Returns:
+            dict: task definition
+        """
+        return self._render(self.skeleton, values)
+
+
+DECISION_TASK = TaskTemplate((TEMPLATES / "decision.yaml").read_text())
+FUZZING_TASK = TaskTemplate((TEMPLATES / "fuzzing.yaml").read_text())
+
+# number of concurrent requests when creating/cancelling tasks
+CANCEL_TASK_JOBS = 8
+CREATE_TASK_JOBS = 8
+# tasks are created by the decision task (deadline 1 hour) and task deadlines are
+# limited to 5 days by the queue. older hook fires can't have live tasks.
+MAX_FIRE_AGE = timedelta(days=5, hours=1)
+# index namespace of successful preprocess tasks, by pool and content key
+PREPROCESS_INDEX = "project.fuzzing.preprocess"
 
 
 def add_capabilities_for_scopes(task):
@@ -64,71 +152,158 @@ def add_capabilities_for_scopes(task):
         del capabilities["devices"]
 
 
-def cancel_tasks(worker_type):
+def _share_connections(client, size):
+    """Size the connection pool of a Taskcluster client for concurrent use
+
+    Args:
+        client (taskcluster.BaseClient): client shared between threads
+        size (int): number of connections to keep open
+    """
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    client.session.mount("https://", adapter)
+    client.session.mount("http://", adapter)
+
+
+def cancel_tasks(worker_type, jobs=CANCEL_TASK_JOBS):
+    """Cancel the pending & running tasks previously created by a pool's hook
+
+    Task groups of recent hook fires are listed concurrently, and live tasks are
+    cancelled as they are found. Fires older than `MAX_FIRE_AGE` can't contain
+    live tasks and are not listed. Fires are returned newest first, so paging stops
+    at the first page reaching them.
+
+    Args:
+        worker_type (str): hook id of the pool
+        jobs (int): maximum number of concurrent requests
+    """
     # Avoid cancelling self
     self_task_id = os.getenv("TASK_ID")
 
     hooks = taskcluster.get_service("hooks")
     queue = taskcluster.get_service("queue")
+    _share_connections(queue, jobs)
+
+    oldest = datetime.now(timezone.utc) - MAX_FIRE_AGE
+
+    def is_old(fire):
+        return dateutil.parser.isoparse(fire["taskCreateTime"]) < oldest
 
-    # Get tasks by hook
-    def iter_tasks_by_hook(hook_id):
+    def iter_fires(hook_id):
+        query = {}
         try:
-            for fire in hooks.listLastFires(HOOK_PREFIX, hook_id)["lastFires"]:
-                if fire["result"] != "success":
-                    continue
-                try:
-                    result = queue.listTaskGroup(fire["taskId"])
-                except TaskclusterFailure as exc:
-                    if "No task-group with taskGroupId" in str(exc):
-                        continue
-                    raise
-                while result.get("continuationToken"):
-                    yield from [
-                        (task, (fire["firedBy"] == "schedule"))
-                        for task in result["tasks"]
-                    ]
-                    result = queue.listTaskGroup(
-                        fire["taskId"],
-                        query={"continuationToken": result["continuationToken"]},
-                    )
-                yield from [
-                    (task, (fire["firedBy"] == "schedule")) for task in result["tasks"]
-                ]
+            while True:
+                result = hooks.listLastFires(HOOK_PREFIX, hook_id, query=query)
+                yield from result["lastFires"]
+                if not result.get("continuationToken"):
+                    break
+                if any(is_old(fire) for fire in result["lastFires"]):
+                    # the next pages only have older fires
+                    break
+                query = {"continuationToken": result["continuationToken"]}
         except TaskclusterRestFailure as msg:
             if "No such hook" in str(msg):
                 return
             raise
 
-    tasks_to_cancel = []
-    for task, scheduled in iter_tasks_by_hook(worker_type):
-        task_id = task["status"]["taskId"]
-
-        if task_id == self_task_id:
-            if scheduled:
-                # if this decision task was the result of a scheduled hook, don't
-                # cancel anything. if cycle_time is shorter than max_run_time, we
-                # want prior tasks to remain running
-                LOG.info(f"{self_task_id} is scheduled, not cancelling tasks")
-                return
-            # avoid cancelling self
+    fires = []
+    for fire in iter_fires(worker_type):
+        if fire["taskId"] == self_task_id and fire["firedBy"] == "schedule":
+            # if this decision task was the result of a scheduled hook, don't
+            # cancel anything. if cycle_time is shorter than max_run_time, we
+            # want prior tasks to remain running
+            LOG.info(f"{self_task_id} is scheduled, not cancelling tasks")
+            return
+        if fire["result"] != "success":
             continue
-
-        # State can be pending,running,completed,failed,exception
-        # We only cancel pending & running tasks
-        if any(
-            run["state"] in {"pending", "running"} for run in task["status"]["runs"]
-        ):
-            tasks_to_cancel.append(task_id)
-    LOG.info(f"{self_task_id} is cancelling {len(tasks_to_cancel)} tasks")
-
-    for task_id in tasks_to_cancel:
-        # Cancel the task
-        try:
-            LOG.warning(f"=> cancelling: {task_id}")
-            queue.cancelTask(task_id)
-        except Exception:
-            LOG.exception(f"Exception calling cancelTask({task_id})")
+        if is_old(fire):
+            continue
+        fires.append(fire)
+
+    def cancel(task_id):
+        LOG.warning(f"=> cancelling: {task_id}")
+        queue.cancelTask(task_id)
+
+    def cancel_group(executor, task_group_id):
+        """List a task group page by page, and queue live tasks for cancellation"""
+        cancels = {}
+        query = {}
+        while True:
+            try:
+                result = queue.listTaskGroup(task_group_id, query=query)
+            except TaskclusterFailure as exc:
+                if "No task-group with taskGroupId" in str(exc):
+                    break
+                raise
+            for task in result["tasks"]:
+                task_id = task["status"]["taskId"]
+                # State can be pending,running,completed,failed,exception
+                # We only cancel pending & running tasks
+                if task_id != self_task_id and any(
+                    run["state"] in {"pending", "running"}
+                    for run in task["status"]["runs"]
+                ):
+                    cancels[task_id] = executor.submit(cancel, task_id)
+            if not result.get("continuationToken"):
+                break
+            query = {"continuationToken": result["continuationToken"]}
+        return cancels
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        groups = [
+            executor.submit(cancel_group, executor, fire["taskId"]) for fire in fires
+        ]
+        cancels = {}
+        for future in groups:
+            cancels.update(future.result())
+        LOG.info(f"{self_task_id} is cancelling {len(cancels)} tasks")
+        for task_id, future in cancels.items():
+            try:
+                future.result()
+            except Exception:
+                LOG.exception(f"Exception calling cancelTask({task_id})")
+
+
+def create_tasks(tasks, jobs=CREATE_TASK_JOBS):
+    """Create tasks in Taskcluster concurrently
+
+    Tasks are created by a bounded thread pool sharing one connection pool. The
+    Taskcluster client already retries server errors with exponential backoff.
+    A task is only submitted once the tasks it depends on (if created by this call)
+    exist.
+
+    Args:
+        tasks (iterable of (str, dict)): task ids and definitions, as generated by
+                                         `build_tasks`
+        jobs (int): maximum number of concurrent requests
+
+    Raises:
+        RuntimeError: if any task could not be created, after trying all of them
+    """
+    queue = taskcluster.get_service("queue")
+    _share_connections(queue, jobs)
+
+    def _create(task_id, task):
+        LOG.info(f"Creating task {task['metadata']['name']} as {task_id}")
+        queue.createTask(task_id, task)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for task_id, task in tasks:
+            # wait until dependencies are created, these can't be satisfied otherwise
+            concurrent.futures.wait(
+                [futures[dep] for dep in task.get("dependencies", ()) if dep in futures]
+            )
+            futures[task_id] = executor.submit(_create, task_id, task)
+        for task_id, future in futures.items():
+            try:
+                future.result()
+            except Exception:
+                LOG.exception(f"Exception calling createTask({task_id})")
+                failed.append(task_id)
+    if failed:
+        LOG.error(f"Failed to create {len(failed)}/{len(futures)} tasks")
+        raise RuntimeError(f"Failed to create tasks: {', '.join(failed)}")
 
 
 class PoolConfiguration(CommonPoolConfiguration):
@@ -144,45 +319,26 @@ class PoolConfiguration(CommonPoolConfiguration):
         provider = providers[self.cloud]
 
         # Build the pool configuration for selected machines
-        machines = self.get_machine_list(machine_types)
+        machines = list(self.get_machine_list(machine_types))
+        prices = {
+            name: machine_types.price(self.cloud, self.cpu, name)
+            for name, _, _ in machines
+        }
         config = {
             "launchConfigs": provider.build_launch_configs(
-                self.imageset, machines, self.disk_size
+                self.imageset, machines, self.disk_size, prices
             ),
             "lifecycle": {
                 # give workers 15 minutes to register before assuming they're broken
                 "registrationTimeout": parse_time("15m"),
                 "reregistrationTimeout": parse_time("4d"),
             },
-            "maxCapacity": (
-                # add +1 to expected size, so if we manually trigger the hook, the new
-                # decision can run without also manually cancelling a task
-                # * 2 since Taskcluster seems to not reuse workers very quickly in some
-                # cases, so we end up with a lot of pending tasks.
-                max(1, math.ceil(self.max_run_time / self.cycle_time)) * self.tasks * 2
-                + 1
-            ),
+            "maxCapacity": self.max_capacity(),
             "minCapacity": 0,
         }
 
         # Build the decision task payload that will trigger the new fuzzing tasks
-        decision_task = yaml.safe_load(
-            DECISION_TASK.substitute(
-                description=DESCRIPTION.replace("\n", "\\n"),
-                max_run_time=parse_time("1h"),
-                owner_email=OWNER_EMAIL,
-                pool_id=self.pool_id,
-                provisioner=PROVISIONER_ID,
-                scheduler=SCHEDULER_ID,
-                secret=DECISION_TASK_SECRET,
-                task_id=self.task_id,
-            )
-        )
-        decision_task["scopes"] = sorted(chain(decision_task["scopes"], self.scopes))
-        add_capabilities_for_scopes(decision_task)
-        if env is not None:
-            assert set(decision_task["payload"]["env"]).isdisjoint(set(env))
-            decision_task["payload"]["env"].update(env)
+        decision_task = self.build_decision_task(env)
 
         pool = WorkerPool(
             config=config,
@@ -214,6 +370,38 @@ class PoolConfiguration(CommonPoolConfiguration):
 
         return [pool, hook, role]
 
+    def build_decision_task(self, env=None):
+        """Build the decision task triggered by the hook of this pool
+
+        Args:
+            env (dict): extra environment variables of the decision task
+
+        Returns:
+            dict: task definition
+        """
+        decision_task = DECISION_TASK.render(
+            description=DESCRIPTION,
+            max_run_time=parse_time("1h"),
+            owner_email=OWNER_EMAIL,
+            pool_id=self.pool_id,
+            provisioner=PROVISIONER_ID,
+            scheduler=SCHEDULER_ID,
+            secret=DECISION_TASK_SECRET,
+            task_id=self.task_id,
+        )
+        scopes = list(self.scopes)
+        if self.preprocess:
+            preprocess = self.create_preprocess()
+            if preprocess.preprocess_cache is not None:
+                # delegated to the preprocess task
+                scopes.append(f"queue:route:index.{PREPROCESS_INDEX}.{self.task_id}.*")
+        decision_task["scopes"] = sorted(chain(decision_task["scopes"], scopes))
+        add_capabilities_for_scopes(decision_task)
+        if env is not None:
+            assert set(decision_task["payload"]["env"]).isdisjoint(set(env))
+            decision_task["payload"]["env"].update(env)
+        return decision_task
+
     def artifact_map(self, expires):
         result = {}
         for local_path, value in self.artifacts.items():
@@ -232,31 +420,106 @@ class PoolConfiguration(CommonPoolConfiguration):
         }
         return result
 
-    def build_tasks(self, parent_task_id, env=None):
-        """Create fuzzing tasks and attach them to a decision task"""
-        now = datetime.utcnow()
-        preprocess_task_id = None
+    def find_preprocess(self, now=None):
+        """Compute the content key of the preprocess task, and find a previous
+        preprocess task with the same key.
+
+        The key is a digest of the preprocess configuration, and of the latest
+        tasks indexed in each of its `preprocess_cache` namespaces.
 
+        Args:
+            now (datetime): time the tasks are created (default: now)
+
+        Returns:
+            tuple (str, str): content key, or None if the pool has no cached
+                              preprocess. Id of the preprocess task to reuse, or None
+                              if a new one must run.
+        """
         preprocess = self.create_preprocess()
+        if preprocess is None or preprocess.preprocess_cache is None:
+            return None, None
+        if now is None:
+            now = datetime.utcnow()
+
+        index = taskcluster.get_service("index")
+        inputs = {}
+        for namespace in preprocess.preprocess_cache:
+            try:
+                inputs[namespace] = index.findTask(namespace)["taskId"]
+            except TaskclusterRestFailure as exc:
+                if exc.status_code != 404:
+                    raise
+                # the preprocess task can't run correctly, nothing to reuse
+                LOG.warning(f"No task indexed for preprocess input {namespace}")
+                inputs[namespace] = None
+        digest = hashlib.sha256(
+            json.dumps(
+                {"config": preprocess.as_data(), "inputs": inputs}, sort_keys=True
+            ).encode("utf-8")
+        )
+        key = digest.hexdigest()
+
+        namespace = f"{PREPROCESS_INDEX}.{self.task_id}.{key}"
+        try:
+            found = index.findTask(namespace)
+        except TaskclusterRestFailure as exc:
+            if exc.status_code != 404:
+                raise
+            LOG.info(f"No previous preprocess task for key {key}")
+            return key, None
+        # artifacts of the task must outlive the fuzzing tasks using them
+        expires = dateutil.parser.isoparse(found["expires"]).replace(tzinfo=None)
+        if expires < now + timedelta(seconds=self.max_run_time):
+            LOG.info(f"Previous preprocess task {found['taskId']} expires too soon")
+            return key, None
+        LOG.info(f"Reusing preprocess task {found['taskId']} for key {key}")
+        return key, found["taskId"]
+
+    def build_tasks(
+        self,
+        parent_task_id,
+        env=None,
+        now=None,
+        slug=slugId,
+        preprocess_key=None,
+        preprocess_task_id=None,
+    ):
+        """Create fuzzing tasks and attach them to a decision task
+
+        Args:
+            parent_task_id (str): decision task id
+            env (dict): extra environment variables of the tasks
+            now (datetime): time the tasks are created (default: now)
+            slug (callable): function generating task ids
+            preprocess_key (str): content key of the preprocess task, to index it
+                                  under when it succeeds
+            preprocess_task_id (str): previous preprocess task to depend on, instead
+                                      of creating a new one
+
+        Yields:
+            tuple (str, dict): task id and definition of each task
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        preprocess = None
+        if preprocess_task_id is None:
+            preprocess = self.create_preprocess()
         if preprocess is not None:
-            task = yaml.safe_load(
-                FUZZING_TASK.substitute(
-                    created=stringDate(now),
-                    deadline=stringDate(
-                        now + timedelta(seconds=preprocess.max_run_time)
-                    ),
-                    description=DESCRIPTION.replace("\n", "\\n"),
-                    expires=stringDate(fromNow("1 week", now)),
-                    max_run_time=preprocess.max_run_time,
-                    name=f"Fuzzing task {self.task_id} - preprocess",
-                    owner_email=OWNER_EMAIL,
-                    pool_id=self.pool_id,
-                    provisioner=PROVISIONER_ID,
-                    scheduler=SCHEDULER_ID,
-                    secret=DECISION_TASK_SECRET,
-                    task_group=parent_task_id,
-                    task_id=self.task_id,
-                )
+            task = FUZZING_TASK.render(
+                created=stringDate(now),
+                deadline=stringDate(now + timedelta(seconds=preprocess.max_run_time)),
+                description=DESCRIPTION,
+                expires=stringDate(fromNow("1 week", now)),
+                max_run_time=preprocess.max_run_time,
+                name=f"Fuzzing task {self.task_id} - preprocess",
+                owner_email=OWNER_EMAIL,
+                pool_id=self.pool_id,
+                provisioner=PROVISIONER_ID,
+                scheduler=SCHEDULER_ID,
+                secret=DECISION_TASK_SECRET,
+                task_group=parent_task_id,
+                task_id=self.task_id,
             )
             task["payload"]["artifacts"].update(
                 preprocess.artifact_map(stringDate(fromNow("1 week", now)))
@@ -265,31 +528,34 @@ class PoolConfiguration(CommonPoolConfiguration):
             # `container` can be either a string or a dict, so can't template it
             task["payload"]["image"] = preprocess.container
             task["scopes"] = sorted(chain(preprocess.scopes, task["scopes"]))
+            if preprocess_key is not None:
+                route = f"index.{PREPROCESS_INDEX}.{self.task_id}.{preprocess_key}"
+                task["routes"].append(route)
+                task["scopes"] = sorted(task["scopes"] + [f"queue:route:{route}"])
+                task["payload"]["env"]["FUZZING_PREPROCESS_KEY"] = preprocess_key
             add_capabilities_for_scopes(task)
             if env is not None:
                 assert set(task["payload"]["env"]).isdisjoint(set(env))
                 task["payload"]["env"].update(env)
 
-            preprocess_task_id = slugId()
+            preprocess_task_id = slug()
             yield preprocess_task_id, task
 
         for i in range(1, self.tasks + 1):
-            task = yaml.safe_load(
-                FUZZING_TASK.substitute(
-                    created=stringDate(now),
-                    deadline=stringDate(now + timedelta(seconds=self.max_run_time)),
-                    description=DESCRIPTION.replace("\n", "\\n"),
-                    expires=stringDate(fromNow("1 week", now)),
-                    max_run_time=self.max_run_time,
-                    name=f"Fuzzing task {self.task_id} - {i}/{self.tasks}",
-                    owner_email=OWNER_EMAIL,
-                    pool_id=self.pool_id,
-                    provisioner=PROVISIONER_ID,
-                    scheduler=SCHEDULER_ID,
-                    secret=DECISION_TASK_SECRET,
-                    task_group=parent_task_id,
-                    task_id=self.task_id,
-                )
+            task = FUZZING_TASK.render(
+                created=stringDate(now),
+                deadline=stringDate(now + timedelta(seconds=self.max_run_time)),
+                description=DESCRIPTION,
+                expires=stringDate(fromNow("1 week", now)),
+                max_run_time=self.max_run_time,
+                name=f"Fuzzing task {self.task_id} - {i}/{self.tasks}",
+                owner_email=OWNER_EMAIL,
+                pool_id=self.pool_id,
+                provisioner=PROVISIONER_ID,
+                scheduler=SCHEDULER_ID,
+                secret=DECISION_TASK_SECRET,
+                task_group=parent_task_id,
+                task_id=self.task_id,
             )
             task["payload"]["artifacts"].update(
                 self.artifact_map(stringDate(fromNow("1 week", now)))
@@ -298,13 +564,17 @@ class PoolConfiguration(CommonPoolConfiguration):
             task["payload"]["image"] = self.container
             if preprocess_task_id is not None:
                 task["dependencies"].append(preprocess_task_id)
+                # a reused preprocess task is in another task group
+                task["payload"]["env"][
+                    "TASKCLUSTER_FUZZING_PREPROCESS_TASK"
+                ] = preprocess_task_id
             task["scopes"] = sorted(chain(self.scopes, task["scopes"]))
             add_capabilities_for_scopes(task)
             if env is not None:
                 assert set(task["payload"]["env"]).isdisjoint(set(env))
                 task["payload"]["env"].update(env)
 
-            yield slugId(), task
+            yield slug(), task
 
 
 class PoolConfigMap(CommonPoolConfigMap):
@@ -321,42 +591,27 @@ class PoolConfigMap(CommonPoolConfigMap):
         assert self.cloud in providers, f"Cloud Provider {self.cloud} not available"
         provider = providers[self.cloud]
 
-        pools = list(self.iterpools())
-        all_scopes = tuple(set(chain.from_iterable(pool.scopes for pool in pools)))
-
         # Build the pool configuration for selected machines
-        machines = self.get_machine_list(machine_types)
+        machines = list(self.get_machine_list(machine_types))
+        prices = {
+            name: machine_types.price(self.cloud, self.cpu, name)
+            for name, _, _ in machines
+        }
         config = {
             "launchConfigs": provider.build_launch_configs(
-                self.imageset, machines, self.disk_size
+                self.imageset, machines, self.disk_size, prices
             ),
             "lifecycle": {
                 # give workers 15 minutes to register before assuming they're broken
                 "registrationTimeout": parse_time("15m"),
                 "reregistrationTimeout": parse_time("4d"),
             },
-            "maxCapacity": max(sum(pool.tasks for pool in pools) * 2, 3),
+            "maxCapacity": self.max_capacity(),
             "minCapacity": 0,
         }
 
         # Build the decision task payload that will trigger the new fuzzing tasks
-        decision_task = yaml.safe_load(
-            DECISION_TASK.substitute(
-                description=DESCRIPTION.replace("\n", "\\n"),
-                max_run_time=parse_time("1h"),
-                owner_email=OWNER_EMAIL,
-                pool_id=self.pool_id,
-                provisioner=PROVISIONER_ID,
-                scheduler=SCHEDULER_ID,
-                secret=DECISION_TASK_SECRET,
-                task_id=self.task_id,
-            )
-        )
-        decision_task["scopes"] = sorted(chain(decision_task["scopes"], all_scopes))
-        add_capabilities_for_scopes(decision_task)
-        if env is not None:
-            assert set(decision_task["payload"]["env"]).isdisjoint(set(env))
-            decision_task["payload"]["env"].update(env)
+        decision_task = self.build_decision_task(env)
 
         pool = WorkerPool(
             config=config,
@@ -388,31 +643,90 @@ class PoolConfigMap(CommonPoolConfigMap):
 
         return [pool, hook, role]
 
-    def build_tasks(self, parent_task_id, env=None):
-        """Create fuzzing tasks and attach them to a decision task"""
-        now = datetime.utcnow()
+    def build_decision_task(self, env=None):
+        """Build the decision task triggered by the hook of this pool
+
+        Args:
+            env (dict): extra environment variables of the decision task
+
+        Returns:
+            dict: task definition
+        """
+        decision_task = DECISION_TASK.render(
+            description=DESCRIPTION,
+            max_run_time=parse_time("1h"),
+            owner_email=OWNER_EMAIL,
+            pool_id=self.pool_id,
+            provisioner=PROVISIONER_ID,
+            scheduler=SCHEDULER_ID,
+            secret=DECISION_TASK_SECRET,
+            task_id=self.task_id,
+        )
+        decision_task["scopes"] = sorted(
+            chain(
+                decision_task["scopes"],
+                set(chain.from_iterable(pool.scopes for pool in self.pools)),
+            )
+        )
+        add_capabilities_for_scopes(decision_task)
+        if env is not None:
+            assert set(decision_task["payload"]["env"]).isdisjoint(set(env))
+            decision_task["payload"]["env"].update(env)
+        return decision_task
+
+    def find_preprocess(self, now=None):
+        """Pool maps can't have a preprocess task
+
+        Returns:
+            tuple (None, None)
+        """
+        return None, None
+
+    def build_tasks(
+        self,
+        parent_task_id,
+        env=None,
+        now=None,
+        slug=slugId,
+        preprocess_key=None,
+        preprocess_task_id=None,
+    ):
+        """Create fuzzing tasks and attach them to a decision task
+
+        Args:
+            parent_task_id (str): decision task id
+            env (dict): extra environment variables of the tasks
+            now (datetime): time the tasks are created (default: now)
+            slug (callable): function generating task ids
+            preprocess_key (str): unused, pool maps can't have a preprocess task
+            preprocess_task_id (str): unused, pool maps can't have a preprocess task
+
+        Yields:
+            tuple (str, dict): task id and definition of each task
+        """
+        assert preprocess_key is None and preprocess_task_id is None
+        if now is None:
+            now = datetime.utcnow()
 
         for pool in self.iterpools():
             for i in range(1, pool.tasks + 1):
-                task = yaml.safe_load(
-                    FUZZING_TASK.substitute(
-                        created=stringDate(now),
-                        deadline=stringDate(now + timedelta(seconds=pool.max_run_time)),
-                        description=DESCRIPTION.replace("\n", "\\n"),
-                        expires=stringDate(fromNow("1 week", now)),
-                        max_run_time=pool.max_run_time,
-                        name=(
-                            f"Fuzzing task {pool.platform}-{pool.pool_id} - "
-                            f"{i}/{pool.tasks}"
-                        ),
-                        owner_email=OWNER_EMAIL,
-                        pool_id=pool.pool_id,
-                        provisioner=PROVISIONER_ID,
-                        scheduler=SCHEDULER_ID,
-                        secret=DECISION_TASK_SECRET,
-                        task_group=parent_task_id,
-                        task_id=self.task_id,
-                    )
+                task = FUZZING_TASK.render(
+                    created=stringDate(now),
+                    deadline=stringDate(now + timedelta(seconds=pool.max_run_time)),
+                    description=DESCRIPTION,
+                    expires=stringDate(fromNow("1 week", now)),
+                    max_run_time=pool.max_run_time,
+                    name=(
+                        f"Fuzzing task {pool.platform}-{pool.pool_id} - "
+                        f"{i}/{pool.tasks}"
+                    ),
+                    owner_email=OWNER_EMAIL,
+                    pool_id=pool.pool_id,
+                    provisioner=PROVISIONER_ID,
+                    scheduler=SCHEDULER_ID,
+                    secret=DECISION_TASK_SECRET,
+                    task_group=parent_task_id,
+                    task_id=self.task_id,
                 )
                 task["payload"]["artifacts"].update(
                     pool.artifact_map(stringDate(fromNow("1 week", now)))
@@ -425,17 +739,23 @@ class PoolConfigMap(CommonPoolConfigMap):
                     assert set(task["payload"]["env"]).isdisjoint(set(env))
                     task["payload"]["env"].update(env)
 
-                yield slugId(), task
+                yield slug(), task
 
 
 class PoolConfigLoader:
     @staticmethod
-    def from_file(pool_yml):
-        assert pool_yml.is_file()
-        data = yaml.safe_load(pool_yml.read_text())
+    def from_file(pool_yml, resolver=None):
+        resolver = resolver or PoolConfigResolver()
+        data = resolver.load(pool_yml)
         for cls in (PoolConfiguration, PoolConfigMap):
             if set(cls.FIELD_TYPES) >= set(data) >= cls.REQUIRED_FIELDS:
-                return cls(pool_yml.stem, data, base_dir=pool_yml.parent)
+                return cls(
+                    pool_yml.stem,
+                    data,
+                    base_dir=pool_yml.parent,
+                    resolver=resolver,
+                    _source=pool_yml,
+                )
         LOG.error(
             f"{pool_yml} has keys {data.keys()} and expected all of either "
             f"{PoolConfiguration.REQUIRED_FIELDS} or {PoolConfigMap.REQUIRED_FIELDS} "
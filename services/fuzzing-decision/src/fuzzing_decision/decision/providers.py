@@ -1,23 +1,160 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import hashlib
 import json
 import logging
+import math
 
 import yaml
 
 LOG = logging.getLogger(__name__)
 
 
+def _read_only(*args, **kwds):
+    raise TypeError("worker configurations are shared, and can't be modified")
+
+
+class _FrozenDict(dict):
+    """dict which can't be modified, so it can be shared by all launch configs"""
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class _FrozenList(list):
+    """list which can't be modified, so it can be shared by all launch configs"""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def _freeze(value):
+    """Recursively convert dicts & lists to read-only equivalents
+
+    Args:
+        value (object): JSON-like data
+
+    Returns:
+        object: the same data, which can't be modified
+    """
+    if isinstance(value, dict):
+        return _FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return _FrozenList(_freeze(item) for item in value)
+    return value
+
+
+class LaunchConfigPolicy:
+    """Pruning and ranking of the launch configs of a provider.
+
+    When there are more launch configs than `max_launch_configs`, they are ranked
+    by the price of their machine type, and locations with a higher capacity hint
+    are preferred when prices are equal. Only the best are kept, in the order they
+    were generated, so the worker pool doesn't change when prices do unless other
+    launch configs are kept.
+
+    Args:
+        max_launch_configs (int): number of launch configs kept for each pool, or
+                                  None to keep all of them
+        capacity_hints (dict): region or zone -> relative capacity available there.
+                               Locations with no capacity are excluded, others
+                               default to 1.
+    """
+
+    FIELDS = frozenset(("capacity_hints", "max_launch_configs"))
+
+    def __init__(self, max_launch_configs=None, capacity_hints=None):
+        assert (
+            max_launch_configs is None or max_launch_configs > 0
+        ), "max_launch_configs must be positive"
+        self.max_launch_configs = max_launch_configs
+        self.capacity_hints = capacity_hints or {}
+
+    @classmethod
+    def from_data(cls, data):
+        """Load the policy of each provider from launch-configs.yml
+
+        Args:
+            data (dict): provider -> policy fields
+
+        Returns:
+            dict: provider -> LaunchConfigPolicy
+        """
+        result = {}
+        for provider, fields in data.items():
+            extra = set(fields) - cls.FIELDS
+            assert not extra, f"{provider} launch policy has unknown keys: {extra!r}"
+            result[provider] = cls(**fields)
+        return result
+
+    def capacity_hint(self, region, zone):
+        return self.capacity_hints.get(zone, self.capacity_hints.get(region, 1))
+
+    def select(self, candidates, prices=None):
+        """Prune launch configs
+
+        Args:
+            candidates (list): (launch config, machine type, region, zone) of each
+                               launch config, in the order they were generated
+            prices (dict): machine type -> hourly price (see `MachineTypes.price`)
+
+        Returns:
+            list of dict: launch configs kept, in the order they were generated
+        """
+        prices = prices or {}
+        ranked = []
+        for index, (_, machine, region, zone) in enumerate(candidates):
+            hint = self.capacity_hint(region, zone)
+            if hint <= 0:
+                continue
+            # machine types are matched on their cpu count, so each fits one task
+            price = prices.get(machine)
+            ranked.append((math.inf if price is None else price, -hint, index))
+        limit = self.max_launch_configs
+        if limit is not None and len(ranked) > limit:
+            # rank only to pick the launch configs kept, not to list them
+            ranked = sorted(ranked)[:limit]
+            ranked.sort(key=lambda entry: entry[2])
+        if len(ranked) < len(candidates):
+            LOG.debug(f"Kept {len(ranked)}/{len(candidates)} launch configs")
+        return [candidates[index][0] for _, _, index in ranked]
+
+
 class Provider(object):
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, policy=None):
         self.imagesets = yaml.safe_load(
             (base_dir / "config" / "imagesets.yml").read_text()
         )
+        self.policy = policy or LaunchConfigPolicy()
+        # imageset -> worker config
+        self._worker_configs = {}
 
     def get_worker_config(self, worker):
+        """Get the worker configuration of an imageset.
+
+        It only depends on the imageset, so it is built once, and the same read-only
+        instance is shared by every launch config using it.
+
+        Args:
+            worker (str): imageset name
+
+        Returns:
+            dict: worker configuration, including its deploymentId
+        """
+        if worker not in self._worker_configs:
+            self._worker_configs[worker] = _freeze(self._build_worker_config(worker))
+        return self._worker_configs[worker]
+
+    def _build_worker_config(self, worker):
         assert worker in self.imagesets, f"Missing worker {worker}"
-        out = self.imagesets[worker].get("workerConfig", {})
+        out = copy.deepcopy(self.imagesets[worker].get("workerConfig", {}))
         out.setdefault("dockerConfig", {})
         out.setdefault("genericWorker", {})
         out["genericWorker"].setdefault("config", {})
@@ -47,9 +184,9 @@ class Provider(object):
 class AWS(Provider):
     """Amazon Cloud provider config for Taskcluster"""
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, policy=None):
         # Load configuration from cloned community config
-        super().__init__(base_dir)
+        super().__init__(base_dir, policy)
         self.regions = self.load_regions(base_dir / "config" / "aws.yml")
         LOG.info("Loaded AWS configuration")
 
@@ -73,42 +210,50 @@ class AWS(Provider):
         assert worker in self.imagesets, f"Missing worker {worker}"
         return self.imagesets[worker]["aws"]["amis"]
 
-    def build_launch_configs(self, imageset, machines, disk_size):
+    def build_launch_configs(self, imageset, machines, disk_size, prices=None):
         # Load the AWS infos for that imageset
         amis = self.get_amis(imageset)
         worker_config = self.get_worker_config(imageset)
 
-        return [
-            {
-                "capacityPerInstance": capacity,
-                "region": region_name,
-                "launchConfig": {
-                    "ImageId": amis[region_name],
-                    "Placement": {"AvailabilityZone": az},
-                    "SubnetId": subnet,
-                    "SecurityGroupIds": [
-                        # Always use the no-inbound sec group
-                        region["security_groups"]["no-inbound"]
-                    ],
-                    "InstanceType": instance,
-                    # Always use spot instances
-                    "InstanceMarketOptions": {"MarketType": "spot"},
-                },
-                "workerConfig": worker_config,
-            }
-            for instance, capacity, az_blacklist in machines
-            for region_name, region in self.regions.items()
-            for az, subnet in region["subnets"].items()
-            if region_name in amis and az not in az_blacklist
-        ]
+        return self.policy.select(
+            [
+                (
+                    {
+                        "capacityPerInstance": capacity,
+                        "region": region_name,
+                        "launchConfig": {
+                            "ImageId": amis[region_name],
+                            "Placement": {"AvailabilityZone": az},
+                            "SubnetId": subnet,
+                            "SecurityGroupIds": [
+                                # Always use the no-inbound sec group
+                                region["security_groups"]["no-inbound"]
+                            ],
+                            "InstanceType": instance,
+                            # Always use spot instances
+                            "InstanceMarketOptions": {"MarketType": "spot"},
+                        },
+                        "workerConfig": worker_config,
+                    },
+                    instance,
+                    region_name,
+                    az,
+                )
+                for instance, capacity, az_blacklist in machines
+                for region_name, region in self.regions.items()
+                for az, subnet in region["subnets"].items()
+                if region_name in amis and az not in az_blacklist
+            ],
+            prices,
+        )
 
 
 class GCP(Provider):
     """Google Cloud provider config for Taskcluster"""
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, policy=None):
         # Load configuration from cloned community config
-        super().__init__(base_dir)
+        super().__init__(base_dir, policy)
         gcp_config = yaml.safe_load((base_dir / "config" / "gcp.yml").read_text())
         assert "regions" in gcp_config, "Missing regions in gcp config"
         self.regions = {
@@ -117,7 +262,7 @@ class GCP(Provider):
         }
         LOG.info("Loaded GCP configuration")
 
-    def build_launch_configs(self, imageset, machines, disk_size):
+    def build_launch_configs(self, imageset, machines, disk_size, prices=None):
 
         # Load source image
         assert imageset in self.imagesets, f"Missing imageset {imageset}"
@@ -127,29 +272,39 @@ class GCP(Provider):
         source_image = self.imagesets[imageset]["gcp"]["image"]
         worker_config = self.get_worker_config(imageset)
 
-        return [
-            {
-                "capacityPerInstance": capacity,
-                "machineType": f"zones/{zone}/machineTypes/{instance}",
-                "region": region,
-                "zone": zone,
-                "scheduling": {"onHostMaintenance": "terminate"},
-                "disks": [
+        return self.policy.select(
+            [
+                (
                     {
-                        "type": "PERSISTENT",
-                        "boot": True,
-                        "autoDelete": True,
-                        "initializeParams": {
-                            "sourceImage": source_image,
-                            "diskSizeGb": disk_size,
-                        },
-                    }
-                ],
-                "networkInterfaces": [{"accessConfigs": [{"type": "ONE_TO_ONE_NAT"}]}],
-                "workerConfig": worker_config,
-            }
-            for instance, capacity, zone_blacklist in machines
-            for region, zones in self.regions.items()
-            for zone in zones
-            if zone not in zone_blacklist
-        ]
+                        "capacityPerInstance": capacity,
+                        "machineType": f"zones/{zone}/machineTypes/{instance}",
+                        "region": region,
+                        "zone": zone,
+                        "scheduling": {"onHostMaintenance": "terminate"},
+                        "disks": [
+                            {
+                                "type": "PERSISTENT",
+                                "boot": True,
+                                "autoDelete": True,
+                                "initializeParams": {
+                                    "sourceImage": source_image,
+                                    "diskSizeGb": disk_size,
+                                },
+                            }
+                        ],
+                        "networkInterfaces": [
+                            {"accessConfigs": [{"type": "ONE_TO_ONE_NAT"}]}
+                        ],
+                        "workerConfig": worker_config,
+                    },
+                    instance,
+                    region,
+                    zone,
+                )
+                for instance, capacity, zone_blacklist in machines
+                for region, zones in self.regions.items()
+                for zone in zones
+                if zone not in zone_blacklist
+            ],
+            prices,
+        )
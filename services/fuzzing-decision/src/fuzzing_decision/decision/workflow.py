@@ -5,25 +5,150 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import atexit
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing
+import os
 import pathlib
 import re
 import shutil
 import tempfile
+import time
+from datetime import datetime
 
 import yaml
 from tcadmin.appconfig import AppConfig
+from tcadmin.resources.resources import Resource
 
-from ..common import taskcluster
-from ..common.pool import MachineTypes
+from ..common.pool import SHARED_CONFIG_FILES, MachineTypes
+from ..common.timing import profile_until_exit, timings
 from ..common.workflow import Workflow as CommonWorkflow
 from . import HOOK_PREFIX, WORKER_POOL_PREFIX
-from .pool import PoolConfigLoader, cancel_tasks
-from .providers import AWS, GCP
+from .pool import PoolConfigLoader, cancel_tasks, create_tasks
+from .providers import AWS, GCP, LaunchConfigPolicy
 
 LOG = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def generator_digest():
+    """Digest of the code generating the resources (the Python modules and task
+    templates of GENERATOR_PACKAGES)
+
+    Returns:
+        str: sha256 hex digest
+    """
+    root = pathlib.Path(__file__).resolve().parent.parent
+    digest = hashlib.sha256()
+    for package in GENERATOR_PACKAGES:
+        for path in sorted((root / package).rglob("*")):
+            if path.suffix in {".py", ".yaml"}:
+                digest.update(path.relative_to(root).as_posix().encode("utf-8"))
+                digest.update(b"\0")
+                digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# time allowed to clone the fuzzing & community configuration repos, in seconds
+CLONE_TIMEOUT = 15 * 60
+
+# bump when changes to the generated resources invalidate cached resources
+RESOURCES_CACHE_VERSION = 2
+# packages generating the resources, cached resources are invalidated when their
+# code changes
+GENERATOR_PACKAGES = ("common", "decision")
+
+# time tasks are created at when rendered, so renders can be compared
+RENDER_TIME = datetime(2000, 1, 1)
+RENDER_FORMATS = ("jsonl", "json")
+
+# state shared by all pools built in a worker process (see `Workflow.generate`)
+_WORKER_STATE = {}
+
+
+@contextlib.contextmanager
+def current_appconfig(appconfig):
+    """Make an AppConfig the current one, as tc-admin does while generating
+    resources. tc-admin resources need it to format their descriptions.
+
+    Args:
+        appconfig (tcadmin.appconfig.AppConfig): configuration to use
+    """
+    # tc-admin doesn't expose this outside of itself
+    with AppConfig._as_current(appconfig):
+        yield
+
+
+def _init_worker(clouds, machines, env, resolver, description_prefix):
+    appconfig = AppConfig()
+    appconfig.description_prefix = description_prefix
+    _WORKER_STATE.update(
+        appconfig=appconfig,
+        clouds=clouds,
+        env=env,
+        machines=machines,
+        resolver=resolver,
+    )
+
+
+def _build_pool_resources(config_file):
+    """Build the tc-admin resources for a pool file, in a worker process
+
+    Returns:
+        str: JSON object holding the resources (tc-admin resources can't be
+             pickled), and the phases timed while building them
+    """
+    # only send the phases of this pool back
+    timings.clear()
+    with current_appconfig(_WORKER_STATE["appconfig"]), timings.phase(
+        "build_resources", pool=config_file.name
+    ):
+        pool_config = PoolConfigLoader.from_file(
+            config_file, resolver=_WORKER_STATE["resolver"]
+        )
+        resources = pool_config.build_resources(
+            _WORKER_STATE["clouds"], _WORKER_STATE["machines"], _WORKER_STATE["env"]
+        )
+    return json.dumps(
+        {
+            "phases": timings.as_json()["phases"],
+            "resources": [resource.to_json() for resource in resources],
+        }
+    )
+
+
+def _resources_from_json(get_result):
+    """Wrap a worker result getter to return tc-admin resources"""
+
+    def _get():
+        result = json.loads(get_result())
+        timings.merge(result["phases"])
+        return _resources_from_data(result["resources"])
+
+    return _get
+
+
+def _resources_from_data(data, env=None):
+    """Create tc-admin resources from their JSON representation
+
+    Args:
+        data (list of dict): resources, as returned by `to_json()`
+        env (dict): if given, environment updated in the decision task of hooks
+    """
+    result = []
+    for resource in data:
+        if env and resource["kind"] == "Hook":
+            resource["task"]["payload"]["env"].update(env)
+        result.append(Resource.from_json(resource))
+    return result
+
+
 class Workflow(CommonWorkflow):
     """Fuzzing decision task workflow"""
 
@@ -58,36 +183,111 @@ class Workflow(CommonWorkflow):
             secret=appconfig.options.get("fuzzing_taskcluster_secret"),
             fuzzing_git_repository=appconfig.options.get("fuzzing_git_repository"),
             fuzzing_git_revision=appconfig.options.get("fuzzing_git_revision"),
+            snapshot_dir=appconfig.options.get("fuzzing_snapshot_dir"),
+            git_cache_dir=appconfig.options.get("fuzzing_git_cache_dir"),
         )
 
+        timings_path = appconfig.options.get("fuzzing_timings")
+        if timings_path is not None:
+            timings.save_at_exit(pathlib.Path(timings_path))
+        profile_path = appconfig.options.get("fuzzing_profile")
+        if profile_path is not None:
+            profile_until_exit(pathlib.Path(profile_path))
+
+        # tc-admin options are not typed, they are given as strings
+        jobs = appconfig.options.get("fuzzing_jobs")
+        if jobs is not None:
+            jobs = int(jobs)
+
         # Retrieve remote repositories
         workflow.clone(config)
 
         # Then generate all our Taskcluster resources
-        workflow.generate(resources, config)
+        with timings.phase("generate"):
+            workflow.generate(
+                resources,
+                config,
+                jobs=jobs,
+                base_revision=appconfig.options.get("fuzzing_base_revision"),
+            )
 
     def clone(self, config):
         """Clone remote repositories according to current setup"""
         super().clone(config)
 
-        # Clone fuzzing & community configuration repos
-        self.fuzzing_config_dir = self.git_clone(**config["fuzzing_config"])
-        self.community_config_dir = self.git_clone(**config["community_config"])
-
-    def generate(self, resources, config):
+        # Clone fuzzing & community configuration repos concurrently
+        deadline = time.monotonic() + CLONE_TIMEOUT
+        with timings.phase("clone"), concurrent.futures.ThreadPoolExecutor(
+            max_workers=2
+        ) as executor:
+            clones = {
+                "fuzzing_config": executor.submit(
+                    self.clone_fuzzing_config,
+                    config,
+                    deadline=deadline,
+                    write_snapshot=True,
+                ),
+                "community_config": executor.submit(
+                    self.git_clone,
+                    cache_dir=config.get("git_cache_dir"),
+                    deadline=deadline,
+                    **config["community_config"],
+                ),
+            }
+        failed = []
+        for name, future in clones.items():
+            try:
+                result = future.result()
+            except Exception:
+                LOG.exception(f"Failed to clone {name}")
+                failed.append(name)
+                continue
+            # set even if the other clone failed, so cleanup() removes it
+            if name == "community_config":
+                self.community_config_dir = result
+        if failed:
+            raise RuntimeError(f"Failed to clone {', '.join(failed)}")
+
+    def generate(self, resources, config, jobs=None, base_revision=None):
+        """Generate the tc-admin resources for all the pools in the fuzzing config
+
+        When `snapshot_dir` is configured, the resources generated for the fuzzing
+        configuration commit are cached there, along with digests of their inputs.
+
+        Args:
+            resources (tcadmin.resources.Resources): collection to update
+            config (dict): workflow configuration
+            jobs (int): number of processes used to build pool resources. Pools are
+                        built in this process if not greater than 1.
+            base_revision (str): fuzzing configuration commit previously generated.
+                                 Pools whose inputs didn't change since then reuse
+                                 the resources cached for it.
+        """
 
         # Setup resources manager to track only fuzzing instances
         for pattern in self.build_resources_patterns():
             resources.manage(pattern)
 
+        # Load the launch config policies, if any
+        policies = {}
+        policies_path = self.fuzzing_config_dir / "launch-configs.yml"
+        if self.resolver.exists(policies_path):
+            policies = LaunchConfigPolicy.from_data(self.resolver.load(policies_path))
+
         # Load the cloud configuration from community config
         clouds = {
-            "aws": AWS(self.community_config_dir),
-            "gcp": GCP(self.community_config_dir),
+            "aws": AWS(self.community_config_dir, policies.get("aws")),
+            "gcp": GCP(self.community_config_dir, policies.get("gcp")),
         }
 
-        # Load the machine types
-        machines = MachineTypes.from_file(self.fuzzing_config_dir / "machines.yml")
+        # Load the machine types, and their prices if a snapshot is available
+        prices = None
+        prices_path = self.fuzzing_config_dir / "spot-prices.yml"
+        if self.resolver.exists(prices_path):
+            prices = self.resolver.load(prices_path)
+        machines = MachineTypes(
+            self.resolver.load(self.fuzzing_config_dir / "machines.yml"), prices
+        )
 
         # Pass fuzzing-tc-config repository through to decision tasks, if specified
         env = {}
@@ -96,9 +296,272 @@ class Workflow(CommonWorkflow):
             env["FUZZING_GIT_REVISION"] = config["fuzzing_config"]["revision"]
 
         # Browse the files in the repo
-        for config_file in self.fuzzing_config_dir.glob("pool*.yml"):
-            pool_config = PoolConfigLoader.from_file(config_file)
-            resources.update(pool_config.build_resources(clouds, machines, env))
+        config_files = self.resolver.glob(self.fuzzing_config_dir, "pool*.yml")
+
+        cache_dir = config.get("snapshot_dir")
+        state = None
+        cached = {}
+        if cache_dir is not None:
+            cache_dir = pathlib.Path(cache_dir)
+            with timings.phase("resources_state"):
+                state = self._resources_state(config_files, clouds, env)
+            if base_revision is not None:
+                cached = self._load_cached_resources(
+                    cache_dir / f"{base_revision}.resources.json", state, env
+                )
+        build_files = [
+            config_file for config_file in config_files if config_file not in cached
+        ]
+
+        if jobs is not None and jobs > 1:
+            LOG.info(
+                f"Generating resources for {len(build_files)} pools using {jobs} "
+                "processes"
+            )
+            with multiprocessing.Pool(
+                jobs,
+                initializer=_init_worker,
+                initargs=(
+                    clouds,
+                    machines,
+                    env,
+                    self.resolver,
+                    AppConfig.current().description_prefix,
+                ),
+            ) as pool:
+                results = {
+                    config_file: _resources_from_json(
+                        pool.apply_async(_build_pool_resources, (config_file,)).get,
+                    )
+                    for config_file in build_files
+                }
+                results.update(cached)
+                self._merge_and_cache(
+                    resources, config_files, results, cache_dir, state
+                )
+        else:
+
+            def _build(config_file):
+                with timings.phase("build_resources", pool=config_file.name):
+                    pool_config = PoolConfigLoader.from_file(
+                        config_file, resolver=self.resolver
+                    )
+                    return pool_config.build_resources(clouds, machines, env)
+
+            results = {
+                config_file: functools.partial(_build, config_file)
+                for config_file in build_files
+            }
+            results.update(cached)
+            self._merge_and_cache(resources, config_files, results, cache_dir, state)
+
+    def _merge_and_cache(self, resources, config_files, results, cache_dir, state):
+        """Merge pool resources in config file order, and cache them if possible
+
+        Args:
+            resources (tcadmin.resources.Resources): collection to update
+            config_files (list of Path): pool files, in order
+            results (dict): pool file -> function returning its resources
+            cache_dir (Path): directory where resources are cached, or None
+            state (dict): inputs of the pools (see `_resources_state`)
+        """
+        built = {}
+        try:
+            self._merge_resources(
+                resources,
+                ((config_file, results[config_file]) for config_file in config_files),
+                built,
+            )
+        finally:
+            if cache_dir is not None and self.fuzzing_config_revision is not None:
+                self._save_cached_resources(cache_dir, state, built)
+
+    def _resources_state(self, config_files, clouds, env):
+        """Compute digests of everything the pool resources are generated from
+
+        Args:
+            config_files (list of Path): pool files
+            clouds (dict): cloud providers
+            env (dict): environment passed to decision tasks
+
+        Returns:
+            dict: "dependencies" maps each pool file name to the names of its inputs
+                  (None if it can't be loaded), "files" maps each input name to its
+                  digest, and "inputs" is the digest of inputs shared by all pools
+        """
+
+        def _default(obj):
+            # timestamps are written like in configuration snapshots, so files
+            # loaded from either have the same digest
+            if isinstance(obj, datetime):
+                return obj.isoformat()
+            return str(obj)
+
+        def _digest(data):
+            payload = json.dumps(data, sort_keys=True, default=_default).encode("utf-8")
+            return hashlib.sha256(payload).hexdigest()
+
+        # files used by every pool
+        shared = ["machines.yml"] + [
+            name
+            for name in SHARED_CONFIG_FILES
+            if self.resolver.exists(self.fuzzing_config_dir / name)
+        ]
+        files = {
+            name: _digest(self.resolver.load(self.fuzzing_config_dir / name))
+            for name in shared
+        }
+        dependencies = {}
+        for config_file in config_files:
+            try:
+                # only the files are read, pools are flattened if they are built
+                paths = self.resolver.dependencies(config_file)
+            except Exception:
+                # errors are reported when building the pool
+                dependencies[config_file.name] = None
+                continue
+            names = set(shared)
+            for path, data in paths.items():
+                names.add(path.name)
+                if path.name not in files:
+                    files[path.name] = _digest(data)
+                # every imageset named in the files, one of them is used
+                imageset = data.get("imageset")
+                if imageset is not None:
+                    name = f"imageset:{imageset}"
+                    if name not in files:
+                        # imagesets are shared by all providers
+                        files[name] = _digest(clouds["aws"].imagesets.get(imageset))
+                    names.add(name)
+            dependencies[config_file.name] = sorted(names)
+
+        # the revision changes on every commit, it is updated in cached hooks
+        env = {
+            key: value for key, value in env.items() if key != "FUZZING_GIT_REVISION"
+        }
+        community = {
+            path.name: path.read_text()
+            for path in (self.community_config_dir / "config").glob("*.yml")
+            if path.name != "imagesets.yml"
+        }
+        inputs = _digest(
+            {
+                "community": community,
+                "env": env,
+                "generator": generator_digest(),
+                "version": RESOURCES_CACHE_VERSION,
+            }
+        )
+        return {"dependencies": dependencies, "files": files, "inputs": inputs}
+
+    def _load_cached_resources(self, path, state, env):
+        """Load the cached resources of pools whose inputs didn't change
+
+        Args:
+            path (Path): resources cache of the base revision
+            state (dict): current inputs of the pools (see `_resources_state`)
+            env (dict): environment passed to decision tasks. Hooks are updated
+                        with it, so they use the current revision.
+
+        Returns:
+            dict: pool file -> function returning its cached resources
+        """
+        if not path.is_file():
+            LOG.info(f"No cached resources in {path}, generating all pools")
+            return {}
+        cache = json.loads(path.read_text())
+        if (
+            cache.get("version") != RESOURCES_CACHE_VERSION
+            or cache["inputs"] != state["inputs"]
+        ):
+            LOG.info(f"Shared inputs changed since {path}, generating all pools")
+            return {}
+
+        # reverse dependency index: input name -> names of the pools using it
+        dependents = collections.defaultdict(set)
+        for pool_name, inputs in state["dependencies"].items():
+            for name in inputs or ():
+                dependents[name].add(pool_name)
+
+        changed = {
+            name
+            for name in set(cache["files"]) | set(state["files"])
+            if cache["files"].get(name) != state["files"].get(name)
+        }
+        stale = set()
+        for name in changed:
+            stale.update(dependents[name])
+
+        result = {}
+        for pool_name, pool_resources in cache["pools"].items():
+            if pool_name in stale or state["dependencies"].get(pool_name) is None:
+                continue
+            result[self.fuzzing_config_dir / pool_name] = functools.partial(
+                _resources_from_data, pool_resources, env
+            )
+        LOG.info(
+            f"{len(changed)} input(s) changed since {cache['revision']}, reusing "
+            f"resources of {len(result)}/{len(state['dependencies'])} pools"
+        )
+        return result
+
+    def _save_cached_resources(self, cache_dir, state, built):
+        """Write the resources generated for the current revision to the cache
+
+        Args:
+            cache_dir (Path): directory where resources are cached
+            state (dict): current inputs of the pools (see `_resources_state`)
+            built (dict): pool file -> list of resources generated for it
+        """
+        revision = self.fuzzing_config_revision
+        cache = {
+            "files": state["files"],
+            "inputs": state["inputs"],
+            "pools": {
+                config_file.name: [resource.to_json() for resource in pool_resources]
+                for config_file, pool_resources in built.items()
+                if state["dependencies"].get(config_file.name) is not None
+            },
+            "revision": revision,
+            "version": RESOURCES_CACHE_VERSION,
+        }
+        path = cache_dir / f"{revision}.resources.json"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, caches may be shared by other processes
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        tmp_path.write_text(json.dumps(cache))
+        tmp_path.replace(path)
+        LOG.info(f"Saved generated resources for {revision}")
+
+    @staticmethod
+    def _merge_resources(resources, results, built=None):
+        """Add pool resources to the tc-admin resources, in the given order.
+
+        Errors are logged for each pool, and reported together once all pools are
+        merged.
+
+        Args:
+            resources (tcadmin.resources.Resources): collection to update
+            results (iterable of (Path, callable)): pool file and a function returning
+                                                    the resources built for it
+            built (dict): if given, updated with the resources of each pool merged
+        """
+        failed = []
+        for config_file, get_resources in results:
+            try:
+                pool_resources = get_resources()
+                resources.update(pool_resources)
+            except Exception:
+                LOG.exception(f"Failed to generate resources for {config_file.name}")
+                failed.append(config_file.name)
+                continue
+            if built is not None:
+                built[config_file] = pool_resources
+        if failed:
+            raise RuntimeError(
+                f"Failed to generate resources for {len(failed)} pool(s): "
+                f"{', '.join(failed)}"
+            )
 
     def build_resources_patterns(self):
         """Build regex patterns to manage our resources"""
@@ -141,9 +604,22 @@ class Workflow(CommonWorkflow):
             rf"Role=hook-id:{HOOK_PREFIX}/{role_suffix}",
         ]
 
-    def build_tasks(self, pool_name, task_id, config, dry_run=False):
+    def build_tasks(
+        self, pool_name, task_id, config, dry_run=False, launch_params=None
+    ):
+        """Create the fuzzing tasks of a pool
+
+        Args:
+            pool_name (str): pool to create tasks for
+            task_id (str): decision task id
+            config (dict): workflow configuration
+            dry_run (bool): build the tasks, but don't cancel or create any, nor
+                            look up a preprocess task to reuse
+            launch_params (Path): write the parameters of fuzzing-pool-launch for
+                                  this pool to this JSON file
+        """
         path = self.fuzzing_config_dir / f"{pool_name}.yml"
-        assert path.exists(), f"Missing pool {pool_name}"
+        assert self.resolver.exists(path), f"Missing pool {pool_name}"
 
         # Pass fuzzing-tc-config repository through to tasks, if specified
         env = {}
@@ -152,20 +628,129 @@ class Workflow(CommonWorkflow):
             env["FUZZING_GIT_REVISION"] = config["fuzzing_config"]["revision"]
 
         # Build tasks needed for a specific pool
-        pool_config = PoolConfigLoader.from_file(path)
+        with timings.phase("load_pool", pool=pool_name):
+            pool_config = PoolConfigLoader.from_file(path, resolver=self.resolver)
+
+        if launch_params is not None:
+            # published by the decision task, so tasks don't need to clone
+            params = pool_config.launch_params()
+            params["revision"] = self.fuzzing_config_revision
+            launch_params.write_text(json.dumps(params, sort_keys=True))
+            LOG.info(f"Saved launch parameters to {launch_params}")
 
         # cancel any previously running tasks
         if not dry_run:
-            cancel_tasks(pool_config.task_id)
+            with timings.phase("cancel_tasks", pool=pool_name):
+                cancel_tasks(pool_config.task_id)
 
-        tasks = pool_config.build_tasks(task_id, env)
+        # reuse the results of a previous preprocess task when its inputs match
+        preprocess_key, preprocess_task_id = None, None
+        if not dry_run:
+            with timings.phase("find_preprocess", pool=pool_name):
+                preprocess_key, preprocess_task_id = pool_config.find_preprocess()
+
+        with timings.phase("build_tasks", pool=pool_name):
+            tasks = list(
+                pool_config.build_tasks(
+                    task_id,
+                    env,
+                    preprocess_key=preprocess_key,
+                    preprocess_task_id=preprocess_task_id,
+                )
+            )
 
         if not dry_run:
             # Create all the tasks on taskcluster
-            queue = taskcluster.get_service("queue")
-            for task_id, task in tasks:
-                LOG.info(f"Creating task {task['metadata']['name']} as {task_id}")
-                queue.createTask(task_id, task)
+            with timings.phase("create_tasks", pool=pool_name):
+                create_tasks(tasks)
+
+    def render_tasks(self, output_dir, pool_names=None, output_format="jsonl"):
+        """Render the decision and fuzzing tasks of pools to files, without calling
+        Taskcluster.
+
+        Tasks are written one pool at a time, with fixed creation times and task ids
+        so renders of different configuration revisions can be compared. Pools share
+        the flattened configuration cached in the resolver. The sha256 of each pool's
+        tasks is written to `hashes.txt`.
+
+        Args:
+            output_dir (Path): directory to write to
+            pool_names (list of str): pools to render (default: all)
+            output_format (str): "jsonl" writes a line per task to `tasks.jsonl`,
+                                 "json" writes a list of tasks per pool to
+                                 `<pool>.json`
+
+        Returns:
+            dict: pool name -> sha256 of its tasks
+        """
+        assert output_format in RENDER_FORMATS, f"Unknown format {output_format}"
+        if pool_names is None:
+            paths = self.resolver.glob(self.fuzzing_config_dir, "pool*.yml")
+        else:
+            paths = [self.fuzzing_config_dir / f"{name}.yml" for name in pool_names]
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        hashes = {}
+        failed = []
+        jsonl = None
+        if output_format == "jsonl":
+            jsonl = (output_dir / "tasks.jsonl").open("w")
+        try:
+            for path in paths:
+                with timings.phase("render_tasks", pool=path.stem):
+                    try:
+                        lines = list(self._render_pool_tasks(path))
+                    except Exception:
+                        LOG.exception(f"Failed to render tasks for {path.stem}")
+                        failed.append(path.stem)
+                        continue
+                digest = hashlib.sha256()
+                for line in lines:
+                    digest.update(line.encode("utf-8"))
+                hashes[path.stem] = digest.hexdigest()
+                if jsonl is not None:
+                    jsonl.writelines(lines)
+                else:
+                    (output_dir / f"{path.stem}.json").write_text(
+                        "[\n"
+                        + ",\n".join(line.rstrip("\n") for line in lines)
+                        + "\n]\n"
+                    )
+        finally:
+            if jsonl is not None:
+                jsonl.close()
+            (output_dir / "hashes.txt").write_text(
+                "".join(f"{digest}  {name}\n" for name, digest in hashes.items())
+            )
+        if failed:
+            raise RuntimeError(
+                f"Failed to render tasks for {len(failed)} pool(s): {', '.join(failed)}"
+            )
+        LOG.info(f"Rendered tasks of {len(hashes)} pools to {output_dir}")
+        return hashes
+
+    def _render_pool_tasks(self, path):
+        """Render the tasks of a pool as JSON lines
+
+        Args:
+            path (Path): pool file
+
+        Yields:
+            str: JSON object for each task, with "pool", "taskId" and "task"
+        """
+        pool_config = PoolConfigLoader.from_file(path, resolver=self.resolver)
+        counter = itertools.count(1)
+
+        def _slug():
+            return f"task{next(counter)}"
+
+        tasks = itertools.chain(
+            [("decision", pool_config.build_decision_task())],
+            pool_config.build_tasks("decision", now=RENDER_TIME, slug=_slug),
+        )
+        for task_id, task in tasks:
+            line = {"pool": path.stem, "taskId": task_id, "task": task}
+            yield json.dumps(line, sort_keys=True) + "\n"
 
     def cleanup(self):
         """Cleanup temporary folders at end of execution"""
@@ -9,7 +9,9 @@ import logging
 import os
 
 from ..common.cli import build_cli_parser
+from ..common.pool import parse_size
 from .launcher import PoolLauncher
+from .logship import COMPRESSIONS, DEFAULT_COMPRESSION
 
 
 def main(args=None):
@@ -26,11 +28,62 @@ def main(args=None):
         help="Load the pre-process config instead of the normal pool config",
         default=os.environ.get("TASKCLUSTER_FUZZING_PREPROCESS") == "1",
     )
+    parser.add_argument(
+        "--decision-task-id",
+        type=str,
+        help="Load the pool from the launch parameters published by this decision "
+        "task, and only clone the fuzzing configuration if they are missing",
+        default=os.environ.get("TASKCLUSTER_FUZZING_DECISION"),
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="Load the configuration, but exit before executing the command.",
     )
+    parser.add_argument(
+        "--instances",
+        type=int,
+        help="Run this many copies of the command, each on its share of the CPUs, "
+        "restarting those that fail (0 for one per CPU)",
+        default=int(os.environ.get("FUZZING_INSTANCES", "1")),
+    )
+    parser.add_argument(
+        "--no-placement",
+        action="store_false",
+        dest="placement",
+        help="Don't apply the CPU affinity, NUMA node and memory limit of the pool",
+        default=os.environ.get("FUZZING_NO_PLACEMENT") != "1",
+    )
+    parser.add_argument(
+        "--log-shipper",
+        action="store_true",
+        help="Ship stdout/stderr to rotating compressed logs, instead of live.log",
+        default=os.environ.get("FUZZING_LOG_SHIPPER") == "1",
+    )
+    parser.add_argument(
+        "--log-compression",
+        choices=COMPRESSIONS,
+        help="Compression of the shipped logs",
+        default=os.environ.get("FUZZING_LOG_COMPRESSION", DEFAULT_COMPRESSION),
+    )
+    parser.add_argument(
+        "--log-rotate-size",
+        type=parse_size,
+        help="Compressed size of each shipped log file (eg. 64m)",
+        default=os.environ.get("FUZZING_LOG_ROTATE_SIZE", "64m"),
+    )
+    parser.add_argument(
+        "--log-max-size",
+        type=parse_size,
+        help="Compressed size of all the shipped log files (eg. 1g)",
+        default=os.environ.get("FUZZING_LOG_MAX_SIZE", "1g"),
+    )
+    parser.add_argument(
+        "--log-tail-size",
+        type=parse_size,
+        help="Size of the output kept uncompressed in tail.log (eg. 1m)",
+        default=os.environ.get("FUZZING_LOG_TAIL_SIZE", "1m"),
+    )
     parser.add_argument("command", help="docker command-line", nargs=argparse.REMAINDER)
     args = parser.parse_args(args=args)
 
@@ -38,18 +91,39 @@ def main(args=None):
     logging.basicConfig(level=args.log_level)
 
     # Configure workflow using the secret or local configuration
-    launcher = PoolLauncher(args.command, args.pool_name, args.preprocess)
-    config = launcher.configure(
-        local_path=args.configuration,
-        secret=args.taskcluster_secret,
-        fuzzing_git_repository=args.git_repository,
-        fuzzing_git_revision=args.git_revision,
-    )
-
-    if config is not None:
-        # Retrieve remote repository
-        launcher.clone(config)
-        launcher.load_params()
+    log_shipper = None
+    if args.log_shipper:
+        log_shipper = {
+            "compression": args.log_compression,
+            "rotate_size": int(args.log_rotate_size),
+            "max_size": int(args.log_max_size),
+            "tail_size": int(args.log_tail_size),
+        }
+    launcher = PoolLauncher(
+        args.command,
+        args.pool_name,
+        args.preprocess,
+        log_shipper=log_shipper,
+        instances=args.instances,
+        placement=args.placement,
+    )
+    loaded = args.decision_task_id is not None and launcher.load_artifact(
+        args.decision_task_id
+    )
+    if not loaded:
+        config = launcher.configure(
+            local_path=args.configuration,
+            secret=args.taskcluster_secret,
+            fuzzing_git_repository=args.git_repository,
+            fuzzing_git_revision=args.git_revision,
+            snapshot_dir=args.snapshot_dir,
+            git_cache_dir=args.git_cache_dir,
+        )
+
+        if config is not None:
+            # Retrieve remote repository
+            launcher.clone(config)
+            launcher.load_params()
 
     if not args.dry_run:
         # Execute command
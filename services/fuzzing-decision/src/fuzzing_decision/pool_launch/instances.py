@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+from .logship import LogShipper
+
+LOG = logging.getLogger(__name__)
+
+# seconds between checks of the instances
+POLL_INTERVAL = 0.5
+# seconds before the first restart of an instance, doubled on each restart
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+
+def available_cpus():
+    """Get the CPUs this process is allowed to run on
+
+    Returns:
+        list of int: CPU numbers, or None if affinity isn't supported
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    return sorted(os.sched_getaffinity(0))
+
+
+def split_cpus(cpus, count):
+    """Split CPUs into contiguous sets, one for each instance
+
+    Args:
+        cpus (list of int): CPUs to split
+        count (int): number of instances
+
+    Returns:
+        list of list of int: CPUs of each instance. If there are more instances
+                             than CPUs, CPUs are shared by several instances.
+    """
+    if count >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(count)]
+    per_instance, extra = divmod(len(cpus), count)
+    result = []
+    start = 0
+    for i in range(count):
+        # the first instances take the remainder
+        size = per_instance + (i < extra)
+        result.append(cpus[start : start + size])
+        start += size
+    return result
+
+
+def exit_status(returncode):
+    """Convert a Popen returncode to an exit status, as returned by a shell"""
+    if returncode < 0:
+        return 128 - returncode
+    return returncode
+
+
+class Instance:
+    """One copy of the command run by InstanceSupervisor
+
+    Attributes:
+        index (int): index of the instance, from 0
+        cpus (list of int): CPUs the instance is restricted to (or None)
+        restarts (int): number of times the instance was restarted
+        restart_at (float): time.monotonic() when the instance is restarted, None
+                            unless it is waiting to restart
+        status (int): exit status of the last run, None while running
+    """
+
+    def __init__(self, index, cpus, environment, log_dir=None, log_shipper=None):
+        self.index = index
+        self.cpus = cpus
+        self.environment = environment
+        self.restarts = 0
+        self.restart_at = None
+        self.status = None
+        self.process = None
+        self._log = None
+        self._shipper = None
+        self._shipper_thread = None
+        self._write_fd = None
+
+        if log_dir is not None:
+            log_dir.mkdir(mode=0o777, exist_ok=True)
+            if log_shipper is not None:
+                # the pipe outlives restarts, so all runs go to the same files
+                self._shipper = LogShipper(log_dir, **log_shipper)
+                read_fd, self._write_fd = os.pipe()
+                self._shipper_thread = threading.Thread(
+                    target=self._ship, args=(read_fd,), name=f"log-shipper-{index}"
+                )
+                self._shipper_thread.start()
+            else:
+                self._log = (log_dir / "live.log").open("ab")
+
+    def _ship(self, read_fd):
+        try:
+            self._shipper.ship(read_fd)
+        finally:
+            os.close(read_fd)
+
+    def _output(self):
+        if self._write_fd is not None:
+            return self._write_fd
+        if self._log is not None:
+            return self._log.fileno()
+        return None
+
+    def start(self, command):
+        """Start (or restart) the command
+
+        Args:
+            command (list): command-line to execute
+        """
+        output = self._output()
+        self.status = None
+        self.restart_at = None
+        pin_after_start = False
+        if self.cpus is not None:
+            # pin before exec, so threads and processes started by the command
+            # early on are pinned too (not in preexec_fn, which can deadlock with
+            # the log shipper threads)
+            taskset = shutil.which("taskset")
+            if taskset is not None:
+                cpus = ",".join(map(str, self.cpus))
+                command = [taskset, "--cpu-list", cpus] + list(command)
+            else:
+                LOG.warning("taskset missing, pinning the instance once started")
+                pin_after_start = True
+        self.process = subprocess.Popen(
+            command,
+            env=self.environment,
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=subprocess.STDOUT if output is not None else None,
+        )
+        if pin_after_start:
+            try:
+                os.sched_setaffinity(self.process.pid, set(self.cpus))
+            except ProcessLookupError:
+                # already exited, poll() will tell
+                pass
+
+    def poll(self):
+        """Check whether the command exited
+
+        Returns:
+            int: exit status of the command, or None if it is still running
+        """
+        if self.status is None and self.process is not None:
+            returncode = self.process.poll()
+            if returncode is not None:
+                self.status = exit_status(returncode)
+        return self.status
+
+    def signal(self, signum):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signum)
+
+    def close(self):
+        """Close the output of the instance, once it won't be restarted"""
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+            self._shipper_thread.join()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class InstanceSupervisor:
+    """Run several copies of a command, restarting those that fail.
+
+    Each instance gets its share of the available CPUs, and its index in the
+    environment as `FUZZING_INSTANCE` (with `FUZZING_INSTANCES` the number of
+    instances, and `FUZZING_INSTANCE_CPUS` the CPUs it is restricted to). The
+    output of each instance is written to its own `instance<N>` directory in
+    `log_dir`.
+    """
+
+    def __init__(
+        self,
+        command,
+        environment,
+        instances,
+        log_dir=None,
+        log_shipper=None,
+        max_restarts=10,
+        pin_cpus=True,
+    ):
+        """
+        Args:
+            command (list): command-line to execute
+            environment (dict): environment of the command
+            instances (int): number of copies to run (0 for one per CPU)
+            log_dir (Path): directory for the logs of each instance, or None to
+                            inherit stdout/stderr
+            log_shipper (dict): if given, ship the logs of each instance with
+                                LogShipper, using these keyword arguments
+            max_restarts (int): number of times each instance is restarted after
+                                failing, waiting RESTART_DELAY seconds before the
+                                first restart and twice as long before each next
+                                one (up to MAX_RESTART_DELAY)
+            pin_cpus (bool): restrict each instance to its share of the CPUs
+        """
+        cpus = available_cpus()
+        if instances == 0:
+            assert cpus is not None, "Can't count available CPUs"
+            instances = len(cpus)
+        assert instances > 0, "At least one instance is required"
+        self.command = command
+        self.max_restarts = max_restarts
+        self.stopping = False
+
+        cpu_sets = [None] * instances
+        if pin_cpus and cpus is not None:
+            cpu_sets = split_cpus(cpus, instances)
+        self.instances = []
+        for index, instance_cpus in enumerate(cpu_sets):
+            env = environment.copy()
+            env["FUZZING_INSTANCE"] = str(index)
+            env["FUZZING_INSTANCES"] = str(instances)
+            if instance_cpus is not None:
+                env["FUZZING_INSTANCE_CPUS"] = ",".join(map(str, instance_cpus))
+            instance_log_dir = None
+            if log_dir is not None:
+                instance_log_dir = log_dir / f"instance{index}"
+            self.instances.append(
+                Instance(index, instance_cpus, env, instance_log_dir, log_shipper)
+            )
+
+    def stop(self, signum=signal.SIGTERM, _frame=None):
+        """Stop restarting instances, and forward a signal to the running ones"""
+        self.stopping = True
+        for instance in self.instances:
+            instance.signal(signum)
+
+    def run(self):
+        """Run all the instances until they exit successfully, or fail more than
+        max_restarts times, or the supervisor is stopped.
+
+        Returns:
+            int: 0 if every instance succeeded, otherwise the exit status of the
+                 first instance which failed
+        """
+        handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        LOG.info(f"Starting {len(self.instances)} instances of {self.command[0]}")
+        running = set()
+        try:
+            for instance in self.instances:
+                instance.start(self.command)
+                running.add(instance)
+
+            while running:
+                time.sleep(POLL_INTERVAL)
+                for instance in sorted(running, key=lambda inst: inst.index):
+                    status = instance.poll()
+                    if status is None:
+                        continue
+                    if (
+                        status != 0
+                        and not self.stopping
+                        and instance.restarts < self.max_restarts
+                    ):
+                        if instance.restart_at is None:
+                            delay = min(
+                                RESTART_DELAY * 2**instance.restarts,
+                                MAX_RESTART_DELAY,
+                            )
+                            instance.restart_at = time.monotonic() + delay
+                            LOG.warning(
+                                f"Instance {instance.index} exited with {status}, "
+                                f"restarting in {delay}s "
+                                f"({instance.restarts + 1}/{self.max_restarts})"
+                            )
+                        if time.monotonic() >= instance.restart_at:
+                            instance.restarts += 1
+                            instance.start(self.command)
+                        continue
+                    LOG.info(f"Instance {instance.index} exited with {status}")
+                    running.discard(instance)
+                    instance.close()
+        finally:
+            if running:
+                self.stop(signal.SIGKILL)
+                for instance in running:
+                    instance.process.wait()
+                    instance.close()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        for instance in self.instances:
+            if instance.status != 0:
+                return instance.status
+        return 0
@@ -10,8 +10,14 @@ import os
 import pathlib
 import sys
 
-from ..common.pool import PoolConfigLoader
+from taskcluster.exceptions import TaskclusterFailure, TaskclusterRestFailure
+
+from ..common import taskcluster
+from ..common.pool import LAUNCH_PARAMS_ARTIFACT, PLACEMENT_NONE, PoolConfigLoader
 from ..common.workflow import Workflow
+from .instances import InstanceSupervisor
+from .logship import LogShipper, supervise
+from .placement import Placement
 
 LOG = logging.getLogger(__name__)
 
@@ -19,7 +25,30 @@ LOG = logging.getLogger(__name__)
 class PoolLauncher(Workflow):
     """Launcher for a fuzzing pool, using docker parameters from a private repo."""
 
-    def __init__(self, command, pool_name, preprocess=False):
+    def __init__(
+        self,
+        command,
+        pool_name,
+        preprocess=False,
+        log_shipper=None,
+        instances=1,
+        placement=True,
+    ):
+        """
+        Args:
+            command (list): command-line to execute, if not given by the pool
+            pool_name (str): pool to load, optionally prefixed by a pool map
+                             ("map/pool")
+            preprocess (bool): load the preprocess configuration of the pool
+            log_shipper (dict): if given, ship the output of the command to
+                                rotating log files in Taskcluster, instead of a
+                                single log file. Keyword arguments of LogShipper.
+            instances (int): number of copies of the command to run under
+                             InstanceSupervisor (0 for one per CPU). With 1, the
+                             launcher is replaced by the command.
+            placement (bool): apply the CPU, NUMA and memory placement of the pool
+                              in Taskcluster
+        """
         super().__init__()
 
         self.command = command.copy()
@@ -31,40 +60,136 @@ class PoolLauncher(Workflow):
             self.apply = None
         self.preprocess = preprocess
         self.log_dir = pathlib.Path("/logs")
+        self.log_shipper = log_shipper
+        self.instances = instances
+        self.placement = Placement() if placement else None
 
     def clone(self, config):
         """Clone remote repositories according to current setup"""
         super().clone(config)
 
-        # Clone fuzzing & community configuration repos
-        self.fuzzing_config_dir = self.git_clone(**config["fuzzing_config"])
+        # Clone fuzzing configuration repo
+        self.clone_fuzzing_config(config)
+
+    @property
+    def launcher_pool_name(self):
+        """Name of the pool, as published in the launch parameters"""
+        if self.apply is not None:
+            return f"{self.apply}/{self.pool_name}"
+        return self.pool_name
+
+    def load_artifact(self, decision_task_id):
+        """Load the parameters of the pool from the artifact published by the decision
+        task, instead of cloning the fuzzing configuration.
+
+        Args:
+            decision_task_id (str): decision task which created this task
+
+        Returns:
+            bool: whether the parameters were loaded. If not, they have to be loaded
+                  from the fuzzing configuration with `clone()` and `load_params()`.
+        """
+        queue = taskcluster.get_service("queue")
+        try:
+            params = queue.getLatestArtifact(decision_task_id, LAUNCH_PARAMS_ARTIFACT)
+        except TaskclusterRestFailure as exc:
+            if exc.status_code != 404:
+                LOG.warning(f"Failed to fetch launch parameters: {exc}")
+            else:
+                LOG.info(f"No launch parameters published by {decision_task_id}")
+            return False
+        except TaskclusterFailure as exc:
+            LOG.warning(f"Failed to fetch launch parameters: {exc}")
+            return False
+
+        section = "preprocess" if self.preprocess else "pools"
+        pool_params = params.get(section, {}).get(self.launcher_pool_name)
+        if pool_params is None:
+            LOG.warning(
+                f"Launch parameters of {decision_task_id} don't include "
+                f"{self.launcher_pool_name} ({section})"
+            )
+            return False
+        LOG.info(
+            f"Loaded launch parameters from {decision_task_id} "
+            f"(revision {params.get('revision')})"
+        )
+        self._set_params(pool_params)
+        return True
+
+    def _set_params(self, params):
+        """Use the launch fields of a pool
+
+        Args:
+            params (dict): fields returned by `launch_fields()` of the pool. Launch
+                           parameters of older decision tasks may lack the
+                           placement fields.
+        """
+        if params["command"]:
+            assert not self.command, "Specify command-line args XOR pool.command"
+            self.command = params["command"].copy()
+        self.environment.update(params["macros"])
+        if self.placement is not None:
+            self.placement = Placement(
+                params.get("cores_per_task"),
+                params.get("cpu_affinity", PLACEMENT_NONE),
+                params.get("numa_node", PLACEMENT_NONE),
+                params.get("memory_limit", PLACEMENT_NONE),
+            )
 
     def load_params(self):
         path = self.fuzzing_config_dir / f"{self.pool_name}.yml"
-        assert path.exists(), f"Missing pool {self.pool_name}"
+        assert self.resolver.exists(path), f"Missing pool {self.pool_name}"
 
         # Build tasks needed for a specific pool
-        pool_config = PoolConfigLoader.from_file(path)
+        pool_config = PoolConfigLoader.from_file(path, resolver=self.resolver)
         if self.preprocess:
             pool_config = pool_config.create_preprocess()
             assert pool_config is not None, "preprocess given, but could not be loaded"
         if self.apply is not None:
             pool_config = pool_config.apply(self.apply)
 
-        if pool_config.command:
-            assert not self.command, "Specify command-line args XOR pool.command"
-            self.command = pool_config.command.copy()
-        self.environment.update(pool_config.macros)
+        self._set_params(pool_config.launch_fields())
+
+    def _create_log_dir(self):
+        LOG.info(f"Creating private logs directory '{self.log_dir}/'")
+        if self.log_dir.is_dir():
+            self.log_dir.chmod(0o777)
+        else:
+            self.log_dir.mkdir(mode=0o777)
 
     def exec(self):
         assert self.command
 
+        if self.in_taskcluster and self.placement is not None:
+            self.command = self.placement.apply(
+                self.command, seed=os.environ.get("TASK_ID", "")
+            )
+
+        if self.instances != 1:
+            log_dir = None
+            if self.in_taskcluster:
+                self._create_log_dir()
+                log_dir = self.log_dir
+            supervisor = InstanceSupervisor(
+                self.command,
+                self.environment,
+                self.instances,
+                log_dir=log_dir,
+                log_shipper=self.log_shipper,
+            )
+            sys.stdout.flush()
+            sys.stderr.flush()
+            sys.exit(supervisor.run())
+
         if self.in_taskcluster:
-            LOG.info(f"Creating private logs directory '{self.log_dir}/'")
-            if self.log_dir.is_dir():
-                self.log_dir.chmod(0o777)
-            else:
-                self.log_dir.mkdir(mode=0o777)
+            self._create_log_dir()
+            if self.log_shipper is not None:
+                LOG.info(f"Shipping stdout/stderr to {self.log_dir}/live.*.log")
+                shipper = LogShipper(self.log_dir, **self.log_shipper)
+                sys.stdout.flush()
+                sys.stderr.flush()
+                sys.exit(supervise(self.command, self.environment, shipper))
             LOG.info(f"Redirecting stdout/stderr to {self.log_dir}/live.log")
             sys.stdout.flush()
             sys.stderr.flush()
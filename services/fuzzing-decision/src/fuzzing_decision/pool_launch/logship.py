@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import gzip
+import logging
+import os
+import signal
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+LOG = logging.getLogger(__name__)
+
+COMPRESSIONS = ("zstd", "gzip", "none")
+DEFAULT_COMPRESSION = "zstd" if zstandard is not None else "gzip"
+EXTENSIONS = {"zstd": ".zst", "gzip": ".gz", "none": ""}
+
+# size of reads from the fuzzer output pipe
+READ_SIZE = 64 * 1024
+# seconds between flushes of the compressed stream when the output is idle
+FLUSH_INTERVAL = 5.0
+
+
+class LogShipper:
+    """Write the output of a command to rotating, compressed log files.
+
+    Output is read from a pipe into memory by one thread, and compressed and
+    written to disk by another, so a slow disk never blocks the command writing to
+    the pipe. When more than `max_pending` bytes are waiting to be written, the
+    oldest are dropped and a note is written in their place.
+
+    Segments are named `live.<index>.log` with the extension of the compression.
+    Once the compressed size of all segments exceeds `max_size`, the oldest are
+    removed. The last `tail_size` bytes of output are always written uncompressed
+    to `tail.log` when the pipe is closed, for crash context.
+    """
+
+    def __init__(
+        self,
+        log_dir,
+        compression=DEFAULT_COMPRESSION,
+        rotate_size=64 * 1024 * 1024,
+        max_size=1024 * 1024 * 1024,
+        tail_size=1024 * 1024,
+        max_pending=64 * 1024 * 1024,
+    ):
+        assert compression in COMPRESSIONS, f"Unknown compression: {compression}"
+        assert (
+            compression != "zstd" or zstandard is not None
+        ), "zstd compression needs the zstandard package"
+        assert 0 < rotate_size <= max_size, "rotate_size must be within max_size"
+        self.log_dir = log_dir
+        self.compression = compression
+        self.rotate_size = rotate_size
+        self.max_size = max_size
+        self.tail_size = tail_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._tail = collections.deque()
+        self._tail_bytes = 0
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # [(path, compressed size)] of the segments on disk, oldest first
+        self._segments = []
+        self._index = 0
+        self._file = None
+        self._stream = None
+
+    @property
+    def segments(self):
+        """Paths of the segments currently on disk, oldest first"""
+        return [path for path, _ in self._segments]
+
+    def _open_segment(self):
+        path = self.log_dir / f"live.{self._index}.log{EXTENSIONS[self.compression]}"
+        self._index += 1
+        self._file = path.open("wb")
+        if self.compression == "zstd":
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._file)
+        elif self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._file, mode="wb")
+        else:
+            self._stream = self._file
+        self._segments.append((path, 0))
+
+    def _close_segment(self):
+        if self._stream is not self._file:
+            self._stream.close()
+        self._file.close()
+        path, _ = self._segments[-1]
+        self._segments[-1] = (path, path.stat().st_size)
+        self._file = self._stream = None
+
+    def _flush(self):
+        if self.compression == "zstd":
+            self._stream.flush(zstandard.FLUSH_BLOCK)
+        else:
+            self._stream.flush()
+        self._file.flush()
+
+    def _expire(self):
+        """Remove the oldest closed segments until the total size fits max_size"""
+        total = sum(size for _, size in self._segments)
+        if self._file is not None:
+            total += self._file.tell()
+        while total > self.max_size and len(self._segments) > 1:
+            path, size = self._segments.pop(0)
+            LOG.debug(f"Removing log segment {path}")
+            path.unlink()
+            total -= size
+
+    def feed(self, data):
+        """Queue output to be written, and keep it in the tail buffer
+
+        Args:
+            data (bytes): output of the command
+        """
+        with self._cond:
+            # under the lock, so the writer can copy the tail if it fails
+            self._tail.append(data)
+            self._tail_bytes += len(data)
+            while (
+                self._tail and self._tail_bytes - len(self._tail[0]) >= self.tail_size
+            ):
+                self._tail_bytes -= len(self._tail.popleft())
+
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            dropped = 0
+            while self._pending_bytes > self.max_pending and len(self._pending) > 1:
+                chunk = self._pending.popleft()
+                self._pending_bytes -= len(chunk)
+                dropped += len(chunk)
+            if dropped:
+                self.dropped += dropped
+                note = f"\n[log shipper: dropped {dropped} bytes]\n".encode()
+                self._pending.appendleft(note)
+                self._pending_bytes += len(note)
+            self._cond.notify()
+
+    def close(self):
+        """Stop accepting output. The writer finishes what is pending, then exits."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def tail(self):
+        """Get the last output of the command
+
+        Returns:
+            bytes: at most tail_size bytes
+        """
+        with self._cond:
+            data = b"".join(self._tail)
+        return data[-self.tail_size :]
+
+    def write_loop(self):
+        """Write the queued output to disk until the shipper is closed"""
+        self._open_segment()
+        last_flush = time.monotonic()
+        try:
+            while True:
+                with self._cond:
+                    if not self._pending and not self._closed:
+                        self._cond.wait(FLUSH_INTERVAL)
+                    chunks = list(self._pending)
+                    self._pending.clear()
+                    self._pending_bytes = 0
+                    closed = self._closed
+                for chunk in chunks:
+                    if self._file.tell() >= self.rotate_size:
+                        self._close_segment()
+                        self._open_segment()
+                        self._expire()
+                    self._stream.write(chunk)
+                if closed and not chunks:
+                    break
+                if not chunks or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    self._flush()
+                    last_flush = time.monotonic()
+                    self._expire()
+        finally:
+            self._close_segment()
+            self._expire()
+            (self.log_dir / "tail.log").write_bytes(self.tail())
+
+    def read_loop(self, fd):
+        """Read output from a file descriptor until it is closed
+
+        Args:
+            fd (int): file descriptor to read (eg. a pipe)
+        """
+        try:
+            while True:
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    break
+                self.feed(data)
+        finally:
+            self.close()
+
+    def ship(self, fd):
+        """Write the output read from a file descriptor to the log directory, until
+        it is closed
+
+        Args:
+            fd (int): file descriptor to read (eg. a pipe)
+        """
+        writer = threading.Thread(target=self.write_loop, name="log-writer")
+        writer.start()
+        try:
+            self.read_loop(fd)
+        finally:
+            writer.join()
+        if self.dropped:
+            LOG.warning(f"Dropped {self.dropped} bytes of output on slow disk writes")
+
+
+def supervise(command, environment, shipper):
+    """Run a command with its stdout/stderr shipped to rotating log files
+
+    Args:
+        command (list): command-line to execute
+        environment (dict): environment of the command
+        shipper (LogShipper): destination of the output
+
+    Returns:
+        int: exit status of the command, as returned by a shell
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            os.close(read_fd)
+            os.dup2(write_fd, 1)
+            os.dup2(write_fd, 2)
+            os.close(write_fd)
+            os.execvpe(command[0], command, environment)
+        finally:
+            os._exit(127)
+
+    os.close(write_fd)
+
+    # forward termination to the command, so it can finish writing its output
+    def _forward(signum, _frame):
+        os.kill(pid, signum)
+
+    handlers = {
+        signum: signal.signal(signum, _forward)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    try:
+        try:
+            shipper.ship(read_fd)
+        finally:
+            os.close(read_fd)
+        _, status = os.waitpid(pid, 0)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import os
+import pathlib
+import re
+import shutil
+import zlib
+
+from ..common.pool import PLACEMENT_AUTO, PLACEMENT_NONE, parse_cpu_list, parse_size
+from .instances import available_cpus
+
+LOG = logging.getLogger(__name__)
+
+NODE_DIR = pathlib.Path("/sys/devices/system/node")
+CGROUP_DIR = pathlib.Path("/sys/fs/cgroup")
+PROC_DIR = pathlib.Path("/proc")
+
+
+def numa_nodes(node_dir=NODE_DIR):
+    """Find the NUMA nodes of this machine
+
+    Args:
+        node_dir (Path): sysfs directory listing the nodes
+
+    Returns:
+        dict: node number -> list of CPUs of the node. Empty if NUMA isn't
+              supported.
+    """
+    result = {}
+    for path in node_dir.glob("node*/cpulist"):
+        match = re.fullmatch(r"node(\d+)", path.parent.name)
+        cpus = path.read_text().strip()
+        if match is not None and cpus:
+            result[int(match.group(1))] = parse_cpu_list(cpus)
+    return result
+
+
+def memory_total(proc_dir=PROC_DIR):
+    """Get the total memory of this machine
+
+    Args:
+        proc_dir (Path): procfs directory
+
+    Returns:
+        int: memory in bytes, or None if unknown
+    """
+    try:
+        meminfo = (proc_dir / "meminfo").read_text()
+    except OSError:
+        return None
+    match = re.search(r"^MemTotal:\s*(\d+)\s*kB", meminfo, re.MULTILINE)
+    if match is None:
+        return None
+    return int(match.group(1)) * 1024
+
+
+def memory_limit_file(cgroup_dir=CGROUP_DIR, proc_dir=PROC_DIR):
+    """Find the memory limit file of the cgroup this process is in
+
+    Args:
+        cgroup_dir (Path): cgroup filesystem mount point
+        proc_dir (Path): procfs directory
+
+    Returns:
+        Path: memory.max (cgroup v2) or memory.limit_in_bytes (cgroup v1), or None
+              if this process isn't in a memory cgroup
+    """
+    try:
+        cgroups = (proc_dir / "self" / "cgroup").read_text()
+    except OSError:
+        return None
+    for line in cgroups.splitlines():
+        _, controllers, path = line.split(":", 2)
+        path = path.lstrip("/")
+        if not controllers:
+            result = cgroup_dir / path / "memory.max"
+        elif "memory" in controllers.split(","):
+            result = cgroup_dir / "memory" / path / "memory.limit_in_bytes"
+        else:
+            continue
+        if result.is_file():
+            return result
+    return None
+
+
+class Placement:
+    """Placement of the fuzzing processes on the machine: the CPUs they run on, the
+    NUMA node their memory is allocated from, and their memory limit.
+
+    Fields take the values of the pool configuration: "auto" to derive them from
+    `cores_per_task`, "none" to leave them unset (the default), or a value to apply
+    as is.
+    """
+
+    def __init__(
+        self,
+        cores_per_task=None,
+        cpu_affinity=PLACEMENT_NONE,
+        numa_node=PLACEMENT_NONE,
+        memory_limit=PLACEMENT_NONE,
+    ):
+        self.cores_per_task = cores_per_task
+        self.cpu_affinity = cpu_affinity
+        self.numa_node = numa_node
+        self.memory_limit = memory_limit
+
+    def resolve(self, available, nodes, total_memory, seed=""):
+        """Compute the placement on a given machine
+
+        Args:
+            available (list of int): CPUs this process is allowed to run on
+            nodes (dict): NUMA node -> list of CPUs, as returned by `numa_nodes()`
+            total_memory (int): memory of the machine in bytes (or None)
+            seed (str): picks between the NUMA nodes which fit, so tasks sharing a
+                        machine are spread between its nodes (eg. the task id)
+
+        Returns:
+            tuple (list of int, int, int): CPUs, NUMA node and memory limit in
+                                           bytes, each None if left unset
+        """
+        node = None
+        if self.numa_node not in {PLACEMENT_AUTO, PLACEMENT_NONE}:
+            node = int(self.numa_node)
+            assert node in nodes, f"Missing NUMA node {node}"
+        elif (
+            self.numa_node == PLACEMENT_AUTO
+            and self.cpu_affinity == PLACEMENT_AUTO
+            and self.cores_per_task
+            and len(nodes) > 1
+        ):
+            # only bind to nodes with enough CPUs for the whole task
+            fits = [
+                number
+                for number, cpus in sorted(nodes.items())
+                if len(set(cpus) & set(available)) >= self.cores_per_task
+            ]
+            if fits:
+                node = fits[zlib.crc32(seed.encode()) % len(fits)]
+
+        cpus = None
+        if self.cpu_affinity not in {PLACEMENT_AUTO, PLACEMENT_NONE}:
+            cpus = sorted(set(parse_cpu_list(self.cpu_affinity)) & set(available))
+            assert cpus, f"None of the CPUs {self.cpu_affinity} are available"
+        elif self.cpu_affinity == PLACEMENT_AUTO and node is not None:
+            cpus = sorted(set(nodes[node]) & set(available))
+
+        limit = None
+        if self.memory_limit not in {PLACEMENT_AUTO, PLACEMENT_NONE}:
+            limit = int(parse_size(str(self.memory_limit)))
+        elif (
+            self.memory_limit == PLACEMENT_AUTO
+            and self.cores_per_task
+            and total_memory is not None
+            and self.cores_per_task < len(available)
+        ):
+            # the share of the memory matching the share of the CPUs
+            limit = total_memory * self.cores_per_task // len(available)
+
+        return cpus, node, limit
+
+    def apply(self, command, seed=""):
+        """Apply the placement to this process, before executing the command
+
+        Args:
+            command (list): command-line which will be executed
+            seed (str): see `resolve()`
+
+        Returns:
+            list: command-line to execute instead, to bind the memory of the command
+                  to the NUMA node
+        """
+        if {self.cpu_affinity, self.numa_node, self.memory_limit} == {PLACEMENT_NONE}:
+            return command
+
+        available = available_cpus()
+        if available is None:
+            # eg. on Windows: CPUs can't be restricted, only the memory share applies
+            available = list(range(os.cpu_count() or 1))
+            cpus, node, limit = self.resolve(available, {}, memory_total(), seed)
+            if cpus is not None:
+                LOG.warning("CPU affinity isn't supported, running on all CPUs")
+        else:
+            cpus, node, limit = self.resolve(
+                available, numa_nodes(), memory_total(), seed
+            )
+            if cpus is not None and cpus != available:
+                LOG.info(f"Restricting to CPUs {','.join(map(str, cpus))}")
+                os.sched_setaffinity(0, cpus)
+
+        if node is not None:
+            numactl = shutil.which("numactl")
+            if numactl is not None:
+                LOG.info(f"Binding memory to NUMA node {node}")
+                command = [numactl, f"--membind={node}", "--"] + command
+            else:
+                LOG.info("numactl missing, memory is allocated near the CPUs")
+
+        if limit is not None:
+            path = memory_limit_file()
+            try:
+                assert path is not None, "not in a memory cgroup"
+                path.write_text(str(limit))
+            except (AssertionError, OSError) as exc:
+                LOG.warning(f"Failed to set the memory limit to {limit}: {exc}")
+            else:
+                LOG.info(f"Limited memory to {limit} bytes in {path}")
+
+        return command
@@ -34,6 +34,37 @@ appconfig.options.add(
     help="A git revision for the fuzzing git repository",
     default=os.environ.get("FUZZING_GIT_REVISION"),
 )
+appconfig.options.add(
+    "--fuzzing-snapshot-dir",
+    help="Directory used to cache compiled snapshots of the Fuzzing configuration",
+    default=os.environ.get("FUZZING_SNAPSHOT_DIR"),
+)
+appconfig.options.add(
+    "--fuzzing-base-revision",
+    help="Fuzzing configuration commit previously generated, pools whose inputs "
+    "didn't change reuse the resources cached for it in the snapshot directory",
+    default=os.environ.get("FUZZING_BASE_REVISION"),
+)
+appconfig.options.add(
+    "--fuzzing-git-cache-dir",
+    help="Directory used to keep mirrors of the cloned git repositories",
+    default=os.environ.get("FUZZING_GIT_CACHE_DIR"),
+)
+appconfig.options.add(
+    "--fuzzing-timings",
+    help="Write the time spent in each phase to this JSON file on exit",
+    default=os.environ.get("FUZZING_TIMINGS"),
+)
+appconfig.options.add(
+    "--fuzzing-profile",
+    help="Profile the execution with cProfile, and write the stats to this file",
+    default=os.environ.get("FUZZING_PROFILE"),
+)
+appconfig.options.add(
+    "--fuzzing-jobs",
+    help="Number of processes used to generate the fuzzing pool resources",
+    default=os.environ.get("FUZZING_JOBS"),
+)
 
 # We always want to run against community Taskcluster instance
 os.environ["TASKCLUSTER_ROOT_URL"] = "https://community-tc.services.mozilla.com"
@@ -0,0 +1,37 @@
+#!/usr/bin/env bash
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Run the benchmarks of a base revision, then those of the working tree on the same
+# machine, and fail if the working tree is slower than the threshold allows.
+#
+# BENCHMARK_BASE: git revision compared with (default: first parent of HEAD)
+# BENCHMARK_THRESHOLD: pytest-benchmark --benchmark-compare-fail expression
+
+set -e
+set -u
+set -o pipefail
+
+base="${BENCHMARK_BASE:-HEAD^}"
+threshold="${BENCHMARK_THRESHOLD:-mean:25%}"
+
+cd "$(dirname "$0")/../.."
+prefix="$(git rev-parse --show-prefix)"
+tmp="$(mktemp -d)"
+trap 'rm -rf "$tmp"' EXIT
+
+git -C "$(git rev-parse --show-toplevel)" archive "$base:$prefix" | tar -x -C "$tmp"
+if [ ! -e "$tmp/tests/test_benchmark.py" ]; then
+  echo "No benchmarks in $base, nothing to compare with" >&2
+  exec python -m pytest --benchmark-only tests/test_benchmark.py "$@"
+fi
+
+# the base sources take precedence over the installed package
+(cd "$tmp" && PYTHONPATH=src python -m pytest -p no:cacheprovider \
+  --benchmark-only --benchmark-json="$tmp/base.json" tests/test_benchmark.py)
+
+python -m pytest --benchmark-only \
+  --benchmark-compare="$tmp/base.json" \
+  --benchmark-compare-fail="$threshold" \
+  tests/test_benchmark.py "$@"
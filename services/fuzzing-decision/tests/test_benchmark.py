@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the decision hot path, over a synthetic fuzzing configuration.
+
+Run with `tox -e benchmark`, which fails on regressions from the base revision.
+"""
+
+import copy
+
+import pytest
+import yaml
+
+from fuzzing_decision.common.pool import MachineTypes, PoolConfigResolver
+from fuzzing_decision.decision.pool import (
+    PoolConfigLoader,
+    PoolConfigMap,
+    PoolConfiguration,
+)
+
+pytest.importorskip("pytest_benchmark")
+
+# size of the synthetic configuration
+POOLS = 200
+PARENT_DEPTH = 5
+MAPS = 20
+MAP_SIZE = 10
+MACHINES = 500
+
+pytestmark = pytest.mark.benchmark(min_rounds=5, max_time=0.5)
+
+
+@pytest.fixture(scope="module")
+def synthetic_config(tmp_path_factory):
+    """Write a fuzzing configuration with POOLS pools inheriting from PARENT_DEPTH
+    levels of parents, MAPS maps applied to MAP_SIZE pools each, and MACHINES
+    machine types"""
+    path = tmp_path_factory.mktemp("config")
+
+    machines = {}
+    for i in range(MACHINES):
+        provider = ("aws", "gcp")[i % 2]
+        cpu = 2 ** (i % 7)
+        machines.setdefault(provider, {}).setdefault("x64", {})[f"type-{i}"] = {
+            "cpu": cpu,
+            "ram": cpu * (1 + i % 8),
+        }
+    (path / "machines.yml").write_text(yaml.dump(machines))
+
+    (path / "base0.yml").write_text(
+        yaml.dump(
+            {
+                "cloud": "gcp",
+                "command": ["run-fuzzing.sh"],
+                "container": "MozillaSecurity/fuzzer:latest",
+                "cores_per_task": 2,
+                "cpu": "x64",
+                "cycle_time": "17h",
+                "disk_size": "120g",
+                "imageset": "docker-worker",
+                "max_run_time": "17h",
+                "metal": False,
+                "minimum_memory_per_core": "2g",
+                "name": "base0",
+                "parents": [],
+                "platform": "linux",
+                "schedule_start": "1970-01-01T00:00:00Z",
+                "scopes": ["secrets:get:base0"],
+                "tasks": 10,
+            }
+        )
+    )
+    for level in range(1, PARENT_DEPTH):
+        (path / f"base{level}.yml").write_text(
+            yaml.dump(
+                {
+                    "macros": {f"LEVEL{level}": str(level)},
+                    "name": f"base{level}",
+                    "parents": [f"base{level - 1}"],
+                    "scopes": [f"secrets:get:base{level}"],
+                }
+            )
+        )
+    for i in range(POOLS):
+        (path / f"pool{i}.yml").write_text(
+            yaml.dump(
+                {
+                    "macros": {"POOL": str(i)},
+                    "name": f"pool {i}",
+                    "parents": [f"base{PARENT_DEPTH - 1}"],
+                    "tasks": 1 + i % 20,
+                }
+            )
+        )
+    for i in range(MAPS):
+        (path / f"pool-map{i}.yml").write_text(
+            yaml.dump(
+                {
+                    "apply_to": [f"pool{(i + j) % POOLS}" for j in range(MAP_SIZE)],
+                    "macros": {"MAP": str(i)},
+                    "name": f"map {i}",
+                }
+            )
+        )
+    return path
+
+
+@pytest.fixture(scope="module")
+def pool_files(synthetic_config):
+    return sorted(synthetic_config.glob("pool*.yml"))
+
+
+@pytest.fixture(scope="module")
+def synthetic_machines(synthetic_config):
+    return MachineTypes.from_file(synthetic_config / "machines.yml")
+
+
+@pytest.fixture(scope="module")
+def loaded_pools(pool_files):
+    resolver = PoolConfigResolver()
+    return [PoolConfigLoader.from_file(path, resolver=resolver) for path in pool_files]
+
+
+def test_load_pools(benchmark, pool_files):
+    def _load():
+        resolver = PoolConfigResolver()
+        return [
+            PoolConfigLoader.from_file(path, resolver=resolver) for path in pool_files
+        ]
+
+    assert len(benchmark(_load)) == POOLS + MAPS
+
+
+def test_flatten(benchmark, synthetic_config):
+    path = synthetic_config / "pool0.yml"
+    data = yaml.safe_load(path.read_text())
+
+    def _flatten():
+        # a new resolver flattens all the parents again
+        return PoolConfiguration(
+            "pool0", data, base_dir=synthetic_config, resolver=PoolConfigResolver()
+        )
+
+    pool = benchmark(_flatten)
+    assert len(pool.scopes) == PARENT_DEPTH
+
+
+@pytest.mark.usefixtures("appconfig")
+def test_build_resources(benchmark, loaded_pools, mock_clouds, synthetic_machines):
+    def _build():
+        return [
+            resource
+            for pool in loaded_pools
+            for resource in pool.build_resources(mock_clouds, synthetic_machines)
+        ]
+
+    assert len(benchmark(_build)) == 3 * (POOLS + MAPS)
+
+
+def test_build_tasks(benchmark, loaded_pools):
+    def _build():
+        return [
+            task for pool in loaded_pools for task in pool.build_tasks("someTaskId")
+        ]
+
+    expected = 0
+    for pool in loaded_pools:
+        if isinstance(pool, PoolConfigMap):
+            expected += sum(applied.tasks for applied in pool.iterpools())
+        else:
+            expected += pool.tasks
+    assert len(benchmark(_build)) == expected
+
+
+def test_cycle_crons(benchmark, loaded_pools):
+    pool = copy.copy(loaded_pools[0])
+
+    def _crons():
+        # a new resolver computes the schedule again
+        pool.resolver = PoolConfigResolver()
+        return list(pool.cycle_crons())
+
+    assert benchmark(_crons)
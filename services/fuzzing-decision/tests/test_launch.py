@@ -1,13 +1,27 @@
 # -*- coding: utf-8 -*-
 
+import gzip
 import os
+import shutil
+import signal
+import sys
+import time
 from unittest.mock import Mock, patch
 
 import pytest
 import yaml
+from taskcluster.exceptions import TaskclusterRestFailure
 
+from fuzzing_decision.decision.pool import DECISION_TASK, FUZZING_TASK
 from fuzzing_decision.pool_launch import cli
+from fuzzing_decision.pool_launch.instances import InstanceSupervisor, split_cpus
 from fuzzing_decision.pool_launch.launcher import PoolLauncher
+from fuzzing_decision.pool_launch.logship import LogShipper, supervise
+from fuzzing_decision.pool_launch.placement import (
+    Placement,
+    memory_limit_file,
+    numa_nodes,
+)
 
 
 @patch("fuzzing_decision.pool_launch.cli.PoolLauncher", autospec=True)
@@ -33,6 +47,88 @@ def test_main_calls(mock_launcher):
     mock_launcher.return_value.exec.assert_called_once()
 
 
+@patch("fuzzing_decision.pool_launch.cli.PoolLauncher", autospec=True)
+def test_main_artifact(mock_launcher):
+    # launch parameters of the decision task are used instead of cloning
+    mock_launcher.return_value.load_artifact.return_value = True
+    cli.main(["--decision-task-id", "decisionTask"])
+    mock_launcher.return_value.load_artifact.assert_called_once_with("decisionTask")
+    mock_launcher.return_value.configure.assert_not_called()
+    mock_launcher.return_value.clone.assert_not_called()
+    mock_launcher.return_value.exec.assert_called_once()
+
+    # the configuration is cloned when they are missing
+    mock_launcher.reset_mock()
+    mock_launcher.return_value.load_artifact.return_value = False
+    mock_launcher.return_value.configure.return_value = {}
+    cli.main(["--decision-task-id", "decisionTask"])
+    mock_launcher.return_value.clone.assert_called_once()
+    mock_launcher.return_value.load_params.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "pool_name, preprocess, command, macros",
+    [
+        ("test-pool", False, ["fuzz"], {"POOL": "1"}),
+        ("test-pool", True, ["prep"], {"PREPROCESS": "1"}),
+        ("pool1/map1", False, [], {"MAP": "1"}),
+        ("other-pool", False, None, None),
+    ],
+)
+@patch("os.environ", {})
+def test_load_artifact(pool_name, preprocess, command, macros):
+    params = {
+        "pools": {
+            "test-pool": {"command": ["fuzz"], "macros": {"POOL": "1"}},
+            "pool1/map1": {"command": [], "macros": {"MAP": "1"}},
+        },
+        "preprocess": {
+            "test-pool": {"command": ["prep"], "macros": {"PREPROCESS": "1"}},
+        },
+        "revision": "abcdef",
+    }
+    with patch("fuzzing_decision.pool_launch.launcher.taskcluster") as tc:
+        queue = tc.get_service.return_value
+        queue.getLatestArtifact.return_value = params
+        launcher = PoolLauncher([], pool_name, preprocess)
+        assert launcher.load_artifact("decisionTask") is (command is not None)
+        queue.getLatestArtifact.assert_called_once_with(
+            "decisionTask", "project/fuzzing/private/launch-params.json"
+        )
+    if command is not None:
+        assert launcher.command == command
+        assert launcher.environment == macros
+    else:
+        assert launcher.command == []
+        assert launcher.environment == {}
+
+
+def test_load_artifact_missing():
+    with patch("fuzzing_decision.pool_launch.launcher.taskcluster") as tc:
+        queue = tc.get_service.return_value
+        queue.getLatestArtifact.side_effect = TaskclusterRestFailure(
+            "Artifact not found", None, status_code=404
+        )
+        launcher = PoolLauncher([], "test-pool")
+        assert not launcher.load_artifact("decisionTask")
+
+
+def test_load_artifact_scopes():
+    """the artifact fetched by the launcher is published by the decision task, and
+    readable by the fuzzing tasks"""
+    with patch("fuzzing_decision.pool_launch.launcher.taskcluster") as tc:
+        queue = tc.get_service.return_value
+        queue.getLatestArtifact.return_value = {}
+        PoolLauncher([], "test-pool").load_artifact("decisionTask")
+        (_, artifact), _ = queue.getLatestArtifact.call_args
+    assert f"queue:get-artifact:{artifact}" in FUZZING_TASK.skeleton["scopes"]
+    assert f"queue:get-artifact:{artifact}" in DECISION_TASK.skeleton["scopes"]
+    payload = DECISION_TASK.skeleton["payload"]
+    assert payload["artifacts"][artifact]["path"] == (
+        payload["env"]["FUZZING_LAUNCH_PARAMS"]
+    )
+
+
 @patch("os.environ", {})
 def test_load_params(tmp_path):
     os.environ["STATIC"] = "value"
@@ -66,6 +162,8 @@ def test_load_params(tmp_path):
 
     launcher.load_params()
     assert launcher.command == ["command", "arg"]
+    assert launcher.placement.cores_per_task == 10
+    assert launcher.placement.cpu_affinity == "none"
     assert launcher.environment == {
         "ENVVAR1": "123456",
         "ENVVAR2": "789abc",
@@ -150,3 +248,311 @@ def test_launch_exec(tmp_path, monkeypatch):
         assert os.dup2.call_count == 2
         os.execvpe.assert_called_once_with("cmd", ["cmd"], pool.environment)
         assert pool.log_dir.is_dir()
+
+    # With the log shipper, the command is supervised instead
+    with patch("os.execvpe"), patch(
+        "fuzzing_decision.pool_launch.launcher.supervise", return_value=3
+    ) as supervise_:
+        pool.log_shipper = {"compression": "none"}
+        with pytest.raises(SystemExit) as exc:
+            pool.exec()
+        assert exc.value.code == 3
+        os.execvpe.assert_not_called()
+        command, environment, shipper = supervise_.call_args[0]
+        assert command == ["cmd"]
+        assert environment is pool.environment
+        assert shipper.log_dir == pool.log_dir
+
+    # With several instances, the command is run by a supervisor
+    with patch("os.execvpe"), patch(
+        "fuzzing_decision.pool_launch.launcher.InstanceSupervisor"
+    ) as supervisor:
+        supervisor.return_value.run.return_value = 0
+        pool.instances = 4
+        with pytest.raises(SystemExit) as exc:
+            pool.exec()
+        assert exc.value.code == 0
+        os.execvpe.assert_not_called()
+        supervisor.assert_called_once_with(
+            ["cmd"],
+            pool.environment,
+            4,
+            log_dir=pool.log_dir,
+            log_shipper={"compression": "none"},
+        )
+
+
+def test_log_shipper(tmp_path):
+    shipper = LogShipper(
+        tmp_path, compression="none", rotate_size=100, max_size=250, tail_size=30
+    )
+    for i in range(50):
+        shipper.feed(f"line {i:04d}\n".encode())
+    shipper.close()
+    shipper.write_loop()
+
+    # oldest segments are removed to stay within max_size
+    assert shipper.segments == sorted(tmp_path.glob("live.*.log"))
+    assert len(shipper.segments) == 2
+    assert sum(path.stat().st_size for path in shipper.segments) <= 250
+    assert shipper.segments[-1].read_bytes().endswith(b"line 0049\n")
+    assert not (tmp_path / "live.2.log").exists()
+    assert (tmp_path / "tail.log").read_bytes() == b"line 0047\nline 0048\nline 0049\n"
+
+
+def test_log_shipper_write_error(tmp_path):
+    class FullDisk(LogShipper):
+        def _open_segment(self):
+            super()._open_segment()
+            self._stream = Mock(write=Mock(side_effect=OSError(28, "full")))
+
+    shipper = FullDisk(tmp_path, compression="none", tail_size=30)
+    shipper.feed(b"line 0000\n")
+    shipper.close()
+    # the error of the writer isn't hidden, and the tail is still written
+    with pytest.raises(OSError, match="full"):
+        shipper.write_loop()
+    assert (tmp_path / "tail.log").read_bytes() == b"line 0000\n"
+
+
+def test_log_shipper_supervise(tmp_path):
+    shipper = LogShipper(tmp_path, compression="gzip")
+    command = [
+        sys.executable,
+        "-c",
+        "import sys; print('out'); sys.stdout.flush(); print('err', file=sys.stderr); "
+        "sys.exit(3)",
+    ]
+    handler = signal.getsignal(signal.SIGTERM)
+    assert supervise(command, os.environ.copy(), shipper) == 3
+    assert signal.getsignal(signal.SIGTERM) is handler
+    (segment,) = shipper.segments
+    assert gzip.decompress(segment.read_bytes()) == b"out\nerr\n"
+    assert (tmp_path / "tail.log").read_bytes() == b"out\nerr\n"
+
+
+@pytest.mark.parametrize(
+    "cpus, count, expected",
+    [
+        ([0, 1, 2, 3], 2, [[0, 1], [2, 3]]),
+        ([0, 1, 2, 3, 4], 2, [[0, 1, 2], [3, 4]]),
+        ([4, 5, 6, 7], 1, [[4, 5, 6, 7]]),
+        ([0, 1], 3, [[0], [1], [0]]),
+    ],
+)
+def test_split_cpus(cpus, count, expected):
+    assert split_cpus(cpus, count) == expected
+
+
+@patch("fuzzing_decision.pool_launch.instances.POLL_INTERVAL", 0.01)
+@patch("fuzzing_decision.pool_launch.instances.RESTART_DELAY", 0.01)
+@pytest.mark.parametrize("log_shipper", [None, {"compression": "none"}])
+def test_instance_supervisor(tmp_path, log_shipper):
+    # each instance fails on its first run, and instance 1 always fails
+    script = (
+        "import os, pathlib, sys\n"
+        "index = os.environ['FUZZING_INSTANCE']\n"
+        "print(f'{index}/{os.environ[\"FUZZING_INSTANCES\"]}', flush=True)\n"
+        "marker = pathlib.Path(sys.argv[1]) / index\n"
+        "if marker.exists() and index != '1':\n"
+        "    sys.exit(0)\n"
+        "marker.touch()\n"
+        "sys.exit(5)\n"
+    )
+    markers = tmp_path / "markers"
+    markers.mkdir()
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    with patch(
+        "fuzzing_decision.pool_launch.instances.available_cpus", return_value=[0, 1]
+    ), patch("os.sched_setaffinity", create=True), patch(
+        "fuzzing_decision.pool_launch.instances.shutil.which", return_value=None
+    ):
+        supervisor = InstanceSupervisor(
+            [sys.executable, "-c", script, str(markers)],
+            os.environ.copy(),
+            3,
+            log_dir=log_dir,
+            log_shipper=log_shipper,
+            max_restarts=2,
+        )
+        assert [instance.cpus for instance in supervisor.instances] == [
+            [0],
+            [1],
+            [0],
+        ]
+        assert supervisor.instances[2].environment["FUZZING_INSTANCE_CPUS"] == "0"
+        handler = signal.getsignal(signal.SIGTERM)
+        assert supervisor.run() == 5
+        assert signal.getsignal(signal.SIGTERM) is handler
+        # without taskset, affinity is set from the supervisor once each run started
+        cpu_sets = [cpus for (pid, cpus), _ in os.sched_setaffinity.call_args_list]
+        assert sorted(cpu_sets, key=sorted) == [{0}] * 4 + [{1}] * 3
+        assert 0 not in {pid for (pid, _), _ in os.sched_setaffinity.call_args_list}
+
+    assert [instance.restarts for instance in supervisor.instances] == [1, 2, 1]
+    assert [instance.status for instance in supervisor.instances] == [0, 5, 0]
+    for index, runs in enumerate((2, 3, 2)):
+        if log_shipper is None:
+            log = log_dir / f"instance{index}" / "live.log"
+        else:
+            log = log_dir / f"instance{index}" / "live.0.log"
+        assert log.read_text() == f"{index}/3\n" * runs
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "sched_getaffinity") or shutil.which("taskset") is None,
+    reason="needs CPU affinity and taskset",
+)
+@patch("fuzzing_decision.pool_launch.instances.POLL_INTERVAL", 0.01)
+def test_instance_supervisor_pinned_children(tmp_path):
+    # the instance starts a child process, which reports its affinity
+    script = (
+        "import subprocess, sys\n"
+        "subprocess.run([sys.executable, '-c', "
+        "'import os; print(sorted(os.sched_getaffinity(0)))'], check=True)\n"
+    )
+    cpu = min(os.sched_getaffinity(0))
+    with patch(
+        "fuzzing_decision.pool_launch.instances.available_cpus", return_value=[cpu]
+    ), patch("os.sched_setaffinity") as sched_setaffinity:
+        supervisor = InstanceSupervisor(
+            [sys.executable, "-c", script],
+            os.environ.copy(),
+            1,
+            log_dir=tmp_path,
+            max_restarts=0,
+        )
+        assert supervisor.run() == 0
+        # pinned before the command is executed
+        sched_setaffinity.assert_not_called()
+    assert (tmp_path / "instance0" / "live.log").read_text() == f"[{cpu}]\n"
+
+
+@patch("fuzzing_decision.pool_launch.instances.POLL_INTERVAL", 0.01)
+@patch("fuzzing_decision.pool_launch.instances.RESTART_DELAY", 0.1)
+@patch("fuzzing_decision.pool_launch.instances.MAX_RESTART_DELAY", 0.2)
+def test_instance_supervisor_backoff():
+    supervisor = InstanceSupervisor(
+        [sys.executable, "-c", "import sys; sys.exit(3)"],
+        os.environ.copy(),
+        1,
+        max_restarts=3,
+        pin_cpus=False,
+    )
+    start = time.monotonic()
+    assert supervisor.run() == 3
+    # restarts wait 0.1s, 0.2s, then 0.2s
+    assert time.monotonic() - start >= 0.5
+    assert supervisor.instances[0].restarts == 3
+
+
+NODES = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+GIB = 1024 * 1024 * 1024
+AUTO = {"cpu_affinity": "auto", "numa_node": "auto", "memory_limit": "auto"}
+
+
+@pytest.mark.parametrize(
+    "fields, available, expected",
+    [
+        # the task fits in a node: bound to it, with its share of the memory
+        (dict(AUTO, cores_per_task=2), range(8), ([4, 5, 6, 7], 1, 4 * GIB)),
+        # only node 0 has enough available CPUs
+        (
+            dict(AUTO, cores_per_task=3),
+            [0, 1, 2, 4, 5],
+            ([0, 1, 2], 0, 16 * GIB * 3 // 5),
+        ),
+        # the task doesn't fit in any node, or uses the whole machine
+        (dict(AUTO, cores_per_task=6), range(8), (None, None, 12 * GIB)),
+        (dict(AUTO, cores_per_task=8), range(8), (None, None, None)),
+        # unknown cores_per_task
+        (AUTO, range(8), (None, None, None)),
+        # placement is disabled by default
+        ({"cores_per_task": 2}, range(8), (None, None, None)),
+        # explicit values, the NUMA node is only picked along with the CPUs
+        (
+            {
+                "cores_per_task": 2,
+                "cpu_affinity": "2-5,9",
+                "numa_node": 1,
+                "memory_limit": "2g",
+            },
+            range(8),
+            ([2, 3, 4, 5], 1, 2 * GIB),
+        ),
+        (
+            dict(AUTO, cores_per_task=2, cpu_affinity="none", memory_limit="none"),
+            range(8),
+            (None, None, None),
+        ),
+        (
+            dict(AUTO, cores_per_task=2, numa_node="none"),
+            range(8),
+            (None, None, 4 * GIB),
+        ),
+    ],
+)
+def test_placement_resolve(fields, available, expected):
+    placement = Placement(**fields)
+    assert placement.resolve(list(available), NODES, 16 * GIB, "task1") == expected
+
+
+def test_placement_machine(tmp_path):
+    nodes = tmp_path / "node"
+    for node, cpus in (("node0", "0-3\n"), ("node1", "4-5,7\n"), ("possible", "")):
+        (nodes / node).mkdir(parents=True)
+        (nodes / node / "cpulist").write_text(cpus)
+    assert numa_nodes(nodes) == {0: [0, 1, 2, 3], 1: [4, 5, 7]}
+
+    proc = tmp_path / "proc"
+    (proc / "self").mkdir(parents=True)
+    cgroup = tmp_path / "cgroup"
+    # cgroup v2
+    (proc / "self" / "cgroup").write_text("0::/docker/abc\n")
+    (cgroup / "docker" / "abc").mkdir(parents=True)
+    (cgroup / "docker" / "abc" / "memory.max").write_text("max\n")
+    assert memory_limit_file(cgroup, proc) == cgroup / "docker/abc/memory.max"
+    # cgroup v1
+    (proc / "self" / "cgroup").write_text("5:cpu,cpuacct:/abc\n3:memory:/abc\n")
+    assert memory_limit_file(cgroup, proc) is None
+    (cgroup / "memory" / "abc").mkdir(parents=True)
+    (cgroup / "memory" / "abc" / "memory.limit_in_bytes").write_text("0\n")
+    assert memory_limit_file(cgroup, proc) == (
+        cgroup / "memory/abc/memory.limit_in_bytes"
+    )
+
+
+@patch("fuzzing_decision.pool_launch.placement.memory_limit_file")
+@patch("fuzzing_decision.pool_launch.placement.memory_total", return_value=16 * GIB)
+@patch("fuzzing_decision.pool_launch.placement.numa_nodes", return_value=NODES)
+def test_placement_apply(_nodes, _total, limit_file, tmp_path):
+    limit_file.return_value = tmp_path / "memory.max"
+    with patch("os.sched_getaffinity", return_value=set(range(8)), create=True), patch(
+        "os.sched_setaffinity", create=True
+    ), patch("shutil.which", return_value="/usr/bin/numactl"):
+        command = Placement(cores_per_task=2, **AUTO).apply(["cmd"], "task1")
+        os.sched_setaffinity.assert_called_once_with(0, [4, 5, 6, 7])
+    assert command == ["/usr/bin/numactl", "--membind=1", "--", "cmd"]
+    assert (tmp_path / "memory.max").read_text() == str(4 * GIB)
+
+
+@patch("fuzzing_decision.pool_launch.placement.memory_limit_file")
+@patch("fuzzing_decision.pool_launch.placement.memory_total", return_value=16 * GIB)
+@patch("fuzzing_decision.pool_launch.placement.numa_nodes", return_value=NODES)
+def test_placement_unsupported(nodes, total, limit_file, monkeypatch):
+    monkeypatch.delattr(os, "sched_getaffinity", raising=False)
+    monkeypatch.delattr(os, "sched_setaffinity", raising=False)
+    # nothing is looked up when placement is disabled
+    assert Placement(cores_per_task=2).apply(["cmd"], "task1") == ["cmd"]
+    nodes.assert_not_called()
+    total.assert_not_called()
+    limit_file.assert_not_called()
+
+    # without CPU affinity (eg. on Windows), only the memory limit applies
+    limit_file.return_value = None
+    with patch("os.cpu_count", return_value=8):
+        command = Placement(cores_per_task=2, **AUTO).apply(["cmd"], "task1")
+    assert command == ["cmd"]
+    nodes.assert_not_called()
+    limit_file.assert_called_once_with()
@@ -2,21 +2,53 @@
 
 import copy
 import datetime
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
 from pathlib import Path
+from string import Template
+from unittest.mock import Mock, patch
 
 import pytest
+import responses
 import slugid
+import yaml
+from taskcluster.exceptions import TaskclusterRestFailure
 
+from fuzzing_decision.common import taskcluster
+from fuzzing_decision.common.pool import (
+    CRON_FIELD_RANGES,
+    MachineTypes,
+)
 from fuzzing_decision.common.pool import PoolConfigLoader as CommonPoolConfigLoader
 from fuzzing_decision.common.pool import PoolConfigMap as CommonPoolConfigMap
+from fuzzing_decision.common.pool import PoolConfigResolver
 from fuzzing_decision.common.pool import PoolConfiguration as CommonPoolConfiguration
-from fuzzing_decision.common.pool import parse_size
+from fuzzing_decision.common.pool import (
+    cron_times,
+    imageset_regions,
+    parse_cpu_list,
+    parse_size,
+    peak_usage,
+    plan_capacity,
+    plan_main,
+)
 from fuzzing_decision.decision.pool import (
     DOCKER_WORKER_DEVICES,
+    PREPROCESS_INDEX,
+    TEMPLATES,
     PoolConfigLoader,
     PoolConfigMap,
     PoolConfiguration,
+    TaskTemplate,
+    cancel_tasks,
+    create_tasks,
 )
+from fuzzing_decision.decision.providers import LaunchConfigPolicy
 
 POOL_FIXTURES = Path(__file__).parent / "fixtures" / "pools"
 
@@ -59,13 +91,19 @@ def test_parse_size(size, divisor, result):
 def test_machine_filters(mock_machines, provider, cpu, ram, cores, metal, result):
 
     if isinstance(result, list):
-        assert list(mock_machines.filter(provider, cpu, cores, ram, metal)) == result
+        machines = mock_machines.filter(provider, cpu, cores, ram, metal)
+        assert [name for name, _, _ in machines] == result
+        for name, capacity, zone_blacklist in machines:
+            assert capacity == 1
+            assert zone_blacklist == mock_machines.zone_blacklist(provider, cpu, name)
     else:
         with pytest.raises(result):
-            list(mock_machines.filter(provider, cpu, cores, ram, metal))
+            mock_machines.filter(provider, cpu, cores, ram, metal)
 
 
 # Hook & role should be the same across cloud providers
+LAUNCH_PARAMS_SCOPE = "queue:get-artifact:project/fuzzing/private/launch-params.json"
+
 VALID_HOOK = {
     "bindings": [],
     "description": (
@@ -79,7 +117,7 @@ VALID_HOOK = {
     "kind": "Hook",
     "name": "linux-test",
     "owner": "fuzzing+taskcluster@mozilla.com",
-    "schedule": ["0 0 12 * * *", "0 0 0 * * *"],
+    "schedule": ["0 0 0,12 * * *"],
     "task": {
         "created": {"$fromNow": "0 seconds"},
         "deadline": {"$fromNow": "1 hour"},
@@ -96,11 +134,26 @@ VALID_HOOK = {
             "source": "https://github.com/MozillaSecurity/orion",
         },
         "payload": {
-            "artifacts": {},
+            "artifacts": {
+                "project/fuzzing/private/launch-params.json": {
+                    "expires": {"$fromNow": "1 week"},
+                    "path": "/launch-params.json",
+                    "type": "file",
+                },
+                "public/timings.json": {
+                    "expires": {"$fromNow": "1 week"},
+                    "path": "/timings.json",
+                    "type": "file",
+                },
+            },
             "cache": {},
             "capabilities": {},
             "command": ["fuzzing-decision", "test"],
-            "env": {"TASKCLUSTER_SECRET": "project/fuzzing/decision"},
+            "env": {
+                "FUZZING_LAUNCH_PARAMS": "/launch-params.json",
+                "FUZZING_TIMINGS": "/timings.json",
+                "TASKCLUSTER_SECRET": "project/fuzzing/decision",
+            },
             "features": {"taskclusterProxy": True},
             "image": {
                 "namespace": "project.fuzzing.orion.fuzzing-decision.master",
@@ -117,6 +170,7 @@ VALID_HOOK = {
         "scopes": [
             "queue:cancel-task:-/*",
             "queue:create-task:highest:proj-fuzzing/linux-test",
+            "queue:get-artifact:project/fuzzing/private/launch-params.json",
             "queue:scheduler-id:-",
             "secrets:get:project/fuzzing/decision",
         ],
@@ -137,6 +191,7 @@ VALID_ROLE = {
     "scopes": [
         "queue:cancel-task:-/*",
         "queue:create-task:highest:proj-fuzzing/linux-test",
+        "queue:get-artifact:project/fuzzing/private/launch-params.json",
         "queue:scheduler-id:-",
         "secrets:get:project/fuzzing/decision",
     ],
@@ -479,6 +534,7 @@ def test_tasks(env, scope_caps):
         expires = _check_date(task, "expires")
         assert expires >= deadline > created
         expected_env = {
+            "TASKCLUSTER_FUZZING_DECISION": "someTaskId",
             "TASKCLUSTER_FUZZING_POOL": "test",
             "TASKCLUSTER_SECRET": "project/fuzzing/decision",
         }
@@ -498,7 +554,7 @@ def test_tasks(env, scope_caps):
         )
         assert log_expires == expires
         assert set(task["scopes"]) == set(
-            ["secrets:get:project/fuzzing/decision"] + scopes
+            [LAUNCH_PARAMS_SCOPE, "secrets:get:project/fuzzing/decision"] + scopes
         )
         # scopes are already asserted above
         # - read the value for comparison instead of deleting the key, so the object is
@@ -582,7 +638,11 @@ def test_preprocess_tasks():
             "extra_env": {"TASKCLUSTER_FUZZING_PREPROCESS": "1"},
             "name": "preprocess",
         },
-        {"deps": ["someTaskId", task_ids[0]], "extra_env": {}, "name": "1/1"},
+        {
+            "deps": ["someTaskId", task_ids[0]],
+            "extra_env": {"TASKCLUSTER_FUZZING_PREPROCESS_TASK": task_ids[0]},
+            "name": "1/1",
+        },
     ]
     for task, expect in zip(tasks, expected):
         created = _check_date(task, "created")
@@ -590,6 +650,7 @@ def test_preprocess_tasks():
         expires = _check_date(task, "expires")
         assert expires >= deadline > created
         expected_env = {
+            "TASKCLUSTER_FUZZING_DECISION": "someTaskId",
             "TASKCLUSTER_FUZZING_POOL": "pre-pool",
             "TASKCLUSTER_SECRET": "project/fuzzing/decision",
         }
@@ -599,7 +660,9 @@ def test_preprocess_tasks():
             task, "payload", "artifacts", "project/fuzzing/private/logs", "expires"
         )
         assert log_expires == expires
-        assert set(task["scopes"]) == set(["secrets:get:project/fuzzing/decision"])
+        assert set(task["scopes"]) == set(
+            [LAUNCH_PARAMS_SCOPE, "secrets:get:project/fuzzing/decision"]
+        )
         # scopes are already asserted above
         # - read the value for comparison instead of deleting the key, so the object is
         #   printed in full on failure
@@ -673,6 +736,113 @@ def test_flatten(pool_path):
     assert pool.tasks == expect.tasks
 
 
+def test_resolver_cache():
+    resolver = PoolConfigResolver()
+    with patch("fuzzing_decision.common.pool.yaml.safe_load", wraps=yaml.safe_load):
+        pools = [
+            CommonPoolConfiguration.from_file(POOL_FIXTURES / f"{name}.yml", resolver)
+            for name in ("pool5", "pool6", "pool7", "pool8")
+        ]
+        # pool1-8 are each parsed once
+        assert yaml.safe_load.call_count == 8
+    # parents are flattened once and shared
+    pool3, _ = resolver.resolve(CommonPoolConfiguration, POOL_FIXTURES / "pool3.yml")
+    assert pool3.pool_id == "pool3"
+    uncached = [
+        CommonPoolConfiguration.from_file(POOL_FIXTURES / f"{name}.yml")
+        for name in ("pool5", "pool6", "pool7", "pool8")
+    ]
+    for pool, expect in zip(pools, uncached):
+        assert pool.name == expect.name
+        assert pool.cycle_time == expect.cycle_time
+        assert pool.macros == expect.macros
+        assert set(pool.scopes) == set(expect.scopes)
+
+
+def test_resolver_cycle(tmp_path):
+    (tmp_path / "pool-a.yml").write_text(yaml.dump({"name": "a", "parents": ["b"]}))
+    (tmp_path / "b.yml").write_text(yaml.dump({"name": "b", "parents": ["c"]}))
+    (tmp_path / "c.yml").write_text(yaml.dump({"name": "c", "parents": ["b"]}))
+    with pytest.raises(AssertionError, match="cyclic configuration"):
+        CommonPoolConfiguration.from_file(tmp_path / "pool-a.yml")
+    (tmp_path / "c.yml").write_text(yaml.dump({"name": "c", "parents": ["pool-a"]}))
+    with pytest.raises(AssertionError, match="cyclic configuration"):
+        CommonPoolConfiguration.from_file(tmp_path / "pool-a.yml")
+
+
+def _as_json(files):
+    """Convert the files found by `PoolConfigResolver.dependencies` to JSON data"""
+    return json.loads(
+        json.dumps(
+            {path.name: data for path, data in files.items()},
+            default=lambda obj: obj.isoformat(),
+        )
+    )
+
+
+def test_snapshot(tmp_path):
+    config_dir = tmp_path / "config"
+    shutil.copytree(str(POOL_FIXTURES), str(config_dir))
+    shutil.copy(str(POOL_FIXTURES.parent / "machines.yml"), str(config_dir))
+
+    compiled = PoolConfigResolver.compile(config_dir)
+    compiled.save_snapshot(tmp_path / "snapshot.json", "abc")
+    assert (
+        PoolConfigResolver.from_snapshot(
+            tmp_path / "snapshot.json", tmp_path / "virtual", "def"
+        )
+        is None
+    )
+    resolver = PoolConfigResolver.from_snapshot(
+        tmp_path / "snapshot.json", tmp_path / "virtual", "abc"
+    )
+    assert resolver.crons == compiled.crons
+    assert resolver.load(tmp_path / "virtual" / "machines.yml") == compiled.load(
+        config_dir / "machines.yml"
+    )
+
+    pool_files = resolver.glob(tmp_path / "virtual", "pool*.yml")
+    assert [path.name for path in pool_files] == [
+        path.name for path in sorted(POOL_FIXTURES.glob("pool*.yml"))
+    ]
+    for pool_path in pool_files:
+        expect = PoolConfigLoader.from_file(config_dir / pool_path.name)
+        with patch("fuzzing_decision.common.pool.yaml.safe_load") as safe_load:
+            pool = PoolConfigLoader.from_file(pool_path, resolver=resolver)
+            crons = list(pool.cycle_crons())
+            safe_load.assert_not_called()
+        assert set(pool.scopes) == set(expect.scopes)
+        for field in set(pool.FIELD_TYPES) - {"parents", "scopes"}:
+            assert getattr(pool, field) == getattr(expect, field), field
+        if expect.schedule_start is not None:
+            assert crons == list(expect.cycle_crons())
+        # files keep the data written in the repository (timestamps are written
+        # as strings in JSON)
+        assert _as_json(resolver.dependencies(pool_path)) == _as_json(
+            compiled.dependencies(config_dir / pool_path.name)
+        )
+
+    # parents are loaded flattened, with their ancestors
+    def _ancestors(resolver):
+        return {
+            path.name: ancestors
+            for (_, path), (_, ancestors) in resolver._parents.items()
+        }
+
+    parents = _ancestors(compiled)
+    assert parents
+    assert _ancestors(resolver) == parents
+    # without loading their files
+    resolver = PoolConfigResolver.from_snapshot(
+        tmp_path / "snapshot.json", tmp_path / "virtual", "abc"
+    )
+    with patch.object(CommonPoolConfiguration, "from_file") as from_file:
+        for name in parents:
+            resolver.resolve(CommonPoolConfiguration, tmp_path / "virtual" / name)
+        from_file.assert_not_called()
+    assert _ancestors(resolver) == parents
+
+
 def test_pool_map():
     class PoolConfigNoFlatten(CommonPoolConfiguration):
         def _flatten(self, _):
@@ -724,6 +894,200 @@ def test_pool_map():
     assert pool.tasks == expect.tasks
 
 
+def test_pool_map_cached():
+    resolver = PoolConfigResolver()
+    with patch("fuzzing_decision.common.pool.yaml.safe_load", wraps=yaml.safe_load):
+        cfg_map = PoolConfigMap.from_file(POOL_FIXTURES / "map1.yml", resolver)
+        pools = cfg_map.pools
+        assert list(cfg_map.iterpools()) == pools
+        assert cfg_map.pools is pools
+        # map1 and pool1 are each parsed once
+        assert yaml.safe_load.call_count == 2
+    assert [pool.pool_id for pool in pools] == ["pool1/map1"]
+
+
+def test_launch_params():
+    conf = CommonPoolConfiguration.from_file(POOL_FIXTURES / "pre-pool.yml")
+    placement = {
+        "cores_per_task": 1,
+        "cpu_affinity": "none",
+        "memory_limit": "none",
+        "numa_node": "none",
+    }
+    assert conf.launch_params() == {
+        "pools": {
+            "pre-pool": dict(placement, command=["run-fuzzing.sh"], macros={}),
+        },
+        "preprocess": {
+            "pre-pool": dict(placement, command=[], macros={"PREPROCESS": "1"}),
+        },
+    }
+
+    # pool maps are published under the names of the applied pools
+    cfg_map = CommonPoolConfigMap.from_file(POOL_FIXTURES / "map1.yml")
+    (pool,) = cfg_map.pools
+    assert cfg_map.launch_params() == {
+        "pools": {"pool1/map1": pool.launch_fields()},
+        "preprocess": {},
+    }
+
+
+@pytest.mark.parametrize("template", ["decision.yaml", "fuzzing.yaml"])
+def test_task_template(template):
+    text = (TEMPLATES / template).read_text()
+    values = {
+        "created": "2020-01-01T00:00:00.000Z",
+        "deadline": "2020-01-01T01:00:00.000Z",
+        "description": "line 1\nline 2",
+        "expires": "2020-01-08T00:00:00.000Z",
+        "max_run_time": 3600,
+        "name": "Fuzzing task - 1/2",
+        "owner_email": "fuzzing@allizom.org",
+        "pool_id": "pool/id",
+        "provisioner": "proj-fuzzing",
+        "scheduler": "-",
+        "secret": "project/fuzzing/decision",
+        "task_group": "someTaskGroup",
+        "task_id": "someTask",
+    }
+    expected = yaml.safe_load(
+        Template(text).substitute(
+            values, description=values["description"].replace("\n", "\\n")
+        )
+    )
+    tmpl = TaskTemplate(text)
+    task = tmpl.render(**values)
+    assert json.dumps(task) == json.dumps(expected)
+    # rendered tasks don't share anything mutable
+    task["scopes"].append("extra")
+    task["payload"]["env"]["extra"] = "1"
+    assert json.dumps(tmpl.render(**values)) == json.dumps(expected)
+
+
+@pytest.mark.parametrize("scheduled", [False, True])
+def test_cancel_tasks(scheduled):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    old = now - datetime.timedelta(days=6)
+
+    def _fire(task_id, created, fired_by="triggerHook", result="success"):
+        return {
+            "taskId": task_id,
+            "taskCreateTime": created.isoformat(),
+            "firedBy": fired_by,
+            "result": result,
+        }
+
+    def _task(task_id, *states):
+        return {"status": {"taskId": task_id, "runs": [{"state": s} for s in states]}}
+
+    fires = [
+        [_fire("group1", now), _fire("failed", now, result="error")],
+        [
+            _fire("self", now, fired_by="schedule" if scheduled else "triggerHook"),
+            _fire("old", old),
+        ],
+        [_fire("older", old)],
+    ]
+    groups = {
+        "group1": [
+            [_task("a", "running"), _task("b", "completed")],
+            [_task("c", "exception", "pending")],
+        ],
+        "self": [[_task("self", "running"), _task("d", "pending")]],
+    }
+
+    def _pages(pages, key):
+        def _callback(request):
+            token = int(request.params.get("continuationToken", 0))
+            result = {key: pages[token]}
+            if token + 1 < len(pages):
+                result["continuationToken"] = str(token + 1)
+            return (200, {}, json.dumps(result))
+
+        return _callback
+
+    cancelled = []
+
+    def _cancel(request):
+        cancelled.append(request.url.split("/")[-2])
+        return (200, {}, json.dumps({"status": {}}))
+
+    with responses.RequestsMock(
+        assert_all_requests_are_fired=False
+    ) as rsps, patch.object(
+        taskcluster, "options", {"rootUrl": "http://taskcluster.test"}
+    ), patch.dict(
+        os.environ, {"TASK_ID": "self"}
+    ):
+        rsps.add_callback(
+            responses.GET,
+            "http://taskcluster.test/api/hooks/v1/hooks/project-fuzzing/hk/last-fires",
+            callback=_pages(fires, "lastFires"),
+        )
+        for group, pages in groups.items():
+            rsps.add_callback(
+                responses.GET,
+                f"http://taskcluster.test/api/queue/v1/task-group/{group}/list",
+                callback=_pages(pages, "tasks"),
+            )
+        rsps.add_callback(
+            responses.POST,
+            re.compile(r"http://taskcluster\.test/api/queue/v1/task/\w+/cancel"),
+            callback=_cancel,
+        )
+        cancel_tasks("hk", jobs=2)
+        listed = {call.request.path_url.split("/")[-2] for call in rsps.calls}
+        fire_pages = [call for call in rsps.calls if "/last-fires" in call.request.url]
+
+    # the page with an old fire is the last one requested
+    assert len(fire_pages) == 2
+
+    if scheduled:
+        assert not cancelled
+        assert listed == {"hk"}
+    else:
+        assert sorted(cancelled) == ["a", "c", "d"]
+        # failed and old fires are not listed
+        assert "old" not in listed and "failed" not in listed
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_create_tasks(fail):
+    created = []
+
+    def _create(request):
+        task = json.loads(request.body)
+        if fail and task["metadata"]["name"] == "task-2":
+            return (400, {}, json.dumps({"message": "bad task"}))
+        created.append(request.url.rsplit("/", 1)[-1])
+        return (200, {}, json.dumps({"status": {}}))
+
+    # the first task is a dependency of all the others
+    tasks = [("pre", {"metadata": {"name": "pre"}, "dependencies": []})]
+    for i in range(5):
+        task = {"metadata": {"name": f"task-{i}"}, "dependencies": ["pre", "dg"]}
+        tasks.append((f"task{i}", task))
+
+    with responses.RequestsMock() as rsps, patch.object(
+        taskcluster, "options", {"rootUrl": "http://taskcluster.test"}
+    ):
+        rsps.add_callback(
+            responses.PUT,
+            re.compile(r"http://taskcluster\.test/api/queue/v1/task/\w+"),
+            callback=_create,
+        )
+        if fail:
+            with pytest.raises(RuntimeError, match=r"tasks: task2$"):
+                create_tasks(tasks, jobs=3)
+        else:
+            create_tasks(tasks, jobs=3)
+
+    assert created[0] == "pre"
+    assert sorted(created) == sorted(
+        task_id for task_id, _ in tasks if not fail or task_id != "task2"
+    )
+
+
 @pytest.mark.parametrize(
     "loader, config_cls, map_cls",
     [
@@ -738,7 +1102,7 @@ def test_pool_loader(loader, config_cls, map_cls):
     assert isinstance(obj, map_cls)
 
 
-def test_cycle_crons():
+def test_cycle_crons(caplog):
     conf = CommonPoolConfiguration(
         "test",
         {
@@ -764,13 +1128,30 @@ def test_cycle_crons():
         },
     )
 
+    def _expand(crons):
+        """Find the times matched by cron patterns, as cron fields"""
+        fields = []
+        for cron in crons:
+            values = []
+            for field, (low, high) in zip(cron.split(), CRON_FIELD_RANGES):
+                if field == "*":
+                    values.append([None])
+                    continue
+                matched = []
+                for part in field.split(","):
+                    step = 1
+                    if "/" in part:
+                        part, step = part.split("/")
+                    first, _, last = part.partition("-")
+                    matched.extend(range(int(first), int(last or first) + 1, int(step)))
+                values.append(matched)
+            fields.extend(itertools.product(*values))
+        return fields
+
+    start = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
     # cycle time 6h
-    assert list(conf.cycle_crons()) == [
-        "0 0 6 * * *",
-        "0 0 12 * * *",
-        "0 0 18 * * *",
-        "0 0 0 * * *",
-    ]
+    assert list(conf.cycle_crons()) == ["0 0 0-18/6 * * *"]
 
     # cycle time 3.5 days
     conf.cycle_time = 3600 * 24 * 3.5
@@ -782,26 +1163,20 @@ def test_cycle_crons():
     # cycle time 17h
     conf.cycle_time = 3600 * 17
     crons = list(conf.cycle_crons())
-    assert len(crons) == (365 * 24 // 17) + 1
-    assert crons[:4] == ["0 0 17 1 1 *", "0 0 10 2 1 *", "0 0 3 3 1 *", "0 0 20 3 1 *"]
-
-    # cycle time 48h
-    conf.cycle_time = 3600 * 48
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 * 24 // 48) + 1
-    assert crons[:4] == ["0 0 0 3 1 *", "0 0 0 5 1 *", "0 0 0 7 1 *", "0 0 0 9 1 *"]
+    assert len(crons) < (365 * 24 // 17) + 1
+    assert crons[:2] == ["0 0 12,17 1 1 *", "0 0 10 2,19 1 *"]
 
-    # cycle time 72h
-    conf.cycle_time = 3600 * 72
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 * 24 // 72) + 1
-    assert crons[:4] == ["0 0 0 4 1 *", "0 0 0 7 1 *", "0 0 0 10 1 *", "0 0 0 13 1 *"]
-
-    # cycle time 17d
-    conf.cycle_time = 3600 * 24 * 17
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 // 17) + 1
-    assert crons[:4] == ["0 0 0 18 1 *", "0 0 0 4 2 *", "0 0 0 21 2 *", "0 0 0 10 3 *"]
+    for cycle_time in (17, 48, 72, 24 * 17, 7.5, 17.2):
+        conf.cycle_time = int(3600 * cycle_time)
+        crons = list(conf.cycle_crons())
+        times = list(conf._cycle_times(start))
+        assert len(crons) <= len(times)
+        # the patterns match exactly the same times
+        expanded = _expand(crons)
+        assert len(expanded) == len(set(times))
+        assert set(expanded) == set(times)
+    # 17.2h can't be compacted
+    assert "needs 509 cron patterns" in caplog.text
 
     # using schedule_start should be the same as using datetime.now()
     conf.schedule_start = None
@@ -821,3 +1196,418 @@ def test_required():
     CommonPoolConfiguration("test", {"name": "test pool"}, _flattened={})
     with pytest.raises(AssertionError):
         CommonPoolConfiguration("test", {}, _flattened={})
+
+
+def test_validation_errors():
+    data = {
+        "artifacts": {"/log": {"url": "public/log", "type": "pipe"}},
+        "container": {"type": "docker-image"},
+        "cpu": "mips",
+        "cpu_affinity": "0-3,x",
+        "cycle_time": "1x",
+        "macros": {"ENV": ["list"]},
+        "memory_limit": "lots",
+        "name": "test pool",
+        "numa_node": -1,
+        "preprocess_cache": ["gecko.v2.latest", "gecko..latest"],
+        "tasks": "3",
+        "unknown": 1,
+    }
+    with pytest.raises(AssertionError) as exc:
+        CommonPoolConfiguration("test", data, _flattened={})
+    assert str(exc.value).splitlines() == [
+        "configuration has extra fields: ['unknown']",
+        "expected artifact '/log' .type to be one of: file, directory",
+        "missing required keys for 'container' with type 'docker-image': name",
+        "unknown 'cpu': mips",
+        "invalid 'cpu_affinity' '0-3,x': invalid CPU list: '0-3,x'",
+        "invalid 'cycle_time' '1x': trailing data",
+        "expected macro 'ENV' value to be 'int' or 'str', got 'list'",
+        "invalid 'memory_limit' 'lots': size should be a number followed by "
+        "optional si prefix",
+        "invalid 'numa_node' -1: expected a node number, 'auto' or 'none'",
+        "invalid index namespace in 'preprocess_cache': 'gecko..latest'",
+        "expected 'tasks' to be 'int', got 'str'",
+    ]
+
+
+@pytest.mark.parametrize(
+    "cpus, expected",
+    [
+        ("0", [0]),
+        ("0-3", [0, 1, 2, 3]),
+        ("0-1, 8,10-11", [0, 1, 8, 10, 11]),
+        ("4,0-1,1", [0, 1, 4]),
+    ],
+)
+def test_parse_cpu_list(cpus, expected):
+    assert parse_cpu_list(cpus) == expected
+    with pytest.raises(AssertionError):
+        parse_cpu_list(cpus + ",3-1")
+
+
+def test_preprocess_cache(tmp_path):
+    shutil.copy(POOL_FIXTURES / "pre-pool.yml", tmp_path)
+    pre = yaml.safe_load((POOL_FIXTURES / "pre.yml").read_text())
+    pre["preprocess_cache"] = ["gecko.v2.latest.build"]
+    (tmp_path / "pre.yml").write_text(yaml.dump(pre))
+    conf = PoolConfiguration.from_file(tmp_path / "pre-pool.yml")
+    namespace = f"{PREPROCESS_INDEX}.linux-pre-pool."
+    route_scope = f"queue:route:index.{namespace}*"
+    assert route_scope in conf.build_decision_task()["scopes"]
+
+    now = datetime.datetime(2020, 1, 1)
+    indexed = {"gecko.v2.latest.build": {"taskId": "build1"}}
+
+    def _find_task(path):
+        if path not in indexed:
+            raise TaskclusterRestFailure("Indexed task not found", None, 404)
+        return indexed[path]
+
+    index = Mock()
+    index.findTask.side_effect = _find_task
+    with patch.object(taskcluster, "get_service", return_value=index):
+        # nothing indexed under the key yet
+        key, task_id = conf.find_preprocess(now)
+        assert task_id is None
+        # the key depends on the tasks indexed as inputs
+        indexed["gecko.v2.latest.build"]["taskId"] = "build2"
+        assert conf.find_preprocess(now)[0] != key
+        indexed["gecko.v2.latest.build"]["taskId"] = "build1"
+        assert conf.find_preprocess(now)[0] == key
+
+        # a previous preprocess task indexed with the key is reused, unless its
+        # artifacts expire before the fuzzing tasks are done
+        indexed[namespace + key] = {
+            "taskId": "previous",
+            "expires": "2020-01-01T00:30:00.000Z",
+        }
+        assert conf.find_preprocess(now) == (key, None)
+        indexed[namespace + key]["expires"] = "2020-01-08T00:00:00.000Z"
+        assert conf.find_preprocess(now) == (key, "previous")
+
+    # a new preprocess task is indexed with its key when it succeeds
+    task_ids, tasks = zip(*conf.build_tasks("someTaskId", preprocess_key=key))
+    assert tasks[0]["routes"] == [f"index.{namespace}{key}"]
+    assert f"queue:route:index.{namespace}{key}" in tasks[0]["scopes"]
+    assert tasks[0]["payload"]["env"]["FUZZING_PREPROCESS_KEY"] == key
+    assert tasks[1]["dependencies"] == ["someTaskId", task_ids[0]]
+    assert tasks[1]["payload"]["env"]["TASKCLUSTER_FUZZING_PREPROCESS_TASK"] == (
+        task_ids[0]
+    )
+
+    # or the previous one is used instead
+    _, tasks = zip(
+        *conf.build_tasks("someTaskId", preprocess_key=key, preprocess_task_id="prev")
+    )
+    assert len(tasks) == 1
+    assert tasks[0]["dependencies"] == ["someTaskId", "prev"]
+    assert tasks[0]["routes"] == []
+    # it is in another task group, so its id is passed to the fuzzing tasks
+    assert tasks[0]["payload"]["env"]["TASKCLUSTER_FUZZING_PREPROCESS_TASK"] == "prev"
+
+    # without preprocess_cache, nothing is looked up
+    conf = PoolConfiguration.from_file(POOL_FIXTURES / "pre-pool.yml")
+    with patch.object(taskcluster, "get_service") as get_service:
+        assert conf.find_preprocess(now) == (None, None)
+        get_service.assert_not_called()
+    assert not any(
+        scope.startswith("queue:route:")
+        for scope in conf.build_decision_task()["scopes"]
+    )
+
+
+PREPROCESS_KEY_SCRIPT = """
+import datetime, sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+from taskcluster.exceptions import TaskclusterRestFailure
+from fuzzing_decision.common import taskcluster
+from fuzzing_decision.decision.pool import PoolConfiguration
+
+index = Mock()
+index.findTask.side_effect = TaskclusterRestFailure("Not found", None, 404)
+conf = PoolConfiguration.from_file(Path(sys.argv[1]))
+with patch.object(taskcluster, "get_service", return_value=index):
+    print(conf.find_preprocess(datetime.datetime(2020, 1, 1))[0])
+"""
+
+
+def test_preprocess_cache_key_stable(tmp_path):
+    """the preprocess key doesn't depend on the hash seed of the decision task"""
+    pool = yaml.safe_load((POOL_FIXTURES / "pre-pool.yml").read_text())
+    pool["scopes"] = [f"secrets:get:project/fuzzing/pool-{i}" for i in range(8)]
+    (tmp_path / "pre-pool.yml").write_text(yaml.dump(pool))
+    pre = yaml.safe_load((POOL_FIXTURES / "pre.yml").read_text())
+    pre["preprocess_cache"] = ["gecko.v2.latest.build"]
+    pre["scopes"] = [f"secrets:get:project/fuzzing/pre-{i}" for i in range(8)]
+    (tmp_path / "pre.yml").write_text(yaml.dump(pre))
+
+    keys = set()
+    pool_yml = tmp_path / "pre-pool.yml"
+    script = [sys.executable, "-c", PREPROCESS_KEY_SCRIPT, str(pool_yml)]
+    for seed in range(1, 5):
+        result = subprocess.run(
+            script,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        )
+        keys.add(result.stdout.strip())
+    assert len(keys) == 1
+    assert keys != {"None"}
+
+
+def test_validation_cache(tmp_path):
+    pool_yml = tmp_path / "pool-a.yml"
+    pool_yml.write_text(yaml.dump({"name": "a", "tasks": 1}))
+    stat = pool_yml.stat()
+    key = (pool_yml, stat.st_mtime_ns, stat.st_size)
+    validator = CommonPoolConfiguration.validator()
+
+    resolver = PoolConfigResolver()
+    data = resolver.load(pool_yml)
+    assert resolver.validate(CommonPoolConfiguration, data, pool_yml) == ()
+    assert validator._results[key] == ()
+
+    # other resolvers reuse the result for the same version of the file
+    with patch.dict(validator._results, {key: ("cached error",)}):
+        resolver = PoolConfigResolver()
+        data = resolver.load(pool_yml)
+        assert resolver.validate(CommonPoolConfiguration, data, pool_yml) == (
+            "cached error",
+        )
+        # modified data isn't cached
+        assert resolver.validate(CommonPoolConfiguration, data) == ()
+
+    # a new version of the file is validated again
+    pool_yml.write_text(yaml.dump({"name": "a", "tasks": "1"}))
+    os.utime(str(pool_yml), ns=(0, 0))
+    resolver = PoolConfigResolver()
+    data = resolver.load(pool_yml)
+    assert resolver.validate(CommonPoolConfiguration, data, pool_yml) == (
+        "expected 'tasks' to be 'int', got 'str'",
+    )
+
+
+@pytest.mark.parametrize(
+    "cloud, imageset", [("aws", "generic-worker-A"), ("gcp", "docker-worker")]
+)
+def test_worker_config_shared(mock_clouds, cloud, imageset):
+    provider = mock_clouds[cloud]
+    machines = [("a1", 1, frozenset()), ("a2", 1, frozenset())]
+    configs = [
+        launch_config["workerConfig"]
+        for _ in range(2)
+        for launch_config in provider.build_launch_configs(imageset, machines, 120)
+    ]
+    assert len(configs) > 2
+    assert all(config is configs[0] for config in configs)
+
+    # the imageset isn't modified, so the deploymentId is stable
+    imagesets = copy.deepcopy(provider.imagesets)
+    provider._worker_configs.clear()
+    assert provider.get_worker_config(imageset) == configs[0]
+    assert provider.imagesets == imagesets
+
+    with pytest.raises(TypeError):
+        configs[0]["genericWorker"]["config"]["deploymentId"] = "changed"
+    with pytest.raises(TypeError):
+        configs[0]["shutdown"].update(enabled=False)
+    assert copy.deepcopy(configs[0]) == configs[0]
+    assert json.loads(json.dumps(configs[0])) == configs[0]
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        # without a limit, all are kept in their original order
+        (
+            {},
+            [
+                "us-west1-a/base",
+                "us-west1-b/base",
+                "us-west1-a/2-cpus",
+                "us-west1-b/2-cpus",
+                "us-west1-a/more-ram",
+                "us-west1-b/more-ram",
+            ],
+        ),
+        # the cheapest are kept, in their original order
+        (
+            {"max_launch_configs": 3},
+            ["us-west1-a/base", "us-west1-a/2-cpus", "us-west1-b/2-cpus"],
+        ),
+        # equal prices are ranked by capacity
+        (
+            {"max_launch_configs": 3, "capacity_hints": {"us-west1-a": 0.5}},
+            ["us-west1-b/base", "us-west1-a/2-cpus", "us-west1-b/2-cpus"],
+        ),
+        (
+            {"capacity_hints": {"us-west1-a": 0}},
+            ["us-west1-b/base", "us-west1-b/2-cpus", "us-west1-b/more-ram"],
+        ),
+    ],
+)
+def test_launch_config_policy(mock_clouds, policy, expected):
+    provider = mock_clouds["gcp"]
+    provider.policy = LaunchConfigPolicy.from_data({"gcp": policy})["gcp"]
+    machines = [(name, 1, frozenset()) for name in ("base", "2-cpus", "more-ram")]
+    # more-ram has no price, it is ranked last
+    prices = {"base": 0.1, "2-cpus": 0.05, "more-ram": None}
+    launch_configs = provider.build_launch_configs(
+        "docker-worker", machines, 120, prices
+    )
+    assert [
+        launch_config["machineType"].replace("zones/", "").replace("/machineTypes", "")
+        for launch_config in launch_configs
+    ] == expected
+
+
+@pytest.mark.usefixtures("appconfig")
+@pytest.mark.parametrize(
+    "specs, prices, expected",
+    [
+        # without prices, the first launch config is kept
+        ({}, None, "us-west1-a/2-cpus"),
+        # the cheaper machine is kept, the expensive one pruned
+        ({"2-cpus": 0.3, "more-ram": 0.2}, None, "us-west1-a/more-ram"),
+        # the price snapshot takes precedence over machines.yml
+        (
+            {"2-cpus": 0.3, "more-ram": 0.2},
+            {"gcp": {"2-cpus": 0.1}},
+            "us-west1-a/2-cpus",
+        ),
+        # machines without a price are ranked last
+        ({}, {"gcp": {"more-ram": 0.1}}, "us-west1-a/more-ram"),
+    ],
+)
+def test_machine_prices(mock_clouds, specs, prices, expected):
+    data = yaml.safe_load((POOL_FIXTURES.parent / "machines.yml").read_text())
+    for machine, price in specs.items():
+        data["gcp"]["x64"][machine]["price"] = price
+    machines = MachineTypes(data, prices)
+    mock_clouds["gcp"].policy = LaunchConfigPolicy(max_launch_configs=1)
+
+    conf = PoolConfiguration(
+        "test",
+        {
+            "cloud": "gcp",
+            "command": [],
+            "container": "MozillaSecurity/fuzzer:latest",
+            "cores_per_task": 2,
+            "cpu": "x64",
+            "cycle_time": "12h",
+            "disk_size": "120g",
+            "imageset": "docker-worker",
+            "max_run_time": "12h",
+            "metal": False,
+            "minimum_memory_per_core": "1g",
+            "name": "test",
+            "parents": [],
+            "platform": "linux",
+            "schedule_start": None,
+            "tasks": 1,
+        },
+    )
+    pool, _, _ = conf.build_resources(mock_clouds, machines)
+    assert [
+        launch_config["machineType"].replace("zones/", "").replace("/machineTypes", "")
+        for launch_config in pool.config["launchConfigs"]
+    ] == [expected]
+
+
+@pytest.mark.parametrize("cycle_time", [6, 84, 17])
+def test_cron_times(cycle_time):
+    conf = CommonPoolConfiguration.__new__(CommonPoolConfiguration)
+    conf.cycle_time = cycle_time * 3600
+    conf.pool_id = "test"
+    start = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    crons = conf._cycle_crons(start)
+
+    # annual schedules glitch around the anniversary, skip the first day
+    first = start + datetime.timedelta(days=1)
+    stop = first + datetime.timedelta(days=7)
+    expected = []
+    time = start
+    while time < stop:
+        if time >= first:
+            expected.append(time)
+        time += datetime.timedelta(hours=cycle_time)
+    assert cron_times(crons, first, stop) == expected
+
+
+def test_plan_capacity(capsys, tmp_path):
+    shutil.copy(str(POOL_FIXTURES.parent / "machines.yml"), str(tmp_path))
+    (tmp_path / "parent.yml").write_text(
+        yaml.dump(
+            {
+                "cloud": "gcp",
+                "command": ["run-fuzzing.sh"],
+                "container": "MozillaSecurity/fuzzer:latest",
+                "cores_per_task": 2,
+                "cpu": "x64",
+                "cycle_time": "12h",
+                "disk_size": "120g",
+                "imageset": "docker-worker",
+                "max_run_time": "12h",
+                "metal": False,
+                "minimum_memory_per_core": "1g",
+                "name": "parent",
+                "parents": [],
+                "platform": "linux",
+                "schedule_start": "1970-01-01T00:00:00Z",
+                "tasks": 3,
+            }
+        )
+    )
+    pools = {
+        # the previous tasks run until the next decision cancels them
+        "pool1": ({}, 4),
+        # tasks are cancelled before max_run_time
+        "pool2": ({"cycle_time": "1h", "max_run_time": "3h", "tasks": 2}, 3),
+        # tasks are done before the next decision
+        "pool3": ({"cycle_time": "6h", "max_run_time": "4h"}, 3),
+        # no machine type has enough memory, it doesn't prevent planning the others
+        "pool4": ({"minimum_memory_per_core": "1000g"}, None),
+    }
+    for name, (fields, _) in pools.items():
+        (tmp_path / f"{name}.yml").write_text(
+            yaml.dump(dict(fields, name=name, parents=["parent"]))
+        )
+    resolver = PoolConfigResolver()
+    loaded = [
+        CommonPoolConfigLoader.from_file(tmp_path / f"{name}.yml", resolver=resolver)
+        for name in pools
+    ]
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    plans = plan_capacity(
+        loaded, MachineTypes.from_file(tmp_path / "machines.yml"), start
+    )
+    assert plans[3] == {"error": "No available machines match specified configuration"}
+    plans = plans[:3]
+    assert [plan["peak"] for plan in plans] == [peak for _, peak in pools.values()][:3]
+    for plan in plans:
+        assert plan["timeline"][0][0] == start
+        assert all(time >= start for time, _, _ in plan["timeline"])
+
+    # pool2 fires every hour, while pool1 and pool3 tasks are running
+    assert peak_usage(plan["timeline"] for plan in plans) == (9, 18)
+    assert [pool.max_capacity() for pool in loaded[:3]] == [7, 13, 7]
+
+    # the report lists the pool which failed, and the others
+    argv = ["fuzzing-capacity-plan", str(tmp_path), "--start", start.isoformat()]
+    with patch("sys.argv", argv):
+        assert plan_main() == 1
+    out = capsys.readouterr().out
+    assert re.search(r"^pool4 +gcp +error: No available machines", out, re.M)
+    assert re.search(r"^pool1 +gcp +4 +7 +5$", out, re.M)
+
+
+def test_imageset_regions():
+    assert imageset_regions(POOL_FIXTURES.parent / "community") == {
+        "aws": {"docker-worker": set(), "generic-worker-A": {"us-west-1"}},
+        # imagesets without a GCP image can't run in any GCP region
+        "gcp": {"docker-worker": {"us-west1"}, "generic-worker-A": set()},
+    }
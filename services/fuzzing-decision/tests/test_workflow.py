@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import importlib.util
+import json
+import os
 import pathlib
 import re
+import shutil
+import subprocess
+import tempfile
+import time
+from unittest.mock import patch
 
+import click
 import pytest
 import yaml
+from tcadmin.resources import Resources
 
+from fuzzing_decision.common.pool import PoolConfigResolver
+from fuzzing_decision.common.timing import PhaseTimer
+from fuzzing_decision.decision.cli import main
+from fuzzing_decision.decision.pool import PoolConfiguration
 from fuzzing_decision.decision.workflow import Workflow
 
+FIXTURES_DIR = pathlib.Path(__file__).parent / "fixtures"
+
 YAML_CONF = """---
 fuzzing_config:
   path: /path/to/secret_conf
@@ -102,3 +119,454 @@ def test_configure_secret(mock_taskcluster_workflow):
         "fuzzing_config": {"revision": "deadbeef", "url": "git@server:repo.git"},
         "private_key": "ssh super secret",
     }
+
+
+@pytest.fixture
+def generate_workflow(tmp_path):
+    """Workflow with fuzzing & community configs suitable for `generate`"""
+    community = tmp_path / "community"
+    shutil.copytree(str(FIXTURES_DIR / "community"), str(community))
+    (community / "config" / "projects").mkdir()
+    (community / "config" / "projects" / "fuzzing.yml").write_text(
+        yaml.dump({"fuzzing": {}})
+    )
+
+    fuzzing = tmp_path / "fuzzing"
+    fuzzing.mkdir()
+    shutil.copy(str(FIXTURES_DIR / "machines.yml"), str(fuzzing))
+    (fuzzing / "parent.yml").write_text(
+        yaml.dump(
+            {
+                "cloud": "gcp",
+                "command": ["run-fuzzing.sh"],
+                "container": "MozillaSecurity/fuzzer:latest",
+                "cores_per_task": 2,
+                "cpu": "x64",
+                "cycle_time": "12h",
+                "disk_size": "120g",
+                "imageset": "docker-worker",
+                "max_run_time": "12h",
+                "metal": False,
+                "minimum_memory_per_core": "1g",
+                "name": "parent",
+                "parents": [],
+                "platform": "linux",
+                "schedule_start": "1970-01-01T00:00:00Z",
+                "tasks": 3,
+            }
+        )
+    )
+    for i in range(4):
+        (fuzzing / f"pool{i}.yml").write_text(
+            yaml.dump({"name": f"pool {i}", "parents": ["parent"], "tasks": i + 1})
+        )
+
+    workflow = Workflow()
+    workflow.community_config_dir = community
+    workflow.fuzzing_config_dir = fuzzing
+    return workflow
+
+
+@pytest.mark.usefixtures("appconfig")
+def test_generate_parallel(generate_workflow):
+    config = {"fuzzing_config": {}}
+    serial = Resources()
+    generate_workflow.generate(serial, config)
+    assert len(list(serial)) == 12
+
+    parallel = Resources()
+    generate_workflow.generate(parallel, config, jobs=2)
+    assert [res.to_json() for res in parallel] == [res.to_json() for res in serial]
+
+
+@pytest.mark.usefixtures("appconfig")
+def test_generate_launch_configs(generate_workflow):
+    (generate_workflow.fuzzing_config_dir / "launch-configs.yml").write_text(
+        yaml.dump({"gcp": {"max_launch_configs": 1}})
+    )
+    # launch configs are ranked with the prices of the machine types
+    (generate_workflow.fuzzing_config_dir / "spot-prices.yml").write_text(
+        yaml.dump({"gcp": {"2-cpus": 0.2, "more-ram": 0.1}})
+    )
+    resources = Resources()
+    generate_workflow.generate(resources, {"fuzzing_config": {}})
+    pools = [res for res in resources if res.kind == "WorkerPool"]
+    assert len(pools) == 4
+    for pool in pools:
+        assert [lc["machineType"] for lc in pool.config["launchConfigs"]] == [
+            "zones/us-west1-a/machineTypes/more-ram"
+        ]
+
+
+@pytest.mark.usefixtures("appconfig")
+@pytest.mark.parametrize("jobs", [None, 2])
+def test_generate_errors(generate_workflow, jobs):
+    for name in ("pool1", "pool3"):
+        (generate_workflow.fuzzing_config_dir / f"{name}.yml").write_text(
+            yaml.dump({"name": name, "parents": ["missing"]})
+        )
+    with pytest.raises(RuntimeError, match=r"for 2 pool\(s\): pool1\.yml, pool3\.yml$"):
+        generate_workflow.generate(Resources(), {"fuzzing_config": {}}, jobs=jobs)
+
+
+@pytest.mark.usefixtures("appconfig")
+@pytest.mark.parametrize("jobs", [None, 2])
+def test_generate_timings(tmp_path, generate_workflow, jobs):
+    timer = PhaseTimer()
+    with patch("fuzzing_decision.decision.workflow.timings", timer), patch(
+        "fuzzing_decision.common.pool.timings", timer
+    ):
+        with timer.phase("generate"):
+            # nested instances of a running phase are not counted again
+            with timer.phase("generate"):
+                generate_workflow.generate(
+                    Resources(), {"fuzzing_config": {}}, jobs=jobs
+                )
+    timer.save(tmp_path / "timings.json")
+    result = json.loads((tmp_path / "timings.json").read_text())
+
+    phases = {
+        (phase["name"], phase.get("pool")): phase["calls"]
+        for phase in result["phases"]
+        if phase["name"] not in {"flatten", "parse_yaml"}
+    }
+    # phases nested in build_resources are sent back by worker processes
+    assert {phase["name"] for phase in result["phases"]} >= {"flatten", "parse_yaml"}
+    assert phases == {
+        ("generate", None): 1,
+        ("build_resources", "pool0.yml"): 1,
+        ("build_resources", "pool1.yml"): 1,
+        ("build_resources", "pool2.yml"): 1,
+        ("build_resources", "pool3.yml"): 1,
+    }
+    assert all(phase["duration"] <= result["total"] for phase in result["phases"])
+
+
+def test_tc_admin_boot(tmp_path):
+    """tc-admin.py can be loaded by tc-admin, and its options reach the workflow"""
+    from tcadmin.appconfig import AppConfig
+
+    spec = importlib.util.spec_from_file_location(
+        "tc_admin", pathlib.Path(__file__).parent.parent / "tc-admin.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(os.environ, {"FUZZING_JOBS": "3"}):
+        spec.loader.exec_module(module)
+    appconfig = module.appconfig
+    assert appconfig.generators.names == ["tc_admin_boot"]
+
+    # parse the command-line like tc-admin does, with the registered options
+    def generate_resources(**kwargs):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(Workflow.tc_admin_boot(Resources()))
+        finally:
+            loop.close()
+
+    for name, kwargs in appconfig.options.option_args.items():
+        generate_resources = click.option(name, **kwargs)(generate_resources)
+    generate_command = click.command()(generate_resources)
+
+    with patch.object(AppConfig, "current", return_value=appconfig), patch.object(
+        Workflow, "configure"
+    ) as configure, patch.object(Workflow, "clone"), patch.object(
+        Workflow, "generate"
+    ) as generate:
+        generate_command.main(
+            ["--fuzzing-configuration", str(tmp_path / "config.yml")],
+            standalone_mode=False,
+        )
+    assert configure.call_args[1]["local_path"] == tmp_path / "config.yml"
+    assert generate.call_args[1]["jobs"] == 3
+
+
+def test_render_tasks(tmp_path, generate_workflow):
+    hashes = generate_workflow.render_tasks(tmp_path / "jsonl")
+    lines = [
+        json.loads(line)
+        for line in (tmp_path / "jsonl" / "tasks.jsonl").read_text().splitlines()
+    ]
+    # a decision task and `tasks` fuzzing tasks for each pool
+    assert len(lines) == 4 + (1 + 2 + 3 + 4)
+    assert [line["taskId"] for line in lines[:3]] == ["decision", "task1", "decision"]
+    assert lines[1]["task"]["taskGroupId"] == "decision"
+    assert (tmp_path / "jsonl" / "hashes.txt").read_text().splitlines() == [
+        f"{digest}  {name}" for name, digest in hashes.items()
+    ]
+
+    # the format doesn't change the hashes
+    assert generate_workflow.render_tasks(tmp_path / "json", output_format="json") == (
+        hashes
+    )
+    pool3 = json.loads((tmp_path / "json" / "pool3.json").read_text())
+    assert [task["taskId"] for task in pool3] == [
+        "decision",
+        "task1",
+        "task2",
+        "task3",
+        "task4",
+    ]
+
+    # only the pools changed have a different hash
+    (generate_workflow.fuzzing_config_dir / "pool1.yml").write_text(
+        yaml.dump({"name": "pool 1", "parents": ["parent"], "tasks": 5})
+    )
+    generate_workflow.resolver = PoolConfigResolver()
+    changed = generate_workflow.render_tasks(tmp_path / "changed", ["pool0", "pool1"])
+    assert changed["pool0"] == hashes["pool0"]
+    assert changed["pool1"] != hashes["pool1"]
+
+
+@pytest.mark.usefixtures("appconfig")
+def test_generate_incremental(tmp_path, generate_workflow):
+    workflow = generate_workflow
+    config = {"fuzzing_config": {}, "snapshot_dir": str(tmp_path / "snapshots")}
+
+    def _generate(revision, base_revision=None):
+        workflow.fuzzing_config_revision = revision
+        config["fuzzing_config"] = {"url": "git@repo", "revision": revision}
+        resources = Resources()
+        with patch.object(
+            PoolConfiguration,
+            "build_resources",
+            autospec=True,
+            side_effect=PoolConfiguration.build_resources,
+        ) as build:
+            workflow.generate(resources, config, base_revision=base_revision)
+        built = sorted(call[0][0].pool_id for call in build.call_args_list)
+        result = []
+        for res in resources:
+            res = res.to_json()
+            if res["kind"] == "Hook":
+                # reused hooks are updated to the current revision
+                env = res["task"]["payload"]["env"]
+                assert env["FUZZING_GIT_REVISION"] == revision
+                env["FUZZING_GIT_REVISION"] = "<revision>"
+            result.append(res)
+        return result, built
+
+    full, built = _generate("rev1")
+    assert built == ["pool0", "pool1", "pool2", "pool3"]
+    assert (tmp_path / "snapshots" / "rev1.resources.json").is_file()
+
+    # nothing changed, pools aren't even flattened
+    with patch.object(PoolConfigResolver, "resolve") as resolve:
+        assert _generate("rev2", "rev1") == (full, [])
+        resolve.assert_not_called()
+
+    # only the changed pool is rebuilt
+    pool2 = workflow.fuzzing_config_dir / "pool2.yml"
+    pool2.write_text(yaml.dump({"name": "pool 2", "parents": ["parent"], "tasks": 9}))
+    workflow.resolver = PoolConfigResolver()
+    resources, built = _generate("rev3", "rev2")
+    assert built == ["pool2"]
+    assert (resources, ["pool0", "pool1", "pool2", "pool3"]) == _generate("rev4")
+
+    # changing the parent rebuilds all pools
+    parent = workflow.fuzzing_config_dir / "parent.yml"
+    parent.write_text(parent.read_text().replace("tasks: 3", "tasks: 4"))
+    workflow.resolver = PoolConfigResolver()
+    _, built = _generate("rev5", "rev4")
+    assert built == ["pool0", "pool1", "pool2", "pool3"]
+
+    # unknown base revision
+    _, built = _generate("rev6", "missing")
+    assert built == ["pool0", "pool1", "pool2", "pool3"]
+
+    # a new version of the generator rebuilds all pools
+    with patch(
+        "fuzzing_decision.decision.workflow.generator_digest", return_value="new"
+    ):
+        _, built = _generate("rev7", "rev6")
+    assert built == ["pool0", "pool1", "pool2", "pool3"]
+
+
+def test_snapshot_clone(tmp_path, generate_workflow):
+    # make a git repo from the fuzzing config
+    repo = generate_workflow.fuzzing_config_dir
+    for cmd in (
+        ["git", "init", "-q"],
+        ["git", "add", "."],
+        ["git", "-c", "user.name=a", "-c", "user.email=a@b", "commit", "-qm", "a"],
+    ):
+        subprocess.check_call(cmd, cwd=str(repo))
+    revision = (
+        subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(repo))
+        .decode()
+        .strip()
+    )
+    config = {
+        "fuzzing_config": {"url": str(repo), "revision": revision},
+        "snapshot_dir": str(tmp_path / "snapshots"),
+    }
+
+    # snapshots are only written when asked for (eg. not by fuzzing-pool-launch)
+    workflow = Workflow()
+    workflow.clone_fuzzing_config(config)
+    assert workflow.fuzzing_config_revision == revision
+    assert not (tmp_path / "snapshots" / f"{revision}.json").exists()
+
+    # the decision writes the snapshot after cloning
+    workflow = Workflow()
+    workflow.clone_fuzzing_config(config, write_snapshot=True)
+    assert (tmp_path / "snapshots" / f"{revision}.json").is_file()
+
+    # then the snapshot is used instead of cloning
+    workflow = Workflow()
+    with patch.object(Workflow, "git_clone") as git_clone:
+        workflow.clone_fuzzing_config(config)
+        git_clone.assert_not_called()
+    assert not workflow.fuzzing_config_dir.exists()
+    pool_files = workflow.resolver.glob(workflow.fuzzing_config_dir, "pool*.yml")
+    assert [path.name for path in pool_files] == [f"pool{i}.yml" for i in range(4)]
+    params_path = tmp_path / "launch-params.json"
+    # dry runs don't look up preprocess tasks to reuse in the index
+    with patch.object(PoolConfiguration, "find_preprocess") as find_preprocess:
+        workflow.build_tasks(
+            "pool2", "someTaskId", config, dry_run=True, launch_params=params_path
+        )
+        find_preprocess.assert_not_called()
+    params = json.loads(params_path.read_text())
+    assert params["revision"] == revision
+    assert set(params["pools"]) == {"pool2"}
+    assert set(params["pools"]["pool2"]) == {
+        "command",
+        "cores_per_task",
+        "cpu_affinity",
+        "macros",
+        "memory_limit",
+        "numa_node",
+    }
+
+
+@pytest.fixture
+def git_remote(tmp_path):
+    """Git repository with two commits"""
+    repo = tmp_path / "remote"
+    repo.mkdir()
+    revisions = []
+    for i in range(2):
+        (repo / "file.txt").write_text(f"{i}")
+        for cmd in (
+            ["git", "init", "-q"],
+            ["git", "add", "."],
+            ["git", "-c", "user.name=a", "-c", "user.email=a@b", "commit", "-qm", "a"],
+        ):
+            subprocess.check_call(cmd, cwd=str(repo))
+        revisions.append(
+            subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(repo))
+            .decode()
+            .strip()
+        )
+    return repo, revisions
+
+
+def test_git_clone_shallow(git_remote):
+    repo, revisions = git_remote
+    workflow = Workflow()
+    path = workflow.git_clone(url=f"file://{repo}", revision=revisions[0])
+    assert (path / "file.txt").read_text() == "0"
+    cmd = ["git", "rev-list", "--count", "HEAD"]
+    assert subprocess.check_output(cmd, cwd=str(path)).strip() == b"1"
+
+    path = workflow.git_clone(url=f"file://{repo}")
+    assert (path / "file.txt").read_text() == "1"
+
+
+def test_git_clone_cache(tmp_path, git_remote):
+    repo, revisions = git_remote
+    cache_dir = tmp_path / "cache"
+    workflow = Workflow()
+    path = workflow.git_clone(
+        url=f"file://{repo}", revision=revisions[0], cache_dir=str(cache_dir)
+    )
+    assert (path / "file.txt").read_text() == "0"
+    (mirror,) = cache_dir.glob("*.git")
+    # automatic garbage collection isn't detached from the lock
+    cmd = ["git", "config", "gc.autoDetach"]
+    assert subprocess.check_output(cmd, cwd=str(mirror)).strip() == b"false"
+
+    # known commits are cloned from the mirror, without fetching the remote
+    shutil.rmtree(str(repo))
+    with patch(
+        "fuzzing_decision.common.workflow.subprocess.call", wraps=subprocess.call
+    ) as call:
+        path = workflow.git_clone(
+            url=f"file://{repo}",
+            revision=revisions[1],
+            cache_dir=str(cache_dir),
+            deadline=time.monotonic() + 60,
+        )
+    assert (path / "file.txt").read_text() == "1"
+    # the mirror lookup is bound by the deadline
+    assert 0 < call.call_args[1]["timeout"] <= 60
+
+
+def test_git_clone_cache_locked(tmp_path, git_remote):
+    fcntl = pytest.importorskip("fcntl")
+    repo, revisions = git_remote
+    cache_dir = tmp_path / "cache"
+    workflow = Workflow()
+    workflow.git_clone(url=f"file://{repo}", cache_dir=str(cache_dir))
+
+    # another process holds the lock of the mirror
+    (lock_path,) = cache_dir.glob("*.lock")
+    clones = set(pathlib.Path(tempfile.gettempdir()).glob("*remote"))
+    with lock_path.open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with pytest.raises(TimeoutError):
+            workflow.git_clone(
+                url=f"file://{repo}",
+                revision=revisions[1],
+                cache_dir=str(cache_dir),
+                deadline=time.monotonic() + 0.2,
+            )
+    # the directory of the failed clone is removed
+    assert set(pathlib.Path(tempfile.gettempdir()).glob("*remote")) == clones
+
+
+@pytest.mark.parametrize(
+    "fuzzing, community, timeout, error",
+    [
+        ("remote", "remote", 60, None),
+        ("remote", "missing", 60, "community_config"),
+        ("missing", "remote", 60, "fuzzing_config"),
+        ("remote", "remote", 0, "fuzzing_config, community_config"),
+    ],
+)
+def test_clone(tmp_path, git_remote, fuzzing, community, timeout, error):
+    repo, revisions = git_remote
+    config = {
+        "fuzzing_config": {
+            "url": f"file://{tmp_path / fuzzing}",
+            "revision": revisions[0],
+        },
+        "community_config": {"url": f"file://{tmp_path / community}"},
+    }
+    workflow = Workflow()
+    with patch("fuzzing_decision.decision.workflow.CLONE_TIMEOUT", timeout):
+        if error is not None:
+            with pytest.raises(RuntimeError, match=rf"Failed to clone {error}$"):
+                workflow.clone(config)
+            # successful clones are still removed by cleanup()
+            if "community_config" not in error:
+                assert (workflow.community_config_dir / "file.txt").is_file()
+            return
+        workflow.clone(config)
+    assert (workflow.fuzzing_config_dir / "file.txt").read_text() == "0"
+    assert (workflow.community_config_dir / "file.txt").read_text() == "1"
+    assert workflow.fuzzing_config_revision == revisions[0]
+
+
+@patch("fuzzing_decision.decision.cli.Workflow", autospec=True)
+def test_cli_launch_params(mock_workflow, tmp_path):
+    """the launch parameters are written before the workflow runs, so the artifact
+    exists even if it fails"""
+    launch_params = tmp_path / "launch-params.json"
+    mock_workflow.return_value.clone.side_effect = RuntimeError("Failed to clone")
+    with pytest.raises(RuntimeError, match=r"Failed to clone"):
+        main(
+            ["pool-A", "--task-id", "someTaskId", "--launch-params", str(launch_params)]
+        )
+    assert json.loads(launch_params.read_text()) == {"pools": {}, "preprocess": {}}
+    mock_workflow.return_value.build_tasks.assert_not_called()